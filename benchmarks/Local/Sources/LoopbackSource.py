@@ -0,0 +1,30 @@
+from typing import Any, Dict
+
+from pybehave.Components.Component import Component
+from pybehave.Sources.Source import Source
+
+
+class LoopbackSource(Source):
+    """
+    Source that echoes every value written to an output back to the task as the new value of the input registered for
+    the same chamber.
+
+    Parameters
+    ----------
+    echo : bool
+        False to only accept writes without echoing them
+    """
+
+    def __init__(self, echo: bool = True):
+        super(LoopbackSource, self).__init__()
+        self.echo = echo
+        self.inputs = {}
+
+    def register_component(self, component: Component, metadata: Dict) -> None:
+        if component.get_type() == Component.Type.DIGITAL_INPUT:
+            self.inputs[metadata["chamber"]] = component.id
+
+    def write_component(self, component_id: str, msg: Any) -> None:
+        chamber = self.component_chambers[component_id]
+        if self.echo and chamber in self.inputs:
+            self.update_component(self.inputs[chamber], msg)
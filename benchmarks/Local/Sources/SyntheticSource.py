@@ -0,0 +1,47 @@
+import threading
+import time
+
+from pybehave.Sources.ThreadSource import ThreadSource
+
+
+class SyntheticSource(ThreadSource):
+    """
+    Source that toggles every registered input at a fixed rate.
+
+    Parameters
+    ----------
+    rate : float
+        Updates per second sent for each input (0 to send as fast as possible, None to disable)
+    batch_size : int
+        Number of updates coalesced into a single frame
+    """
+
+    def __init__(self, rate: float = None, batch_size: int = 1):
+        super(SyntheticSource, self).__init__()
+        self.rate = rate
+        self.batch_size = batch_size
+        self.close_event = None
+
+    def initialize(self):
+        self.close_event = threading.Event()
+        if self.rate is None:
+            self.close_event.wait()
+            return
+        period = 1 / self.rate if self.rate > 0 else 0
+        next_tick = time.perf_counter()
+        value = False
+        while not self.close_event.is_set():
+            value = not value
+            for cid in list(self.components):
+                self.update_component(cid, value)
+            self.flush_updates()
+            if period > 0:
+                next_tick += period
+                remaining = next_tick - time.perf_counter()
+                if remaining > 0:
+                    time.sleep(remaining)
+            elif len(self.components) == 0:
+                time.sleep(0.001)
+
+    def close_source(self):
+        self.close_event.set()
@@ -0,0 +1,49 @@
+from enum import Enum
+import time
+
+from pybehave.Components.BinaryInput import BinaryInput
+from pybehave.Components.Toggle import Toggle
+from pybehave.Events import PybEvents
+from pybehave.Tasks.Task import Task
+
+
+class BenchmarkTask(Task):
+    """
+    Task used by the benchmark suite.
+
+    Outputs mirror the trigger input so a LoopbackSource keeps a closed loop running between the task and the Source.
+    Changes to the signal input are only logged. A timeout is restarted every timeout_period seconds and the lateness of
+    each TimeoutEvent is reported in microseconds with an InfoEvent.
+    """
+
+    class States(Enum):
+        RUN = 0
+
+    @staticmethod
+    def get_components():
+        return {
+            'signal': [BinaryInput],
+            'trigger': [BinaryInput],
+            'output': [Toggle]
+        }
+
+    @staticmethod
+    def get_constants():
+        return {
+            'timeout_period': 0.01
+        }
+
+    def init_state(self):
+        return self.States.RUN
+
+    def start(self):
+        self.set_timeout("tick", self.timeout_period, end_with_state=False)
+        self.output.toggle(True)
+
+    def RUN(self, event: PybEvents.PybEvent):
+        if isinstance(event, PybEvents.ComponentChangedEvent) and event.comp is self.trigger:
+            self.output.toggle(not self.trigger.state)
+        elif isinstance(event, PybEvents.TimeoutEvent) and event.name == "tick":
+            lateness = time.perf_counter() - event.scheduled
+            self.log_event(PybEvents.InfoEvent(self.metadata["chamber"], "timeout_lateness", round(lateness * 1e6)))
+            self.set_timeout("tick", self.timeout_period - lateness, end_with_state=False)
@@ -0,0 +1,77 @@
+"""
+Compares encode/decode time of NumPy payloads in PybEvents using the current array wire format against the previous
+nested msgpack representation.
+
+Payloads are float64 waveforms of 1-100 MB and 1080p RGB video frames wrapped in a ComponentUpdateEvent.
+
+Usage: python benchmarks/numpy_codec.py [--repeats N]
+"""
+import argparse
+import os
+import sys
+import time
+from typing import Any
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import msgspec
+import numpy as np
+
+from pybehave.Events import PybEvents
+
+
+class LegacyArray(msgspec.Struct, gc=False, array_like=True):
+    dtype: str
+    shape: tuple
+    data: bytes
+
+
+legacy_encoder = msgspec.msgpack.Encoder()
+legacy_decoder = msgspec.msgpack.Decoder(type=LegacyArray)
+
+
+def legacy_enc_hook(obj: Any) -> Any:
+    return msgspec.msgpack.Ext(1, legacy_encoder.encode(LegacyArray(dtype=obj.dtype.str, shape=obj.shape, data=obj.data)))
+
+
+def legacy_ext_hook(code: int, data: memoryview) -> Any:
+    rep = legacy_decoder.decode(data)
+    return np.frombuffer(rep.data, dtype=rep.dtype).reshape(rep.shape)
+
+
+def time_codec(arr: np.ndarray, enc_hook, ext_hook, repeats: int) -> tuple:
+    encoder = msgspec.msgpack.Encoder(enc_hook=enc_hook)
+    decoder = PybEvents.EventDecoder(many=True, ext_hook=ext_hook)
+    events = [PybEvents.ComponentUpdateEvent(0, "waveform-0-0", arr)]
+    enc = dec = 0
+    for _ in range(repeats):
+        t = time.perf_counter()
+        data = encoder.encode(events)
+        enc += time.perf_counter() - t
+        t = time.perf_counter()
+        decoded = decoder.decode(data)
+        dec += time.perf_counter() - t
+        assert decoded[0].value.shape == arr.shape
+    return enc / repeats, dec / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NumPy payload codec benchmark")
+    parser.add_argument("--repeats", type=int, default=10)
+    args = parser.parse_args()
+
+    payloads = [("waveform 1 MB", np.random.rand(131072)),
+                ("waveform 10 MB", np.random.rand(2, 655360)),
+                ("waveform 100 MB", np.random.rand(2, 6553600)),
+                ("frame 1080p", np.random.randint(0, 255, (1080, 1920, 3), dtype=np.uint8))]
+
+    print("{:>16} {:>14} {:>14} {:>14} {:>14}".format("payload", "legacy enc ms", "legacy dec ms", "enc ms", "dec ms"))
+    for name, arr in payloads:
+        legacy = time_codec(arr, legacy_enc_hook, legacy_ext_hook, args.repeats)
+        current = time_codec(arr, PybEvents.enc_hook, PybEvents.ext_hook, args.repeats)
+        print("{:>16} {:>14.3f} {:>14.3f} {:>14.3f} {:>14.3f}".format(name, legacy[0] * 1e3, legacy[1] * 1e3,
+                                                                     current[0] * 1e3, current[1] * 1e3))
+
+
+if __name__ == '__main__':
+    main()
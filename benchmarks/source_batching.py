@@ -0,0 +1,70 @@
+"""
+Measures ComponentUpdateEvent throughput from a Source process to the task process for different batch sizes.
+
+A child process encodes updates and sends them over a multiprocessing Pipe either one event per frame or as list frames
+of the requested size. The parent decodes frames the same way TaskProcess does and reports the sustained event rate.
+
+Usage: python benchmarks/source_batching.py [--events N] [--batches 1 8 64 ...]
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import msgspec
+
+from pybehave.Events import PybEvents
+
+
+def produce(conn, n_events: int, batch_size: int):
+    encoder = msgspec.msgpack.Encoder(enc_hook=PybEvents.enc_hook)
+    batch = []
+    for i in range(n_events):
+        event = PybEvents.ComponentUpdateEvent(0, "ain-0-0", i & 0x3FF)
+        if batch_size <= 1:
+            conn.send_bytes(encoder.encode(event))
+        else:
+            batch.append(event)
+            if len(batch) >= batch_size:
+                conn.send_bytes(encoder.encode(batch))
+                batch = []
+    if len(batch) > 0:
+        conn.send_bytes(encoder.encode(batch))
+
+
+def throughput(n_events: int, batch_size: int) -> float:
+    decoder = PybEvents.EventDecoder()
+    list_decoder = PybEvents.EventDecoder(many=True)
+    reader, writer = multiprocessing.Pipe(False)
+    p = multiprocessing.Process(target=produce, args=(writer, n_events, batch_size))
+    start = time.perf_counter()
+    p.start()
+    received = 0
+    while received < n_events:
+        data = reader.recv_bytes()
+        if PybEvents.is_event_list(data):
+            received += len(list_decoder.decode(data))
+        else:
+            decoder.decode(data)
+            received += 1
+    elapsed = time.perf_counter() - start
+    p.join()
+    return n_events / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Source to TaskProcess batching throughput benchmark")
+    parser.add_argument("--events", type=int, default=200000)
+    parser.add_argument("--batches", type=int, nargs="+", default=[1, 8, 64, 256])
+    args = parser.parse_args()
+
+    print("{:>8} {:>16}".format("batch", "events/s"))
+    for b in args.batches:
+        print("{:>8} {:>16.0f}".format(b, throughput(args.events, b)))
+
+
+if __name__ == '__main__':
+    main()
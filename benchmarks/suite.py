@@ -0,0 +1,265 @@
+"""
+Benchmark suite running a headless TaskProcess with synthetic Sources.
+
+Every scenario adds a BenchmarkTask (benchmarks/Local/Tasks) to each chamber, runs it for a fixed duration and observes
+the events the TaskProcess forwards to the GUI pipe:
+
+    throughput      a SyntheticSource toggles an input in every chamber as fast as possible
+    throughput_csv  the same with a CSVEventLogger attached to every chamber
+    loopback        a LoopbackSource echoes every output back as an input to keep a closed loop running in each
+                    chamber with end-to-end latency tracing enabled
+    idle            no inputs so only the timeouts run
+
+Timeout jitter is measured in every scenario. Results are written to JSON and can be compared to a previous run to flag
+regressions.
+
+Usage: python benchmarks/suite.py [--chambers 1 4 16 64] [--duration S] [--output results.json]
+                                  [--baseline previous.json] [--tolerance 0.2] [--timeout-precision S]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+sys.path.insert(0, BENCHMARK_DIR)
+
+import msgspec
+import numpy as np
+
+from pybehave.Events import PybEvents
+from pybehave.Tasks.TaskProcess import TaskProcess
+
+from Local.Sources.LoopbackSource import LoopbackSource
+from Local.Sources.SyntheticSource import SyntheticSource
+
+ADDRESS_FILE = """addresses = AddressFile()
+addresses.add_component("signal", "BinaryInput", "synthetic", "signal")
+addresses.add_component("trigger", "BinaryInput", "loopback", "trigger")
+addresses.add_component("output", "Toggle", "loopback", "output")
+"""
+
+SCENARIOS = {
+    "throughput": {"rate": 0, "echo": False, "logger": False, "trace": False},
+    "throughput_csv": {"rate": 0, "echo": False, "logger": True, "trace": False},
+    "loopback": {"rate": None, "echo": True, "logger": False, "trace": True},
+    "idle": {"rate": None, "echo": False, "logger": False, "trace": False}
+}
+
+# Metrics compared against a baseline and whether larger values are better
+REGRESSION_METRICS = {"events_per_s": True, "latency_p99": False, "timeout_jitter_p99": False}
+
+
+class HeadlessSession:
+    """
+    Runs a TaskProcess and its Sources without the Workstation GUI. Events forwarded to the GUI pipe are decoded on a
+    separate thread and passed to on_event.
+    """
+
+    def __init__(self, sources, trace_latency=False, on_event=None, timeout_precision=0):
+        self.sources = sources
+        self.on_event = on_event
+        self.encoder = msgspec.msgpack.Encoder(enc_hook=PybEvents.enc_hook)
+        source_connections = {}
+        for name, source in sources.items():
+            tpq, sourceq = multiprocessing.Pipe()
+            source.sid = name
+            source.queue = sourceq
+            source.trace_latency = trace_latency
+            source_connections[name] = tpq
+        self.gui_queue, gui_out = multiprocessing.Pipe(False)
+        self.mainq, tpq = multiprocessing.Pipe()
+        self.tp = TaskProcess(tpq, gui_out, source_connections, trace_latency=trace_latency,
+                              timeout_precision=timeout_precision)
+        self.gui_thread = threading.Thread(target=self.read_gui)
+
+    def start(self):
+        for source in self.sources.values():
+            source.start()
+        self.tp.start()
+        self.gui_thread.start()
+
+    def send(self, event):
+        self.mainq.send_bytes(self.encoder.encode(event))
+
+    def read_gui(self):
+        decoder = PybEvents.EventDecoder(many=True)
+        while True:
+            for event in decoder.decode(self.gui_queue.recv_bytes()):
+                if self.on_event is not None:
+                    self.on_event(event)
+                if isinstance(event, PybEvents.ExitEvent):
+                    return
+
+    def exit(self):
+        self.send(PybEvents.ExitEvent())
+        self.tp.join()
+        for source in self.sources.values():
+            source.join()
+        self.gui_thread.join()
+
+
+class Observer:
+    """Collects the measurements for a scenario from the events forwarded by the TaskProcess."""
+
+    def __init__(self):
+        self.measuring = False
+        self.inputs = 0
+        self.lateness = []
+        self.latency = None
+        self.initialized = set()
+        self.lock = threading.Condition()
+
+    def __call__(self, event):
+        with self.lock:
+            if isinstance(event, PybEvents.InitEvent):
+                self.initialized.add(event.chamber)
+                self.lock.notify_all()
+            elif isinstance(event, PybEvents.LatencyReportEvent):
+                self.latency = event.report
+                self.lock.notify_all()
+            elif self.measuring:
+                if isinstance(event, PybEvents.ComponentUpdateEvent) and not event.comp_id.startswith("output"):
+                    self.inputs += 1
+                elif isinstance(event, PybEvents.InfoEvent) and event.name == "timeout_lateness":
+                    self.lateness.append(event.value * 1e-6)
+
+
+def percentiles(values):
+    if len(values) == 0:
+        return {"p50": None, "p99": None, "max": None}
+    return {"p50": float(np.percentile(values, 50)), "p99": float(np.percentile(values, 99)), "max": float(np.max(values))}
+
+
+def run_scenario(name, n_chambers, duration, work_dir, timeout_precision=0):
+    config = SCENARIOS[name]
+    address_file = os.path.join(work_dir, "addresses.py")
+    with open(address_file, "w") as f:
+        f.write(ADDRESS_FILE)
+    observer = Observer()
+    session = HeadlessSession({"synthetic": SyntheticSource(config["rate"], batch_size=64),
+                               "loopback": LoopbackSource(config["echo"])}, config["trace"], observer,
+                              timeout_precision)
+    session.start()
+    loggers = "CSVEventLogger((||csv||))" if config["logger"] else ""
+    for chamber in range(n_chambers):
+        metadata = {"chamber": chamber, "subject": "benchmark", "protocol": "", "address_file": address_file}
+        session.send(PybEvents.AddTaskEvent(chamber, "BenchmarkTask", loggers, metadata=metadata))
+        if config["logger"]:
+            output = os.path.join(work_dir, str(chamber)) + os.sep
+            session.send(PybEvents.OutputFileChangedEvent(chamber, output, "benchmark"))
+    with observer.lock:
+        observer.lock.wait_for(lambda: len(observer.initialized) == n_chambers, timeout=30)
+    for chamber in range(n_chambers):
+        session.send(PybEvents.StartEvent(chamber))
+    time.sleep(min(duration / 4, 1))  # Warm up
+    with observer.lock:
+        observer.measuring = True
+    start = time.perf_counter()
+    time.sleep(duration)
+    with observer.lock:
+        observer.measuring = False
+        elapsed = time.perf_counter() - start
+        inputs = observer.inputs
+        lateness = list(observer.lateness)
+    latency = {}
+    if config["trace"]:
+        session.send(PybEvents.LatencyQueryEvent())
+        with observer.lock:
+            observer.lock.wait_for(lambda: observer.latency is not None, timeout=10)
+        totals = [hops["total"] for hops in (observer.latency or {}).values() if "total" in hops]
+        if len(totals) > 0:
+            latency = {"latency_p50": float(np.median([t["p50"] for t in totals])),
+                       "latency_p99": max(t["p99"] for t in totals),
+                       "latency_max": max(t["max"] for t in totals)}
+    for chamber in range(n_chambers):
+        session.send(PybEvents.StopEvent(chamber))
+        session.send(PybEvents.ClearEvent(chamber, True))
+    session.exit()
+    jitter = percentiles(lateness)
+    result = {"scenario": name, "chambers": n_chambers, "duration": elapsed, "events_per_s": inputs / elapsed,
+              "timeout_jitter_p50": jitter["p50"], "timeout_jitter_p99": jitter["p99"],
+              "timeout_jitter_max": jitter["max"]}
+    result.update(latency)
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """Returns a description of every metric that is worse than the baseline by more than the tolerance."""
+    previous = {(r["scenario"], r["chambers"]): r for r in baseline["results"]}
+    regressions = []
+    for r in results:
+        b = previous.get((r["scenario"], r["chambers"]))
+        if b is None:
+            continue
+        for metric, higher_is_better in REGRESSION_METRICS.items():
+            if r.get(metric) is None or b.get(metric) is None or b[metric] == 0:
+                continue
+            change = (r[metric] - b[metric]) / b[metric]
+            if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+                regressions.append("{} with {} chambers: {} changed from {:.6g} to {:.6g} ({:+.0%})".format(
+                    r["scenario"], r["chambers"], metric, b[metric], r[metric], change))
+    return regressions
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=BENCHMARK_DIR, capture_output=True,
+                                text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {"python": platform.python_version(), "platform": platform.platform(), "processor": platform.processor(),
+            "cpu_count": os.cpu_count(), "msgspec": msgspec.__version__, "commit": commit,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless TaskProcess benchmark suite")
+    parser.add_argument("--chambers", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument("--duration", type=float, default=3)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--timeout-precision", type=float, default=0)
+    args = parser.parse_args()
+
+    results = []
+    print("{:>16} {:>9} {:>12} {:>14} {:>14} {:>14}".format("scenario", "chambers", "events/s", "jitter p99 ms",
+                                                             "latency p50 ms", "latency p99 ms"))
+    for n_chambers in args.chambers:
+        for name in args.scenarios:
+            work_dir = tempfile.mkdtemp(prefix="pybehave-benchmark-")
+            try:
+                r = run_scenario(name, n_chambers, args.duration, work_dir, args.timeout_precision)
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+            results.append(r)
+            ms = lambda v: "-" if v is None else "{:.3f}".format(v * 1e3)
+            print("{:>16} {:>9} {:>12.0f} {:>14} {:>14} {:>14}".format(name, n_chambers, r["events_per_s"],
+                                                                     ms(r["timeout_jitter_p99"]),
+                                                                     ms(r.get("latency_p50")),
+                                                                     ms(r.get("latency_p99"))))
+
+    with open(args.output, "w") as f:
+        json.dump({"environment": environment(), "results": results}, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for r in regressions:
+            print("REGRESSION: " + r)
+        if len(regressions) > 0:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
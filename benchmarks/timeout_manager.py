@@ -0,0 +1,110 @@
+"""
+Measures how the cost of a TimeoutManager wakeup scales with the number of active Timeouts.
+
+For each population size a set of long-running background Timeouts is registered and a burst of add/cancel requests is
+pushed through the manager. The time until a final zero-duration Timeout fires divided by the number of requests gives
+the average cost of handling a single wakeup. The lateness of periodic Timeouts is then compared with and without
+early wakeup and spinning before each deadline.
+
+Usage: python benchmarks/timeout_manager.py [--requests N] [--sizes 1 10 100 ...] [--precision S]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pybehave.Tasks.TimeoutManager import Timeout, TimeoutManager
+
+
+def noop():
+    pass
+
+
+def wakeup_cost(n_active: int, n_requests: int) -> float:
+    tm = TimeoutManager()
+    tm.start()
+    for i in range(n_active):
+        tm.add_timeout(Timeout("background{}".format(i), i % 16, 1000 + i, noop, ()))
+    done = threading.Event()
+    settle = threading.Event()
+    tm.add_timeout(Timeout("settle", -1, 0, settle.set, ()))
+    settle.wait()
+
+    start = time.perf_counter()
+    for i in range(n_requests):
+        # Interleave requests with the manager thread so each one produces its own wakeup
+        tm.add_timeout(Timeout("burst", -1, 1000, noop, ()))
+        tm.cancel_timeout("-1/burst")
+        if i % 64 == 0:
+            time.sleep(0)
+    tm.add_timeout(Timeout("done", -1, 0, done.set, ()))
+    done.wait()
+    elapsed = time.perf_counter() - start
+
+    tm.quit()
+    tm.join()
+    return elapsed / (2 * n_requests + 1)
+
+
+def fire_order(n_active: int) -> bool:
+    tm = TimeoutManager()
+    fired = []
+    done = threading.Event()
+    durations = [((i * 7919) % n_active) / n_active * 0.05 for i in range(n_active)]
+    for i, d in enumerate(durations):
+        timeout = Timeout(str(i), 0, d, lambda t: fired.append(t.deadline()), ())
+        timeout.args = (timeout,)
+        tm.add_timeout(timeout)
+    tm.add_timeout(Timeout("done", 1, 0.1, done.set, ()))
+    tm.start()
+    done.wait()
+    tm.quit()
+    tm.join()
+    return fired == sorted(fired)
+
+
+def lateness(precision: float, n: int = 500, period: float = 0.002):
+    tm = TimeoutManager(precision)
+    tm.start()
+    late = []
+    done = threading.Event()
+
+    def fire(timeout):
+        late.append(timeout.fired - timeout.scheduled)
+        if len(late) < n:
+            tm.reset_timeout(timeout)
+        else:
+            done.set()
+
+    timeout = Timeout("periodic", 0, period, fire, ())
+    timeout.args = (timeout,)
+    tm.add_timeout(timeout)
+    done.wait()
+    tm.quit()
+    tm.join()
+    late.sort()
+    return late[len(late) // 2], late[int(len(late) * 0.99)], late[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TimeoutManager wakeup scaling benchmark")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100, 1000, 10000, 100000])
+    parser.add_argument("--precision", type=float, default=0.0005)
+    args = parser.parse_args()
+
+    print("{:>10} {:>16}".format("timeouts", "us/wakeup"))
+    for n in args.sizes:
+        print("{:>10} {:>16.2f}".format(n, wakeup_cost(n, args.requests) * 1e6))
+    print("Fired in deadline order: {}".format(fire_order(1000)))
+    print("{:>10} {:>12} {:>12} {:>12}".format("precision", "p50 us", "p99 us", "max us"))
+    for precision in (0, args.precision):
+        p50, p99, worst = lateness(precision)
+        print("{:>10} {:>12.1f} {:>12.1f} {:>12.1f}".format(precision, p50 * 1e6, p99 * 1e6, worst * 1e6))
+
+
+if __name__ == '__main__':
+    main()
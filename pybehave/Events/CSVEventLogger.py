@@ -9,30 +9,67 @@ if TYPE_CHECKING:
 import time
 import math
 
-from pybehave.Events.FileEventLogger import FileEventLogger
+from pybehave.Events.FileEventLogger import FileEventLogger, SegmentFooter
+
+CSV_VERSION = 2  # Files without a Version row are version 1 with metadata saved in the repr format
+FOOTER_MARKER = "SegmentFooter"
+# The checksum is the CRC32 of the UTF-8 encoded contents of the segment before the footer
+FOOTER_FORMAT = "\n" + FOOTER_MARKER + "\nSegment,{}\nRows,{}\nFirstTrial,{}\nLastTrial,{}\nFirstTime,{}\nLastTime,{}\nNext,{}\nChecksum,{:08x}\n"
 
 
 class CSVEventLogger(FileEventLogger):
+    """
+    FileEventLogger that saves events to a CSV file. Metadata is saved in the format named by metadata_format. Long
+    sessions can be split into segments of at most segment_mb megabytes or segment_hours hours of the session (0 for no
+    limit). Each segment is a complete CSV file with its own header followed by a footer summarizing its events.
+    Parameters can be provided in the logger configuration (e.g. CSVEventLogger((||csv||||msgpack||||100||||24||))).
+    """
+
+    def __init__(self, name: str, metadata_format: str = "json", segment_mb: str = "0", segment_hours: str = "0"):
+        super().__init__(name)
+        self.set_metadata_format(metadata_format)
+        if float(segment_mb) > 0:
+            self.segment_bytes = int(float(segment_mb) * 1e6)
+        if float(segment_hours) > 0:
+            self.segment_interval = float(segment_hours) * 3600
+        self.header = None
 
     def get_file_path(self) -> str:
         return "{}{}.csv".format(self.output_folder, math.floor(time.time() * 1000))
 
     def start(self) -> None:
         super().start()
-        self.log_file.write("Subject,{}".format(self.task.metadata["subject"])+"\n")
-        self.log_file.write("Task,{}".format(type(self.task).__name__)+"\n")
-        self.log_file.write("Chamber,{}".format(self.task.metadata["chamber"] + 1)+"\n")
-        self.log_file.write("Protocol,{}".format(self.task.metadata["protocol"])+"\n")
-        self.log_file.write("AddressFile,{}".format(self.task.metadata["address_file"])+"\n")
+        # The header is saved when the session starts so every segment repeats the same values
+        header = ["Subject,{}\n".format(self.task.metadata["subject"]),
+                  "Task,{}\n".format(type(self.task).__name__),
+                  "Chamber,{}\n".format(self.task.metadata["chamber"] + 1),
+                  "Protocol,{}\n".format(self.task.metadata["protocol"]),
+                  "AddressFile,{}\n".format(self.task.metadata["address_file"])]
         if len(self.task.initial_constants) > 0:
-            self.log_file.write("SubjectConfiguration\n")
+            header.append("SubjectConfiguration\n")
             for key, value in self.task.initial_constants.items():
-                self.log_file.write("{},\"{}\"\n".format(key, getattr(self.task, key)))
-        self.log_file.write("\n")
-        self.log_file.write("Trial,Time,Type,Code,State,Metadata\n")
+                header.append("{},\"{}\"\n".format(key, getattr(self.task, key)))
+        header.append("\n")
+        header.append("Trial,Time,Type,Code,State,Metadata\n")
+        self.header = "".join(header)
+        self.write_header()
+
+    def write_header(self) -> None:
+        version = "Version,{}\nMetadataFormat,{}\n".format(CSV_VERSION, self.metadata_format)
+        if self.segmented():
+            version += "Segment,{}\n".format(self.segment)
+        self.log_file.write(version + self.header)
+
+    def format_footer(self, footer: SegmentFooter, checksum: int) -> str:
+        return FOOTER_FORMAT.format(footer.segment, footer.rows, footer.first_trial, footer.last_trial,
+                                    "" if footer.first_time is None else footer.first_time,
+                                    "" if footer.last_time is None else footer.last_time, footer.next, checksum)
 
     def log_events(self, le: collections.deque[LoggerEvent]) -> None:
+        super().log_events(le)
+        lines = []
         for event in le:
             self.event_count += 1
-            self.log_file.write(self.format_event(event, type(event.event).__name__))
-        super().log_events(le)
+            lines.append(self.format_event(event, type(event.event).__name__))
+        if len(lines) > 0:
+            self.log_file.write("".join(lines))
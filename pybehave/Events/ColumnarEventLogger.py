@@ -0,0 +1,264 @@
+from __future__ import annotations
+
+import collections
+import math
+import struct
+import time
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+if TYPE_CHECKING:
+    from pybehave.Events.LoggerEvent import LoggerEvent
+
+import msgspec
+import numpy as np
+
+from pybehave.Events.FileEventLogger import FileEventLogger
+from pybehave.Events.MetadataSerializer import encode_unsupported
+
+MAGIC = b"PYBC"
+VERSION = 1
+FRAME_HEADER = struct.Struct('<I')  # Every frame is prefixed with the length of its msgpack encoded contents
+
+
+class SessionHeader(msgspec.Struct):
+    """First frame of a columnar log with the same information as the CSV header."""
+    version: int
+    subject: str
+    task: str
+    chamber: int
+    protocol: str
+    address_file: str
+    constants: Dict[str, str] = {}
+
+
+class RecordBatch(msgspec.Struct, array_like=True):
+    """
+    Events stored as little-endian columns.
+
+    Event types and names are dictionary encoded. Entries added to the dictionaries by this batch are listed in
+    new_types and new_names. Codes are stored as int64 unless a batch contains codes that are not integers, in which
+    case they are kept as a list in code_values.
+    """
+    rows: int
+    new_types: List[str]
+    new_names: List[str]
+    trial: bytes
+    time: bytes
+    type: bytes
+    name: bytes
+    code: Optional[bytes]
+    code_values: Optional[List[Any]]
+    metadata: bytes
+
+
+class ColumnarEventLogger(FileEventLogger):
+    """
+    FileEventLogger that saves events as typed binary columns rather than text. Events are buffered and appended as
+    record batches holding the trial, time (float64), dictionary encoded type and state name, code, and msgpack
+    encoded metadata for every event. A batch is written once batch_size events are buffered, batch_interval
+    seconds after the first buffered event (checked by the TaskProcess even if no further events arrive), or when the
+    task stops. Files can be loaded into NumPy arrays with
+    read_columnar_session without any text parsing. Segmented sessions save a complete file for each segment.
+    """
+    file_mode = "wb"
+    batch_size = 256  # Events buffered before a batch is written
+    batch_interval = 1.0  # Maximum seconds events are buffered before a batch is written
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.types = {}
+        self.names = {}
+        self.pending = []
+        self.pending_since = 0
+        self.header = None
+        self.encoder = msgspec.msgpack.Encoder(enc_hook=encode_unsupported)
+
+    def get_file_path(self) -> str:
+        return "{}{}.pybc".format(self.output_folder, math.floor(time.time() * 1000))
+
+    def start(self) -> None:
+        super().start()
+        self.pending = []
+        constants = {key: str(getattr(self.task, key)) for key in self.task.initial_constants}
+        self.header = SessionHeader(VERSION, self.task.metadata["subject"], type(self.task).__name__,
+                                    self.task.metadata["chamber"] + 1, self.task.metadata["protocol"],
+                                    self.task.metadata["address_file"], constants)
+        self.write_header()
+
+    def write_header(self) -> None:
+        # Every segment has its own dictionaries so it can be read on its own
+        self.types = {}
+        self.names = {}
+        self.log_file.write(MAGIC)
+        self.write_frame(self.header)
+
+    def rotate(self) -> None:
+        self.write_batch()
+        super().rotate()
+
+    def write_frame(self, obj: msgspec.Struct) -> None:
+        data = self.encoder.encode(obj)
+        self.log_file.write(FRAME_HEADER.pack(len(data)) + data)
+
+    def log_events(self, le: collections.deque[LoggerEvent]) -> None:
+        if len(le) == 0:
+            return
+        super().log_events(le)
+        if len(self.pending) == 0:
+            self.pending_since = time.perf_counter()
+        self.pending.extend(le)
+        if len(self.pending) >= self.batch_size:
+            self.write_batch()
+        else:
+            self.flush()
+
+    def flush(self) -> None:
+        if len(self.pending) > 0 and time.perf_counter() - self.pending_since >= self.batch_interval:
+            self.write_batch()
+
+    def write_batch(self) -> None:
+        rows = len(self.pending)
+        if rows == 0:
+            return
+        new_types = []
+        new_names = []
+        types = np.empty(rows, dtype='<u2')
+        names = np.empty(rows, dtype='<u4')
+        times = np.empty(rows, dtype='<f8')
+        codes = []
+        metadata = []
+        for i, event in enumerate(self.pending):
+            event_type = type(event.event).__name__
+            tid = self.types.get(event_type)
+            if tid is None:
+                tid = self.types[event_type] = len(self.types)
+                new_types.append(event_type)
+            nid = self.names.get(event.name)
+            if nid is None:
+                nid = self.names[event.name] = len(self.names)
+                new_names.append(event.name)
+            types[i] = tid
+            names[i] = nid
+            times[i] = event.entry_time
+            codes.append(event.eid)
+            metadata.append(event.event.metadata)
+        self.pending = []
+        if all(type(code) is int or type(code) is bool for code in codes):
+            code, code_values = np.array(codes, dtype='<i8').tobytes(), None
+        else:
+            code, code_values = None, codes
+        trials = np.arange(self.event_count + 1, self.event_count + rows + 1, dtype='<i8')
+        self.event_count += rows
+        self.write_frame(RecordBatch(rows, new_types, new_names, trials.tobytes(), times.tobytes(), types.tobytes(),
+                                     names.tobytes(), code, code_values, self.encoder.encode(metadata)))
+
+    def stop(self) -> None:
+        if self.log_file is not None and not self.log_file.closed:
+            self.write_batch()
+        super().stop()
+
+
+class ColumnarSession:
+    """
+    Session loaded from a ColumnarEventLogger file.
+
+    Attributes
+    ----------
+    header : SessionHeader
+        Subject, task, chamber, protocol, address file and constants for the session
+    trial : np.ndarray
+        Index of each event (int64)
+    time : np.ndarray
+        Time of each event in seconds since the task started (float64)
+    type : np.ndarray
+        Index of the type of each event in types (uint16)
+    types : list
+        Event type names
+    name : np.ndarray
+        Index of the state or component name of each event in names (uint32)
+    names : list
+        State and component names
+    code : np.ndarray
+        Code for each event (int64 or object if any codes were not integers)
+    """
+
+    def __init__(self, header: SessionHeader, batches: List[RecordBatch]):
+        self.header = header
+        self.types = []
+        self.names = []
+        for batch in batches:
+            self.types.extend(batch.new_types)
+            self.names.extend(batch.new_names)
+
+        def column(field: str, dtype: str) -> np.ndarray:
+            if len(batches) == 0:
+                return np.empty(0, dtype=dtype)
+            return np.concatenate([np.frombuffer(getattr(batch, field), dtype=dtype) for batch in batches])
+
+        self.trial = column("trial", '<i8')
+        self.time = column("time", '<f8')
+        self.type = column("type", '<u2')
+        self.name = column("name", '<u4')
+        if all(batch.code is not None for batch in batches):
+            self.code = column("code", '<i8')
+        else:
+            self.code = np.empty(len(self.trial), dtype=object)
+            i = 0
+            for batch in batches:
+                values = batch.code_values if batch.code is None else np.frombuffer(batch.code, dtype='<i8')
+                self.code[i:i + batch.rows] = list(values)
+                i += batch.rows
+        self.batch_metadata = [batch.metadata for batch in batches]
+        self.metadata_ = None
+
+    def __len__(self) -> int:
+        return len(self.trial)
+
+    def metadata(self) -> List[Dict]:
+        """Returns the metadata for every event. Metadata is only decoded the first time it is requested."""
+        if self.metadata_ is None:
+            decoder = msgspec.msgpack.Decoder(List[Dict])
+            self.metadata_ = [entry for data in self.batch_metadata for entry in decoder.decode(data)]
+        return self.metadata_
+
+    def type_names(self) -> np.ndarray:
+        return np.array(self.types, dtype=object)[self.type]
+
+    def state_names(self) -> np.ndarray:
+        return np.array(self.names, dtype=object)[self.name]
+
+    def select(self, type: str = None, name: str = None) -> np.ndarray:
+        """Returns the indices of events with the given type and name."""
+        mask = np.ones(len(self), dtype=bool)
+        if type is not None:
+            mask &= self.type == (self.types.index(type) if type in self.types else -1)
+        if name is not None:
+            mask &= self.name == (self.names.index(name) if name in self.names else -1)
+        return np.flatnonzero(mask)
+
+
+def read_columnar_session(path: str) -> ColumnarSession:
+    """Loads a file saved by a ColumnarEventLogger. A partially written final batch (e.g. after a crash) is ignored."""
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError("{} is not a pybehave columnar log".format(path))
+    view = memoryview(data)
+    offset = len(MAGIC)
+    header = None
+    batches = []
+    batch_decoder = msgspec.msgpack.Decoder(RecordBatch)
+    while offset + FRAME_HEADER.size <= len(data):
+        length = FRAME_HEADER.unpack_from(data, offset)[0]
+        offset += FRAME_HEADER.size
+        if offset + length > len(data):
+            break
+        frame = view[offset:offset + length]
+        offset += length
+        if header is None:
+            header = msgspec.msgpack.decode(frame, type=SessionHeader)
+        else:
+            batches.append(batch_decoder.decode(frame))
+    if header is None:
+        raise ValueError("{} does not contain a session header".format(path))
+    return ColumnarSession(header, batches)
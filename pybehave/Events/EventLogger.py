@@ -9,11 +9,14 @@ if TYPE_CHECKING:
 
 from abc import ABCMeta, abstractmethod
 
+from pybehave.Events.MetadataSerializer import create_serializer
+
 
 class EventLogger:
     __metaclass__ = ABCMeta
     """
     Abstract class defining the base requirements for an event logging system. Event loggers parse Event objects.
+    Metadata is converted to text by a serializer for metadata_format that is created once per logger.
 
     Methods
     -------
@@ -23,12 +26,21 @@ class EventLogger:
         Closes the event logger
     log_events(events)
         Handle each event in the input Event list
+    flush()
+        Save any buffered events that are due while the task is running
     """
 
+    metadata_format = "json"  # Name of the MetadataSerializer used by format_event
+
     def __init__(self, name: str):
         self.name = name
         self.task = None
         self.event_count = 0
+        self.serializer = create_serializer(self.metadata_format)
+
+    def set_metadata_format(self, metadata_format: str) -> None:
+        self.metadata_format = metadata_format
+        self.serializer = create_serializer(metadata_format)
 
     def start_(self):
         self.event_count = 0
@@ -47,6 +59,9 @@ class EventLogger:
     def close(self) -> None:
         pass
 
+    def flush(self) -> None:
+        pass
+
     @abstractmethod
     def log_events(self, events: collections.deque[LoggerEvent]) -> None:
         raise NotImplementedError
@@ -55,6 +70,7 @@ class EventLogger:
         self.task = task
 
     def format_event(self, le: LoggerEvent, event_type: str):
+        # Quotes are doubled so metadata remains a single CSV field
         return "{},{},{},{},{},\"{}\"\n".format(self.event_count, le.entry_time, event_type,
                                                 str(le.eid), le.name,
-                                                str(le.event.metadata))
+                                                self.serializer.encode(le.event.metadata).replace('"', '""'))
@@ -2,6 +2,7 @@ from PyQt5.QtCore import pyqtSlot, pyqtSignal
 
 from pybehave.Events import PybEvents
 from pybehave.Events.LoggerEvent import LoggerEvent
+from pybehave.Events.MetadataSerializer import create_serializer
 from pybehave.Events.Widget import Widget
 
 
@@ -11,6 +12,7 @@ class EventWidget(Widget):
     def __init__(self, name: str):
         super(EventWidget, self).__init__(name)
         self.event_count = 0
+        self.serializer = create_serializer("json")
         self.emitter.connect(lambda event: self.handle_event(event))
 
     @pyqtSlot()
@@ -36,4 +38,4 @@ class EventWidget(Widget):
     def format_event(self, le: LoggerEvent, event_type: str):
         return "{},{},{},{},{},\"{}\"".format(self.event_count, le.entry_time, event_type,
                                               str(le.eid), le.name,
-                                              str(le.event.metadata))
+                                              self.serializer.encode(le.event.metadata).replace('"', '""'))
@@ -1,21 +1,45 @@
 from __future__ import annotations
 
 import collections
-from typing import TYPE_CHECKING
+import functools
+import math
+import os
+from typing import TYPE_CHECKING, Any, Dict, Optional, Union
 
 if TYPE_CHECKING:
     from pybehave.Events.LoggerEvent import LoggerEvent
 
 from abc import ABCMeta, abstractmethod
 
+import msgspec
+
 from pybehave.Events.EventLogger import EventLogger
-import os
+from pybehave.Events.LogWriter import LogWriter
+
+
+class SegmentFooter(msgspec.Struct):
+    """Summary of the events in a segment of a session that is saved at the end of the segment."""
+    segment: int
+    rows: int
+    first_trial: int
+    last_trial: int
+    first_time: Optional[float]
+    last_time: Optional[float]
+    next: str  # File name of the following segment (empty for the last segment)
 
 
 class FileEventLogger(EventLogger):
     __metaclass__ = ABCMeta
     """
     Abstract class defining the base requirements for an EventLogger that logs Event objects to a file on disk.
+    The file is written by a LogWriter on a background thread so no file I/O happens in the TaskProcess. Data written
+    to log_file is flushed according to flush_interval and flush_bytes and synced to disk by the writer thread after the
+    task stops.
+
+    If segment_bytes or segment_interval are set, the session is split into segments named with the file path followed by
+    the segment index. A new segment is started once the current one holds segment_bytes of data or events arrive after
+    the end of the current segment_interval of the session. Each segment begins with the header from write_header and
+    ends with the footer from format_footer.
 
     Methods
     -------
@@ -26,29 +50,102 @@ class FileEventLogger(EventLogger):
     log_events(events)
         Handle saving of each Event in the input list to the file
     get_file_path()
-        Returns the 
+        Returns the path of the file
+    write_header()
+        Writes the header at the start of the file or of each segment
+    format_footer(footer, checksum)
+        Returns the footer written at the end of each segment
     """
+    file_mode = "w"  # Mode the log file is opened with ("wb" for binary formats)
+    queue_size = 4096  # Maximum writes waiting for the writer thread before log_events blocks
+    flush_interval = 1.0  # Maximum seconds before written events are flushed (None to only flush by size or on stop)
+    flush_bytes = 65536  # Unflushed data that triggers a flush (None to only flush by time or on stop)
+    fsync_on_stop = True  # True if the file should be synced to disk when the task stops
+    segment_bytes = None  # Size at which a new segment is started (None for no limit)
+    segment_interval = None  # Seconds of the session in each segment (None for no limit)
 
     def __init__(self, name: str):
         super().__init__(name)
         self.output_folder = None
+        self.file_path = None  # Path returned by get_file_path for the current session
         self.log_file = None
+        self.segment = 0
+        self.segment_first_trial = 1
+        self.segment_first_time = None
+        self.segment_last_time = None
+        self.segment_end = None
 
     @abstractmethod
     def get_file_path(self) -> str:
         raise NotImplementedError
 
     @abstractmethod
-    def log_events(self, event: collections.deque[LoggerEvent]) -> None:
-        self.log_file.flush()  # Need a better solution for regular saving
+    def log_events(self, events: collections.deque[LoggerEvent]) -> None:
+        # Flushing is handled by the writer thread so only segments are managed here. Subclasses should call this
+        # before writing the events so a new segment is started before events that are beyond the current one.
+        if not self.segmented() or len(events) == 0:
+            return
+        if self.segment_first_time is not None and \
+                ((self.segment_bytes is not None and self.log_file.size >= self.segment_bytes) or
+                 (self.segment_interval is not None and events[0].entry_time >= self.segment_end)):
+            self.rotate()
+        if self.segment_first_time is None:
+            self.segment_first_time = events[0].entry_time
+            if self.segment_interval is not None:
+                self.segment_end = (math.floor(self.segment_first_time / self.segment_interval) + 1) * self.segment_interval
+        self.segment_last_time = events[-1].entry_time
+
+    def segmented(self) -> bool:
+        return self.segment_bytes is not None or self.segment_interval is not None
+
+    def segment_path(self, segment: int) -> str:
+        stem, ext = os.path.splitext(self.file_path)
+        return "{}_{:04d}{}".format(stem, segment, ext)
+
+    def write_header(self) -> None:
+        pass
+
+    def format_footer(self, footer: SegmentFooter, checksum: int) -> Optional[Union[str, bytes]]:
+        return None
+
+    def segment_footer(self, next_path: str) -> functools.partial:
+        footer = SegmentFooter(self.segment, self.event_count - self.segment_first_trial + 1, self.segment_first_trial,
+                               self.event_count, self.segment_first_time, self.segment_last_time,
+                               os.path.basename(next_path))
+        return functools.partial(self.format_footer, footer)  # Called on the writer thread with the checksum
+
+    def rotate(self) -> None:
+        """Ends the current segment and continues the session in a new one."""
+        next_path = self.segment_path(self.segment + 1)
+        self.log_file.rotate(next_path, self.segment_footer(next_path))
+        self.segment += 1
+        self.segment_first_trial = self.event_count + 1
+        self.segment_first_time = None
+        self.segment_last_time = None
+        self.segment_end = None
+        self.write_header()
+
+    @property
+    def writer_stats(self) -> Optional[Dict[str, Any]]:
+        """Backpressure metrics from the writer for the most recent session once its file has been saved."""
+        if self.log_file is None or not self.log_file.done.is_set():
+            return None
+        return self.log_file.stats()
 
     def start(self) -> None:
-        if not os.path.exists(self.output_folder):
-            os.makedirs(self.output_folder)
         if self.log_file is not None:
-            self.log_file.close()
-        self.log_file = open(self.get_file_path(), "w")
+            self.log_file.close(wait=False)
+        self.file_path = self.get_file_path()
+        self.segment = 0
+        self.segment_first_trial = 1
+        self.segment_first_time = None
+        self.segment_last_time = None
+        self.segment_end = None
+        self.log_file = LogWriter(self.segment_path(0) if self.segmented() else self.file_path, self.file_mode,
+                                  self.queue_size, self.flush_interval, self.flush_bytes, self.fsync_on_stop,
+                                  self.segmented())
 
     def stop(self) -> None:
         if self.log_file is not None and not self.log_file.closed:
-            self.log_file.close()
+            # The writer thread writes the footer and syncs the file so a slow disk never delays the TaskProcess
+            self.log_file.close(self.segment_footer("") if self.segmented() else None, wait=False)
@@ -0,0 +1,225 @@
+from __future__ import annotations
+
+import os
+import queue
+import threading
+import time
+import zlib
+from typing import Any, Callable, Dict, Optional, Union
+
+from pybehave.Utilities.Latency import LatencyHistogram
+
+open_writers = set()  # Writers whose thread has not finished saving their file
+
+
+class SegmentEnd:
+    """Placed on the queue to close the current file once everything before it has been written."""
+
+    def __init__(self, path: Optional[str], footer: Optional[Callable[[int], Union[str, bytes]]]):
+        self.path = path  # Next file to open (None to stop the writer)
+        self.footer = footer  # Returns data written at the end of the file given the checksum of its contents
+
+
+class LogWriter:
+    """
+    File-like object that performs every write to a log file on a dedicated thread so disk latency never reaches the
+    thread logging events. Writes are placed on a bounded queue and the writer thread opens, writes, flushes and closes
+    the file. If the queue is full, write blocks until the writer thread catches up and the wait is recorded in the
+    backpressure metrics. Long sessions can be split across several files with rotate.
+
+    Parameters
+    ----------
+    path : str
+        Path of the file to write (missing folders are created)
+    mode : str
+        Mode the file is opened with
+    queue_size : int
+        Maximum number of writes waiting for the writer thread
+    flush_interval : float
+        Maximum seconds written data waits before the file is flushed (None to only flush by size or on close)
+    flush_bytes : int
+        Amount of unflushed data that triggers a flush (None to only flush by time or on close)
+    fsync : bool
+        True if the file should be synced to disk when it is closed
+    checksum : bool
+        True if a CRC32 checksum of the data in each file should be provided to footers
+
+    Attributes
+    ----------
+    size : int
+        Amount of data written to the current file including writes that have not been saved yet
+    error : OSError
+        Any error raised by the writer thread. It is raised again by the next call to write or close.
+    done : threading.Event
+        Set once the writer thread has closed the last file
+    """
+
+    def __init__(self, path: str, mode: str = "w", queue_size: int = 4096, flush_interval: Optional[float] = 1.0,
+                 flush_bytes: Optional[int] = 65536, fsync: bool = True, checksum: bool = False):
+        self.name = path
+        self.mode = mode
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.fsync = fsync
+        self.checksum = checksum
+        self.crc = 0
+        self.size = 0
+        self.closed = False
+        self.detached = False  # True if close did not wait for the writer thread
+        self.error = None
+        self.queue = queue.Queue(queue_size)
+        # Backpressure metrics
+        self.writes = 0
+        self.bytes_written = 0
+        self.flushes = 0
+        self.high_water = 0  # Largest number of writes waiting for the writer thread
+        self.blocked_writes = 0  # Writes that had to wait for space in the queue
+        self.blocked_time = 0  # Total time spent waiting for space in the queue
+        self.write_times = LatencyHistogram()  # Time taken by each write on the writer thread
+        self.flush_times = LatencyHistogram()  # Time taken by each flush on the writer thread
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="LogWriter", daemon=True)
+        open_writers.add(self)
+        self.thread.start()
+
+    def write(self, data: Union[str, bytes]) -> None:
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+        if self.error is not None:
+            raise self.error
+        try:
+            self.queue.put_nowait(data)
+        except queue.Full:
+            start = time.perf_counter()
+            self.queue.put(data)
+            self.blocked_writes += 1
+            self.blocked_time += time.perf_counter() - start
+        self.writes += 1
+        self.size += len(data)
+        waiting = self.queue.qsize()
+        if waiting > self.high_water:
+            self.high_water = waiting
+
+    def rotate(self, path: str, footer: Callable[[int], Union[str, bytes]] = None) -> None:
+        """
+        Closes the current file once all pending writes are saved and continues writing to path. Does not wait for the
+        writer thread. footer is called on the writer thread with the checksum of the file's contents and returns any
+        data to write before the file is closed.
+        """
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+        self.queue.put(SegmentEnd(path, footer))
+        self.name = path
+        self.size = 0
+
+    def close(self, footer: Callable[[int], Union[str, bytes]] = None, wait: bool = True) -> None:
+        """
+        Closes the file once all pending writes are saved. If wait is False, the writer thread writes the footer, syncs
+        and closes the file without blocking the caller and done is set once it finishes. Errors are then only available
+        from error.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.detached = not wait
+        self.queue.put(SegmentEnd(None, footer))
+        if wait:
+            self.thread.join()
+            if self.error is not None:
+                raise self.error
+
+    def stats(self) -> Dict[str, Any]:
+        return {"writes": self.writes, "bytes": self.bytes_written, "flushes": self.flushes,
+                "high_water": self.high_water, "queue_size": self.queue.maxsize,
+                "blocked_writes": self.blocked_writes, "blocked_time": self.blocked_time,
+                "write_time": self.write_times.summary(), "flush_time": self.flush_times.summary(),
+                "error": None if self.error is None else str(self.error)}
+
+    def open(self, path: str):
+        self.crc = 0
+        try:
+            folder = os.path.dirname(path)
+            if folder and not os.path.exists(folder):
+                os.makedirs(folder)
+            return open(path, self.mode)
+        except OSError as e:
+            self.error = e
+            return None
+
+    def finish(self, log_file, footer: Optional[Callable[[int], Union[str, bytes]]]) -> None:
+        try:
+            if footer is not None:
+                data = footer(self.crc)
+                if data is not None:
+                    log_file.write(data)
+            log_file.flush()
+            if self.fsync:
+                os.fsync(log_file.fileno())
+        except OSError as e:
+            self.error = self.error or e
+        finally:
+            log_file.close()
+
+    def run(self) -> None:
+        try:
+            self.write_files()
+        finally:
+            if self.detached and self.error is not None:
+                # Nobody is waiting to receive the error
+                print("Unable to save {}: {}".format(self.name, self.error))
+            open_writers.discard(self)
+            self.done.set()
+
+    def write_files(self) -> None:
+        log_file = self.open(self.name)
+        unflushed = 0
+        last_flush = time.perf_counter()
+        while True:
+            timeout = None
+            if unflushed > 0 and self.flush_interval is not None:
+                timeout = max(last_flush + self.flush_interval - time.perf_counter(), 0)
+            try:
+                data = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                data = None  # The flush interval elapsed with no new writes
+            if isinstance(data, SegmentEnd):
+                if log_file is not None and self.error is None:
+                    self.finish(log_file, data.footer)
+                elif log_file is not None:
+                    log_file.close()
+                if data.path is None:
+                    break
+                log_file = self.open(data.path) if self.error is None else None
+                unflushed = 0
+                last_flush = time.perf_counter()
+                continue
+            if log_file is None or self.error is not None:
+                continue  # Writes are discarded after an error so write never blocks on a queue that is not emptied
+            try:
+                if data is not None:
+                    start = time.perf_counter()
+                    log_file.write(data)
+                    self.write_times.add(time.perf_counter() - start)
+                    if self.checksum:
+                        self.crc = zlib.crc32(data.encode() if isinstance(data, str) else data, self.crc)
+                    unflushed += len(data)
+                    self.bytes_written += len(data)
+                if unflushed > 0 and (data is None or
+                                      (self.flush_bytes is not None and unflushed >= self.flush_bytes) or
+                                      (self.flush_interval is not None and
+                                       time.perf_counter() - last_flush >= self.flush_interval)):
+                    start = time.perf_counter()
+                    log_file.flush()
+                    last_flush = time.perf_counter()
+                    self.flush_times.add(last_flush - start)
+                    self.flushes += 1
+                    unflushed = 0
+            except OSError as e:
+                self.error = e
+
+
+def wait_for_writers(timeout: float = None) -> None:
+    """Waits for every LogWriter that is still saving its file, for example before the process exits."""
+    deadline = None if timeout is None else time.perf_counter() + timeout
+    for writer in list(open_writers):
+        writer.done.wait(None if deadline is None else max(deadline - time.perf_counter(), 0))
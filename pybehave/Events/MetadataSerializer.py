@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import ast
+import base64
+from typing import Any, Dict
+
+import msgspec
+import numpy as np
+
+
+def encode_unsupported(obj: Any) -> Any:
+    """Converts values msgspec cannot encode natively. NumPy values become lists and scalars, anything else its repr."""
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    elif isinstance(obj, np.generic):
+        return obj.item()
+    return repr(obj)
+
+
+class MetadataSerializer:
+    """
+    Converts event metadata dictionaries to and from the text saved by EventLoggers. Each EventLogger creates its own
+    serializer so encoders are reused for every event it logs.
+
+    Attributes
+    ----------
+    name : str
+        Name recorded in log headers to identify how metadata was encoded
+    """
+    name = None
+
+    def encode(self, metadata: Dict) -> str:
+        raise NotImplementedError
+
+    def decode(self, text: str) -> Dict:
+        raise NotImplementedError
+
+
+class ReprSerializer(MetadataSerializer):
+    """Python representation of the dictionary as saved by versions of pybehave before the metadata format was configurable."""
+    name = "repr"
+
+    def encode(self, metadata: Dict) -> str:
+        return str(metadata)
+
+    def decode(self, text: str) -> Dict:
+        try:
+            return ast.literal_eval(text)
+        except (ValueError, SyntaxError):
+            return {}  # Values like arrays were not saved in a form that can be parsed
+
+
+class JSONSerializer(MetadataSerializer):
+    """JSON encoded with msgspec. Tuples and sets are saved as lists and non-string keys as strings."""
+    name = "json"
+
+    def __init__(self):
+        self.encoder = msgspec.json.Encoder(enc_hook=encode_unsupported)
+        self.decoder = msgspec.json.Decoder(Dict)
+
+    def encode(self, metadata: Dict) -> str:
+        return self.encoder.encode(metadata).decode()
+
+    def decode(self, text: str) -> Dict:
+        return self.decoder.decode(text)
+
+
+class MsgpackSerializer(MetadataSerializer):
+    """Compact binary msgpack encoding saved as base64 text."""
+    name = "msgpack"
+
+    def __init__(self):
+        self.encoder = msgspec.msgpack.Encoder(enc_hook=encode_unsupported)
+        self.decoder = msgspec.msgpack.Decoder(Dict)
+
+    def encode(self, metadata: Dict) -> str:
+        return base64.b64encode(self.encoder.encode(metadata)).decode("ascii")
+
+    def decode(self, text: str) -> Dict:
+        return self.decoder.decode(base64.b64decode(text))
+
+
+SERIALIZERS = {serializer.name: serializer for serializer in (ReprSerializer, JSONSerializer, MsgpackSerializer)}
+
+
+def create_serializer(name: str) -> MetadataSerializer:
+    """Returns a new serializer for the named metadata format."""
+    if name not in SERIALIZERS:
+        raise ValueError("Unknown metadata format '{}'. Expected one of: {}".format(name, ", ".join(SERIALIZERS)))
+    return SERIALIZERS[name]()
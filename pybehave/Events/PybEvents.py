@@ -1,8 +1,9 @@
 from __future__ import annotations
 
 import multiprocessing
-from multiprocessing.connection import PipeConnection
-from typing import Dict, Any
+import struct
+import sys
+from typing import Dict, Any, List
 
 import msgspec
 import typing
@@ -12,38 +13,80 @@ import numpy as np
 from pybehave.Events.LoggerEvent import LoggerEvent
 from pybehave.Components.Component import Component
 
-
-T = typing.TypeVar("T")
-
-
-class NumpySerializedRepresentation(msgspec.Struct, gc=False, array_like=True):
-    dtype: str
-    shape: tuple
-    data: bytes
-
-
-def subclass_union(cls: typing.Type[T]) -> typing.Type[T]:
-    """Returns a Union of all subclasses of `cls` (excluding `cls` itself)"""
-    classes = set()
-
-    def _add(cls):
-        for c in cls.__subclasses__():
-            _add(c)
-        classes.add(cls)
-    for c in cls.__subclasses__():
-        _add(c)
-    return typing.Union[tuple(classes)]
+if sys.platform == 'win32':
+    from multiprocessing.connection import PipeConnection
+else:
+    # Pipes are plain Connections outside of Windows
+    from multiprocessing.connection import Connection as PipeConnection
+
+
+def is_event_list(data: bytes) -> bool:
+    """Returns True if an encoded frame contains a list of events rather than a single event.
+
+    Events are encoded as tagged arrays so both frame types start with an array header. A single event is followed by
+    its tag while a list is followed by the array header of its first event.
+    """
+    header = data[0]
+    if 0x90 <= header <= 0x9f:
+        offset = 1
+    elif header == 0xdc:
+        offset = 3
+    elif header == 0xdd:
+        offset = 5
+    else:
+        return False
+    if offset >= len(data):
+        return True
+    first = data[offset]
+    return 0x90 <= first <= 0x9f or first == 0xdc or first == 0xdd
 
 
 NUMPY_TYPE_CODE = 1
-numpy_array_encoder = msgspec.msgpack.Encoder()
-numpy_array_decoder = msgspec.msgpack.Decoder(type=NumpySerializedRepresentation)
+# Arrays are encoded as a fixed header (dtype code, ndim) followed by the shape and the raw array bytes
+ARRAY_HEADER = struct.Struct('<BB')
+CUSTOM_DTYPE_CODE = 255  # Followed by the length and text of the dtype string
+DTYPE_CODES = ['|b1', '|i1', '|u1', '<i2', '<u2', '<i4', '<u4', '<i8', '<u8', '<f2', '<f4', '<f8', '<c8', '<c16']
+DTYPES = {dtype: code for code, dtype in enumerate(DTYPE_CODES)}
+
+
+def encode_array(obj: np.ndarray) -> msgspec.msgpack.Ext:
+    if not obj.flags.c_contiguous:
+        obj = np.ascontiguousarray(obj)
+    if obj.dtype.hasobject:
+        raise NotImplementedError("Arrays of Python objects are not supported")
+    dtype = obj.dtype.str
+    if dtype in DTYPES:
+        dtype_header = b''
+        code = DTYPES[dtype]
+    else:
+        dtype_header = bytes((len(dtype),)) + dtype.encode('ascii')
+        code = CUSTOM_DTYPE_CODE
+    header = ARRAY_HEADER.pack(code, obj.ndim) + dtype_header + struct.pack('<{}Q'.format(obj.ndim), *obj.shape)
+    # Join copies the array directly after the header without an intermediate bytes object
+    data = obj.reshape(-1).view(np.uint8) if obj.size > 0 else b''
+    return msgspec.msgpack.Ext(NUMPY_TYPE_CODE, b''.join((header, data)))
+
+
+def decode_array(data: memoryview, copy: bool = False) -> np.ndarray:
+    """Returns the array encoded in data as a read-only view over the received buffer or as a writable copy."""
+    code, ndim = ARRAY_HEADER.unpack_from(data, 0)
+    offset = ARRAY_HEADER.size
+    if code == CUSTOM_DTYPE_CODE:
+        dtype = bytes(data[offset + 1:offset + 1 + data[offset]]).decode('ascii')
+        offset += 1 + data[offset]
+    else:
+        dtype = DTYPE_CODES[code]
+    shape = struct.unpack_from('<{}Q'.format(ndim), data, offset)
+    offset += 8 * ndim
+    arr = np.frombuffer(data[offset:], dtype=dtype).reshape(shape)
+    if copy:
+        return arr.copy()
+    return arr
 
 
 def enc_hook(obj: Any) -> Any:
     if isinstance(obj, np.ndarray):
-        return msgspec.msgpack.Ext(1, numpy_array_encoder.encode(
-            NumpySerializedRepresentation(dtype=obj.dtype.str, shape=obj.shape, data=obj.data)))
+        return encode_array(obj)
     elif isinstance(obj, PipeConnection):
         # Pickle the connection
         return multiprocessing.context.reduction.ForkingPickler.dumps(obj)
@@ -64,17 +107,109 @@ def dec_hook(typ: typing.Type, obj: Any) -> Any:
 
 def ext_hook(code: int, data: memoryview) -> Any:
     if code == NUMPY_TYPE_CODE:
-        serialized_array_rep = numpy_array_decoder.decode(data)
-        return np.frombuffer(serialized_array_rep.data, dtype=serialized_array_rep.dtype).reshape(
-            serialized_array_rep.shape)
+        return decode_array(data)
     else:
         # Raise a NotImplementedError for other extension type codes
         raise NotImplementedError(f"Extension type code {code} is not supported")
 
 
+def writable_ext_hook(code: int, data: memoryview) -> Any:
+    """Variant of ext_hook for consumers that modify received arrays in place."""
+    if code == NUMPY_TYPE_CODE:
+        return decode_array(data, copy=True)
+    else:
+        return ext_hook(code, data)
+
+
+EXT_HOOKS = {False: ext_hook, True: writable_ext_hook}  # Hooks decoding arrays as read-only views or writable copies
+
+
+class EventRegistry:
+    """
+    Table of PybEvent classes keyed by their msgspec tag with decoders cached for the current version of the table.
+
+    Event classes register themselves when they are defined so types created after a process has started, such as the
+    custom events of Local tasks, are added to the table and bump its version. Decoders are only rebuilt when the version
+    changes. Tags are the class names so every process that imports the same event classes builds an identical table. If
+    a class is redefined, for example when a task module is reloaded, the newest definition replaces the old one.
+
+    Attributes
+    ----------
+    version : int
+        Incremented every time an event class is registered
+    """
+
+    def __init__(self):
+        self.pending = []
+        self.events = {}
+        self.version = 0
+        self.decoders = {}
+        self.decoders_version = -1
+
+    def register(self, event_type: typing.Type[PybEvent]) -> None:
+        # Tags are resolved lazily since the struct configuration is not complete while the class is being created
+        self.pending.append(event_type)
+        self.version += 1
+
+    def table(self) -> Dict[str, typing.Type[PybEvent]]:
+        """Returns the mapping from tag to event class."""
+        while len(self.pending) > 0:
+            event_type = self.pending.pop(0)
+            self.events[event_type.__struct_config__.tag] = event_type
+        return self.events
+
+    def decoder(self, many: bool = False, ext_hook: typing.Callable = ext_hook) -> msgspec.msgpack.Decoder:
+        """Returns a cached decoder for a single event or a list of events (many) using the provided ext_hook."""
+        if self.decoders_version != self.version:
+            self.decoders = {}
+            self.decoders_version = self.version
+        try:
+            return self.decoders[many, ext_hook]
+        except KeyError:
+            union = typing.Union[tuple(self.table().values())]
+            decoder = self.decoders[many, ext_hook] = msgspec.msgpack.Decoder(
+                type=typing.List[union] if many else union, dec_hook=dec_hook, ext_hook=ext_hook)
+            return decoder
+
+
+registry = EventRegistry()
+
+
+class EventDecoder:
+    """
+    Decodes encoded PybEvents (or lists of PybEvents if many is True) using the registry, picking up any event classes
+    registered since the last message was decoded.
+
+    Parameters
+    ----------
+    many : bool
+        True if encoded messages contain lists of events
+    ext_hook : Callable
+        Hook for msgpack extension types (defaults to PybEvents.ext_hook or PybEvents.writable_ext_hook)
+    writable : bool
+        True if arrays should be decoded as writable copies rather than read-only views of the message
+    """
+
+    def __init__(self, many: bool = False, ext_hook: typing.Callable = None, writable: bool = False):
+        self.many = many
+        self.ext_hook = ext_hook or EXT_HOOKS[writable]
+        self.version = -1
+        self.decoder = None
+
+    def decode(self, data: bytes) -> Any:
+        if self.version != registry.version:
+            self.decoder = registry.decoder(self.many, self.ext_hook)
+            self.version = registry.version
+        return self.decoder.decode(data)
+
+
 class PybEvent(msgspec.Struct, kw_only=True, tag=True, omit_defaults=True, array_like=True):
     metadata: Dict = {}
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        registry.register(cls)
+
 
 class ErrorEvent(PybEvent):
     error: str
@@ -98,6 +233,12 @@ class RemoveSourceEvent(PybEvent):
     sid: str
 
 
+class SharedMemoryEvent(PybEvent):
+    sid: str
+    task_to_source: str
+    source_to_task: str
+
+
 class ExitEvent(PybEvent):
     pass
 
@@ -111,6 +252,29 @@ class PygameEvent(PybEvent):
     event_dict: Dict
 
 
+class LatencyTraceEvent(PybEvent):
+    chamber: int
+    trace: Dict
+
+
+class LatencyQueryEvent(PybEvent):
+    pass
+
+
+class LatencyReportEvent(PybEvent):
+    report: Dict
+
+
+class SubscribeEvent(PybEvent):
+    # Requests events from a control server. Empty lists subscribe to every chamber or event type.
+    chambers: List[int] = []
+    events: List[str] = []
+
+
+class UnsubscribeEvent(PybEvent):
+    pass
+
+
 class TaskEvent(PybEvent):
     chamber: int
 
@@ -228,6 +392,8 @@ class ComponentChangedEvent(Loggable, StatefulEvent):
 
 class TimeoutEvent(Loggable, StatefulEvent):
     name: str
+    scheduled: typing.Optional[float] = None  # perf_counter time the timeout was due to expire
+    fired: typing.Optional[float] = None  # perf_counter time the timeout actually fired
 
     def format(self) -> LoggerEvent:
         return LoggerEvent(self, self.name, 0, self.timestamp)
@@ -255,3 +421,45 @@ class StateExitEvent(Loggable, StatefulEvent):
 
     def format(self) -> LoggerEvent:
         return LoggerEvent(self, self.name, self.value, self.timestamp)
+
+
+class EventTraits:
+    """
+    Flags and ancestry for a concrete PybEvent subclass resolved once so hot paths avoid repeated isinstance checks.
+
+    Attributes
+    ----------
+    types : frozenset
+        All classes in the MRO of the event class
+    task : bool
+        True if the event is a TaskEvent
+    timed : bool
+        True if the event is a TimedEvent
+    stateful : bool
+        True if the event should be forwarded to the Task state methods
+    loggable : bool
+        True if the event should be forwarded to EventLoggers
+    """
+    __slots__ = ('types', 'task', 'timed', 'stateful', 'loggable')
+
+    def __init__(self, event_type: typing.Type[PybEvent]):
+        self.types = frozenset(event_type.__mro__)
+        self.task = TaskEvent in self.types
+        self.timed = TimedEvent in self.types
+        self.stateful = StatefulEvent in self.types
+        self.loggable = Loggable in self.types
+
+    def is_a(self, event_type: typing.Type[PybEvent]) -> bool:
+        return event_type in self.types
+
+
+_event_traits: Dict[typing.Type[PybEvent], EventTraits] = {}
+
+
+def traits(event_type: typing.Type[PybEvent]) -> EventTraits:
+    """Returns the cached EventTraits for an event class, resolving them the first time the class is seen."""
+    try:
+        return _event_traits[event_type]
+    except KeyError:
+        et = _event_traits[event_type] = EventTraits(event_type)
+        return et
@@ -0,0 +1,252 @@
+from __future__ import annotations
+
+import csv
+import glob
+import os
+import re
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import msgspec
+
+from pybehave.Events.CSVEventLogger import FOOTER_MARKER
+
+SEGMENT_PATTERN = re.compile(r"^(.*)_(\d{4})(\.[^.]*)$")
+TABLE_HEADER = "Trial,Time,Type,Code,State,Metadata\n"
+
+
+class SegmentInfo(msgspec.Struct):
+    """
+    Result of validating a single segment of a session saved by a CSVEventLogger.
+
+    Attributes
+    ----------
+    path : str
+        Path to the segment
+    segment : int
+        Index of the segment from its file name
+    rows : int
+        Number of complete events in the segment
+    first_trial : int
+        Trial of the first event in the segment
+    last_trial : int
+        Trial of the last event in the segment
+    closed : bool
+        True if the segment has a footer (it was closed cleanly)
+    next : str
+        File name of the following segment from the footer (empty if this was the last segment)
+    warnings : list
+        Issues expected after an unclean shutdown such as a missing footer or a partially written event
+    problems : list
+        Issues that indicate the segment was modified or corrupted
+    """
+    path: str
+    segment: int
+    rows: int = 0
+    first_trial: Optional[int] = None
+    last_trial: Optional[int] = None
+    closed: bool = False
+    next: str = ""
+    warnings: List[str] = []
+    problems: List[str] = []
+
+
+class RecoveryReport(msgspec.Struct):
+    """
+    Result of stitching the segments of a session into a single file.
+
+    Attributes
+    ----------
+    output : str
+        Path of the stitched session (None if it was only validated)
+    segments : list
+        Validation results for each segment
+    rows : int
+        Number of events in the stitched session
+    warnings : list
+        Issues with the session as a whole expected after an unclean shutdown
+    problems : list
+        Issues with the session as a whole such as missing segments or trials
+    """
+    output: Optional[str]
+    segments: List[SegmentInfo]
+    rows: int = 0
+    warnings: List[str] = []
+    problems: List[str] = []
+
+    def valid(self) -> bool:
+        return len(self.problems) == 0 and all(len(segment.problems) == 0 for segment in self.segments)
+
+
+def find_segments(path: str) -> List[str]:
+    """Returns every segment of the session in order given the path to any of its segments or to the session."""
+    match = SEGMENT_PATTERN.match(path)
+    stem, ext = (match.group(1), match.group(3)) if match is not None else os.path.splitext(path)
+    segments = glob.glob(glob.escape(stem) + "_[0-9][0-9][0-9][0-9]" + glob.escape(ext))
+    return sorted(segments, key=lambda segment: int(SEGMENT_PATTERN.match(segment).group(2)))
+
+
+def session_path(path: str) -> str:
+    """Returns the path the session would have been saved to without segments."""
+    match = SEGMENT_PATTERN.match(path)
+    return match.group(1) + match.group(3) if match is not None else path
+
+
+def parse_footer(text: str) -> Dict[str, str]:
+    footer = {}
+    for line in text.splitlines()[1:]:
+        key, _, value = line.partition(",")
+        footer[key] = value
+    return footer
+
+
+def split_records(body: str) -> (List[str], str):
+    """
+    Splits the event table into CSV records keeping their line endings. Quoted metadata can span several lines (repr of
+    NumPy arrays) so records only end at newlines outside quotes. Returns the records and any incomplete final record.
+    """
+    records = []
+    pending = []
+    quoted = False
+    for line in body.splitlines(keepends=True):
+        pending.append(line)
+        if line.count('"') % 2 == 1:
+            quoted = not quoted
+        if not quoted and line.endswith("\n"):
+            records.append("".join(pending))
+            pending = []
+    return records, "".join(pending)
+
+
+def read_segment(path: str) -> Tuple[str, List[str], SegmentInfo]:
+    """Returns the header and complete rows from a segment along with the result of validating it."""
+    info = SegmentInfo(path, int(SEGMENT_PATTERN.match(path).group(2)), warnings=[], problems=[])
+    with open(path) as f:
+        text = f.read()
+    start = text.find(TABLE_HEADER)
+    if start < 0:
+        info.problems.append("No event table header")
+        return "", [], info
+    start += len(TABLE_HEADER)
+    header = text[:start]
+    for line in header.splitlines():
+        if line.startswith("Segment,") and line != "Segment,{}".format(info.segment):
+            info.problems.append("Header lists {} but the file name has segment {}".format(line, info.segment))
+    # The footer follows a blank line which cannot appear within the event table
+    end = text.find("\n\n" + FOOTER_MARKER + "\n", start - 1)
+    footer = None
+    if end >= 0:
+        end += 1
+        footer = parse_footer(text[end + 1:])
+        info.closed = True
+    else:
+        end = len(text)
+        info.warnings.append("Segment was not closed")
+    rows, partial = split_records(text[start:end])
+    if len(partial) > 0:
+        info.warnings.append("Dropped a partially written event")
+    for i, row in enumerate(csv.reader(rows)):
+        try:
+            trial = int(row[0])
+            float(row[1])
+        except (ValueError, IndexError):
+            info.problems.append("Row {} could not be parsed".format(i + 1))
+            rows = rows[:i]
+            break
+        if len(row) != 6:
+            info.problems.append("Row {} has {} columns".format(i + 1, len(row)))
+        if info.last_trial is not None and trial != info.last_trial + 1:
+            info.problems.append("Trial {} follows trial {}".format(trial, info.last_trial))
+        if info.first_trial is None:
+            info.first_trial = trial
+        info.last_trial = trial
+    info.rows = len(rows)
+    if footer is not None:
+        info.next = footer.get("Next", "")
+        if "{:08x}".format(zlib.crc32(text[:end].encode())) != footer.get("Checksum"):
+            info.problems.append("Checksum does not match the footer")
+        if str(info.rows) != footer.get("Rows"):
+            info.problems.append("Footer lists {} events but {} were found".format(footer.get("Rows"), info.rows))
+        if info.rows > 0 and str(info.first_trial) != footer.get("FirstTrial"):
+            info.problems.append("Footer lists trial {} first but found {}".format(footer.get("FirstTrial"), info.first_trial))
+    return header, rows, info
+
+
+def recover(path: str, output: str = None, write: bool = True) -> RecoveryReport:
+    """
+    Validates the segments of a session saved by a CSVEventLogger and stitches them into a single CSV file identical in
+    format to an unsegmented session. Partially written events at the end of a segment that was not closed are dropped.
+
+    Parameters
+    ----------
+    path : str
+        Path to any segment of the session
+    output : str
+        Path for the stitched session (defaults to the session path without a segment index)
+    write : bool
+        False to only validate the segments
+
+    Returns
+    -------
+    RecoveryReport
+        Validation results for the session
+    """
+    segments = find_segments(path)
+    report = RecoveryReport(None, [], warnings=[], problems=[])
+    if len(segments) == 0:
+        report.problems.append("No segments found for {}".format(path))
+        return report
+    header = None
+    rows = []
+    previous = None
+    for segment in segments:
+        segment_header, segment_rows, info = read_segment(segment)
+        report.segments.append(info)
+        expected = 0 if previous is None else previous.segment + 1
+        if info.segment > expected:
+            missing = str(expected) if info.segment == expected + 1 else "{} to {}".format(expected, info.segment - 1)
+            report.problems.append("Segment {} missing".format(missing))
+        if previous is not None:
+            if not previous.closed:
+                report.problems.append("Segment {} was not closed but is followed by another segment".format(previous.segment))
+            elif previous.next != os.path.basename(segment):
+                report.problems.append("Segment {} is followed by {} rather than {}".format(previous.segment,
+                                                                                          os.path.basename(segment),
+                                                                                          previous.next))
+            if previous.last_trial is not None and info.first_trial is not None and \
+                    info.first_trial != previous.last_trial + 1:
+                report.problems.append("Trials {} to {} are missing".format(previous.last_trial + 1, info.first_trial - 1))
+        if header is None:
+            header = "".join(line for line in segment_header.splitlines(keepends=True) if not line.startswith("Segment,"))
+        rows.extend(segment_rows)
+        previous = info
+    if previous.closed and previous.next != "":
+        report.problems.append("Segment {} is missing".format(previous.next))
+    elif not previous.closed:
+        report.warnings.append("Session ended without closing its last segment")
+    report.rows = len(rows)
+    if write:
+        report.output = output or session_path(segments[0])
+        if os.path.exists(report.output):
+            raise FileExistsError("{} already exists".format(report.output))
+        with open(report.output, "w") as f:
+            f.write(header)
+            f.writelines(rows)
+    return report
+
+
+def print_report(report: RecoveryReport) -> None:
+    for info in report.segments:
+        print("{}: {} events{}".format(os.path.basename(info.path), info.rows,
+                                       "" if info.first_trial is None else
+                                       " (trials {} to {})".format(info.first_trial, info.last_trial)))
+        for warning in info.warnings:
+            print("  warning: " + warning)
+        for problem in info.problems:
+            print("  error: " + problem)
+    for warning in report.warnings:
+        print("warning: " + warning)
+    for problem in report.problems:
+        print("error: " + problem)
+    if report.output is not None:
+        print("Saved {} events to {}".format(report.rows, report.output))
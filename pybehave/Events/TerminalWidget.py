@@ -27,7 +27,7 @@ class TerminalWidget(EventWidget):
     @pyqtSlot()
     def handle_event(self, event: PybEvents.PybEvent):
         super(TerminalWidget, self).handle_event(event)
-        if isinstance(event, PybEvents.Loggable):
+        if PybEvents.traits(type(event)).loggable:
             event_text = self.format_event(event.format(), type(event).__name__)
             self.cur_text = event_text if self.cur_text is None else "\n".join((self.cur_text, event_text))
             self.event_count += 1
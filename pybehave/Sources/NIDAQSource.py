@@ -52,6 +52,7 @@ class NIDAQSource(Source):
         self.ao_task = None
         self.ao_stream = None
         self.ao_inds = {}
+        self.shared_memory_size = 2 ** 26  # Waveforms are passed through shared memory rather than the Pipe
 
     def initialize(self):
         dev_obj = system.Device(self.dev)
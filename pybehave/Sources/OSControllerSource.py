@@ -6,6 +6,7 @@ except ModuleNotFoundError:
 
 import ctypes
 import threading
+import time
 from contextlib import ExitStack
 
 from pybehave.Components.Component import Component
@@ -24,6 +25,7 @@ class OSControllerSource(ThreadSource):
         self.values = {}
         self.input_ids = {}
         self.close_event = None
+        self.batch_size = 256  # Updates decoded from a single serial read are sent together
 
     def initialize(self):
         self.close_event = threading.Event()
@@ -128,6 +130,7 @@ class OSControllerSource(ThreadSource):
                 msg = serial_port.read(nb)
             else:
                 msg = serial_port.read(1)
+            received = time.perf_counter()
             for b in msg:
                 serial_command.extend(b.to_bytes(1, 'little'))
                 data = int.from_bytes(serial_command, 'little')
@@ -137,7 +140,7 @@ class OSControllerSource(ThreadSource):
                     input_id = "{}_{}".format(serial_index, str(address))
                     if input_id in self.input_ids:
                         self.values[self.input_ids[input_id]] = not self.values[self.input_ids[input_id]]
-                        self.update_component(self.input_ids[input_id], self.values[self.input_ids[input_id]])
+                        self.update_component(self.input_ids[input_id], self.values[self.input_ids[input_id]], received=received)
                     serial_command = bytearray()
                 elif cid == 1:
                     if len(serial_command) == 2:
@@ -147,15 +150,16 @@ class OSControllerSource(ThreadSource):
                         input_id = "{}_{}".format(serial_index, "A" + str(command.b.address))
                         if input_id in self.input_ids:
                             self.values[self.input_ids[input_id]] = command.b.value
-                            self.update_component(self.input_ids[input_id], self.values[self.input_ids[input_id]])
+                            self.update_component(self.input_ids[input_id], self.values[self.input_ids[input_id]], received=received)
                         serial_command = bytearray()
                 elif cid == 2:
                     address = data >> 3 & 0x3
                     input_id = "{}_{}".format(serial_index, "A" + str(address))
                     if input_id in self.input_ids:
                         self.values[self.input_ids[input_id]] = not self.values[self.input_ids[input_id]]
-                        self.update_component(self.input_ids[input_id], self.values[self.input_ids[input_id]])
+                        self.update_component(self.input_ids[input_id], self.values[self.input_ids[input_id]], received=received)
                     serial_command = bytearray()
+            self.flush_updates()
             if self.close_event.is_set():
                 return
 
@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any, Dict, List, Tuple
+
+from pybehave.Events import PybEvents
+from pybehave.Sources.Source import Source
+
+if TYPE_CHECKING:
+    from pybehave.Components.Component import Component
+    from pybehave.Tasks.TaskProcess import TaskProcess
+
+
+class ScriptedSource(Source):
+    """
+    Source that delivers inputs from a script rather than hardware. ScriptedSources run inside the TaskProcess and
+    schedule their inputs with its TimeoutManager so they share the task's clock, making sessions with a VirtualClock
+    fully deterministic.
+
+    Each script entry is a tuple of (time, component, value) where time is the number of seconds after the task starts
+    and component is the name of the Component in the task (name-index for Components in a list). The same script is
+    played for every chamber the Source has Components in. Subclasses can instead respond to task outputs by
+    overriding write_component and calling update_component with a delay.
+
+    Parameters
+    ----------
+    script : list
+        Inputs as (time, component, value) tuples
+    """
+
+    def __init__(self, script: List[Tuple[float, str, Any]] = None):
+        super(ScriptedSource, self).__init__()
+        self.script = sorted(script or [], key=lambda entry: entry[0])
+        self.tp = None
+        self.names = {}  # Component IDs in each chamber by name
+
+    def attach(self, tp: TaskProcess) -> None:
+        """Called by the TaskProcess before any events are handled."""
+        self.tp = tp
+
+    def register_component(self, component: Component, metadata: Dict) -> None:
+        name, chamber, index = component.id.rsplit("-", 2)
+        names = self.names.setdefault(int(chamber), {})
+        names["{}-{}".format(name, index)] = component.id
+        if index == "0":
+            names[name] = component.id
+
+    def task_started(self, chamber: int) -> None:
+        """Schedules the script for a chamber when its task starts."""
+        names = self.names.get(chamber, {})
+        for t, name, value in self.script:
+            if name in names:
+                self.update_component(names[name], value, delay=t)
+
+    def update_component(self, cid: str, value: Any, metadata: Dict = None, received: float = None,
+                         delay: float = 0) -> None:
+        """
+        Delivers a new value for a Component to the task after delay seconds on the task's clock. Inputs still
+        pending when the task stops are discarded.
+        """
+        chamber = self.component_chambers[cid]
+        self.tp.schedule_event(PybEvents.ComponentUpdateEvent(chamber, cid, value, metadata=metadata or {}), delay)
+
+    def close_component(self, component_id: str) -> None:
+        chamber = self.component_chambers.pop(component_id, None)
+        if chamber is not None:
+            self.names.pop(chamber, None)
+        self.components.pop(component_id, None)
+
+    def unavailable(self):
+        # Runs within the TaskProcess so there is no connection to report through
+        self.available = False
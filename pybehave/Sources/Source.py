@@ -1,8 +1,12 @@
 from __future__ import annotations
 
 import importlib
+import multiprocessing
+import threading
+import time
 import traceback
 from multiprocessing import Process
+from multiprocessing.connection import Connection
 from typing import TYPE_CHECKING, Any, Dict, List
 
 import msgspec.msgpack
@@ -14,6 +18,8 @@ if TYPE_CHECKING:
 
 from abc import ABCMeta
 from pybehave.Events.PybEvents import ComponentUpdateEvent, UnavailableSourceEvent
+from pybehave.Utilities import Latency, Scheduling
+from pybehave.Utilities.SharedRingBuffer import SharedRingBuffer
 import pybehave.Utilities.Exceptions as pyberror
 
 
@@ -33,6 +39,8 @@ class Source(Process):
         Queries the current input to the component described by component_id
     write_component(component_id, msg)
         Sends data msg to the component described by component_id
+    flush_updates()
+        Immediately sends any ComponentUpdateEvents waiting in a partial batch
     """
 
     def __init__(self):
@@ -41,22 +49,38 @@ class Source(Process):
         self.components = {}
         self.component_chambers = {}
         self.queue = None
+        self.queues = []  # Connections to every TaskProcess worker (queue is the first)
+        self.chamber_queues = {}  # Connection to the worker running each chamber
         self.decoder = None
         self.encoder = None
+        self.decoders = {}
+        self.encoders = {}
         self.available = True
+        self.batch_size = 1  # Maximum number of ComponentUpdateEvents coalesced into a single frame
+        self.batch_delay = None  # Maximum time in seconds an update can wait in a partial frame (None to only flush explicitly)
+        self.batch = []
+        self.batch_deadline = None
+        self.batch_condition = None
+        self.batch_closed = False
+        self.shared_memory_size = 0  # Capacity in bytes of the shared memory ring used for large arrays (0 to disable)
+        self.writable_arrays = False  # True if received arrays should be writable copies rather than read-only views
+        self.rings = []
+        self.scheduling = None  # SchedulingPolicy applied when the Source process starts
+        self.trace_latency = False  # True if updates should carry timestamps for latency monitoring
 
     def initialize(self):
         pass
 
     def run(self):
-        self.decoder = msgspec.msgpack.Decoder(type=List[PybEvents.subclass_union(PybEvents.PybEvent)], dec_hook=PybEvents.dec_hook, ext_hook=PybEvents.ext_hook)
+        Scheduling.apply(self.scheduling, "Source '{}'".format(self.sid), reset=True)
+        self.decoder = PybEvents.EventDecoder(many=True, writable=self.writable_arrays)
         self.encoder = msgspec.msgpack.Encoder(enc_hook=PybEvents.enc_hook)
+        self.start_shared_memory()
+        self.start_batching()
         try:
             self.initialize()
-            while True:
-                events = self.decoder.decode(self.queue.recv_bytes())
-                if not self.handle_events(events):
-                    return
+            while self.receive_events():
+                pass
         except pyberror.ComponentRegisterError as e:
             self.queue.send_bytes(self.encoder.encode(PybEvents.ErrorEvent(type(e).__name__, traceback.format_exc(), metadata={"sid": self.sid})))
             self.unavailable()
@@ -65,11 +89,27 @@ class Source(Process):
             self.unavailable()
             raise
 
-    def handle_events(self, events: List[PybEvents.PybEvent]):
+    def task_queues(self) -> List[Connection]:
+        return self.queues if len(self.queues) > 0 else [self.queue]
+
+    def receive_events(self) -> bool:
+        """Waits for and handles events from the TaskProcess workers. Returns False once the Source has closed."""
+        queues = self.task_queues()
+        for q in multiprocessing.connection.wait(queues) if len(queues) > 1 else queues:
+            events = self.decoders.get(q, self.decoder).decode(q.recv_bytes())
+            if not self.handle_events(events, q):
+                return False
+        return True
+
+    def handle_events(self, events: List[PybEvents.PybEvent], queue: Connection = None):
         for event in events:
             if isinstance(event, PybEvents.ComponentUpdateEvent):
                 self.write_component(event.comp_id, event.value)
+                if self.trace_latency and Latency.TRACE_KEY in event.metadata:
+                    self.complete_trace(event)
             elif isinstance(event, PybEvents.ComponentRegisterEvent):
+                # Updates are sent back to the worker running the chamber the component was registered from
+                self.chamber_queues[event.metadata["chamber"]] = queue or self.queue
                 self.register_component_(event)
             elif isinstance(event, PybEvents.ComponentCloseEvent):
                 self.close_component(event.comp_id)
@@ -102,7 +142,7 @@ class Source(Process):
         """
         pass
 
-    def update_component(self, cid: str, value: Any, metadata: Dict = None) -> None:
+    def update_component(self, cid: str, value: Any, metadata: Dict = None, received: float = None) -> None:
         """ This method should be called to indicate a Component has updated based on new information from the Source.
 
         Parameters
@@ -113,13 +153,110 @@ class Source(Process):
             the new value received from the Source for the Component
         metadata : dict
             any metadata associated with this update
+        received : float
+            the time.perf_counter() value when the update was received from the hardware (defaults to now)
         """
         metadata = metadata or {}
-        self.queue.send_bytes(self.encoder.encode(ComponentUpdateEvent(self.component_chambers[cid], cid, value, metadata=metadata)))
+        chamber = self.component_chambers[cid]
+        if self.trace_latency:
+            metadata[Latency.TRACE_KEY] = {"source_receive": received or time.perf_counter()}
+        event = ComponentUpdateEvent(chamber, cid, value, metadata=metadata)
+        if self.batch_size <= 1:
+            queue = self.chamber_queues.get(chamber, self.queue)
+            if self.trace_latency:
+                Latency.stamp(metadata, "pipe_send")
+            queue.send_bytes(self.encoders.get(queue, self.encoder).encode(event))
+            return
+        with self.batch_condition:
+            self.batch.append(event)
+            if len(self.batch) >= self.batch_size:
+                self.send_batch()
+            elif len(self.batch) == 1 and self.batch_delay is not None:
+                self.batch_deadline = time.perf_counter() + self.batch_delay
+                self.batch_condition.notify()
+
+    def start_shared_memory(self) -> None:
+        if self.shared_memory_size > 0:
+            # Each TaskProcess worker gets its own pair of rings since they are single-producer/single-consumer
+            for queue in self.task_queues():
+                ring_in = SharedRingBuffer(size=self.shared_memory_size)
+                ring_out = SharedRingBuffer(size=self.shared_memory_size)
+                self.rings.extend((ring_in, ring_out))
+                queue.send_bytes(self.encoder.encode(PybEvents.SharedMemoryEvent(self.sid, ring_in.name, ring_out.name)))
+                hook = ring_in.writable_ext_hook if self.writable_arrays else ring_in.ext_hook
+                self.decoders[queue] = PybEvents.EventDecoder(many=True, ext_hook=hook)
+                self.encoders[queue] = msgspec.msgpack.Encoder(enc_hook=ring_out.enc_hook)
+
+    def stop_shared_memory(self) -> None:
+        for ring in self.rings:
+            ring.close()
+        self.rings = []
+        self.decoders = {}
+        self.encoders = {}
+
+    def flush_updates(self) -> None:
+        """Call to immediately send any ComponentUpdateEvents waiting in a partial batch."""
+        if self.batch_condition is not None:
+            with self.batch_condition:
+                if len(self.batch) > 0:
+                    self.send_batch()
+
+    def start_batching(self) -> None:
+        # Synchronization primitives are created in the Source process as they cannot be pickled
+        self.batch_condition = threading.Condition()
+        self.batch_closed = False
+        if self.batch_size > 1 and self.batch_delay is not None:
+            threading.Thread(target=self.batch_loop, daemon=True).start()
+
+    def stop_batching(self) -> None:
+        if self.batch_condition is not None:
+            with self.batch_condition:
+                if len(self.batch) > 0:
+                    self.send_batch()
+                self.batch_closed = True
+                self.batch_condition.notify()
+
+    def batch_loop(self) -> None:
+        with self.batch_condition:
+            while not self.batch_closed:
+                if len(self.batch) == 0:
+                    self.batch_condition.wait()
+                else:
+                    remaining = self.batch_deadline - time.perf_counter()
+                    if remaining <= 0:
+                        self.send_batch()
+                    else:
+                        self.batch_condition.wait(remaining)
+
+    def complete_trace(self, event: PybEvents.ComponentUpdateEvent) -> None:
+        """Records the hardware write for a traced output and returns the trace to the task for aggregation."""
+        trace = event.metadata[Latency.TRACE_KEY]
+        trace["hardware_write"] = time.perf_counter()
+        with self.batch_condition:
+            self.batch.append(PybEvents.LatencyTraceEvent(event.chamber, trace))
+            if self.batch_size <= 1 or len(self.batch) >= self.batch_size:
+                self.send_batch()
+
+    def send_batch(self) -> None:
+        if self.trace_latency:
+            for event in self.batch:
+                Latency.stamp(event.metadata, "pipe_send")
+        if len(self.queues) > 1:
+            # Split the batch by the worker running each chamber while preserving the order of updates
+            frames = {}
+            for event in self.batch:
+                frames.setdefault(self.chamber_queues.get(event.chamber, self.queue), []).append(event)
+            for queue, events in frames.items():
+                queue.send_bytes(self.encoders.get(queue, self.encoder).encode(events))
+        else:
+            self.queue.send_bytes(self.encoders.get(self.queue, self.encoder).encode(self.batch))
+        self.batch = []
 
     def close_source_(self):
         self.close_source()
+        self.stop_batching()
         self.unavailable()
+        self.stop_shared_memory()
 
     def close_source(self) -> None:
         """Override to close all connections with the interface represented by the Source."""
@@ -1,12 +1,12 @@
 import threading
 import traceback
 from abc import ABC
-from typing import List
 
 import msgspec.msgpack
 
 from pybehave.Events import PybEvents
 from pybehave.Sources.Source import Source
+from pybehave.Utilities import Scheduling
 import pybehave.Utilities.Exceptions as pyberror
 
 
@@ -18,8 +18,11 @@ class ThreadSource(Source, ABC):
         self.run_stop = None
 
     def run(self):
-        self.decoder = msgspec.msgpack.Decoder(type=List[PybEvents.subclass_union(PybEvents.PybEvent)])
+        Scheduling.apply(self.scheduling, "Source '{}'".format(self.sid), reset=True)
+        self.decoder = PybEvents.EventDecoder(many=True, writable=self.writable_arrays)
         self.encoder = msgspec.msgpack.Encoder()
+        self.start_shared_memory()
+        self.start_batching()
         try:
             self.run_stop = threading.Event()
             self.run_thread = threading.Thread(target=self.run_)
@@ -35,10 +38,8 @@ class ThreadSource(Source, ABC):
 
     def run_(self):
         try:
-            while True:
-                events = self.decoder.decode(self.queue.recv_bytes())
-                if not self.handle_events(events):
-                    return
+            while self.receive_events():
+                pass
         except pyberror.ComponentRegisterError as e:
             self.queue.send_bytes(self.encoder.encode(PybEvents.ErrorEvent(type(e).__name__, traceback.format_exc(), metadata={"sid": self.sid})))
             self.unavailable()
@@ -0,0 +1,52 @@
+from __future__ import annotations
+
+import random
+from typing import Any, Dict, List, Tuple
+
+from pybehave.Events import PybEvents
+from pybehave.Sources.ScriptedSource import ScriptedSource
+
+
+class VirtualSubject(ScriptedSource):
+    """
+    Base class for simulated subjects used with simulated time. Subclasses model how a subject responds to the task by
+    overriding write_component (called whenever the task writes to an output) and task_started, and deliver their
+    responses with respond. Each VirtualSubject has its own random number generator so sessions can be reproduced from
+    their seed.
+
+    Parameters
+    ----------
+    script : list
+        Inputs delivered regardless of the task as (time, component, value) tuples
+    seed : int
+        Seed for the random number generator
+    time_limit : float
+        Seconds after the task starts at which it is stopped if it has not completed (None for no limit)
+    """
+
+    def __init__(self, script: List[Tuple[float, str, Any]] = None, seed: int = None, time_limit: float = None):
+        super(VirtualSubject, self).__init__(script)
+        self.random = random.Random(seed)
+        self.time_limit = time_limit
+        self.results = {}  # Values reported in the summary for each session
+
+    def seed(self, seed: int) -> None:
+        self.random.seed(seed)
+
+    def task_started(self, chamber: int) -> None:
+        super(VirtualSubject, self).task_started(chamber)
+        if self.time_limit is not None:
+            self.tp.schedule_event(PybEvents.StopEvent(chamber), self.time_limit)
+
+    def respond(self, chamber: int, name: str, value: Any, delay: float = 0) -> None:
+        """Sets the Component with the given name (name-index for Components in a list) to value after delay seconds."""
+        self.update_component(self.names[chamber][name], value, delay=delay)
+
+    def component_name(self, component_id: str) -> str:
+        """Returns the name of a Component as used in scripts and respond."""
+        name, chamber, index = component_id.rsplit("-", 2)
+        return name if index == "0" else "{}-{}".format(name, index)
+
+    def summary(self) -> Dict[str, Any]:
+        """Override to report additional statistics about a simulated session. Returns results by default."""
+        return self.results
@@ -9,6 +9,7 @@ from typing import Any, Type, overload, Dict, List, TYPE_CHECKING, Tuple
 
 from pybehave.Events import PybEvents
 from pybehave.Tasks.TimeoutManager import Timeout
+from pybehave.Utilities import Clock, Latency
 from pybehave.Utilities.AddressFile import AddressFile
 import pybehave.Utilities.Exceptions as pyberror
 
@@ -60,6 +61,9 @@ class Task:
     class SessionStates(Enum):
         PAUSED = 0
 
+    # Rate in Hz at which HeartbeatEvents are sent to the task while it is running (None or 0 to disable)
+    heartbeat_rate = 10
+
     def __init__(self):
         self.state = None
         self.entry_time = self.start_time = self.pause_time = self.time_into_trial = self.time_paused = 0
@@ -246,7 +250,7 @@ class Task:
             a dictionary containing any metadata that should be associated with the state change event.
         """
         metadata = metadata or {}
-        self.entry_time = time.perf_counter()
+        self.entry_time = Clock.now()
         self.log_event(PybEvents.StateExitEvent(self.metadata["chamber"], self.state.name, self.state.value, metadata=metadata))
         if not self.is_complete_():
             self.log_event(PybEvents.StateEnterEvent(self.metadata["chamber"], new_state.name, new_state.value, metadata=metadata.copy()))
@@ -267,7 +271,7 @@ class Task:
             setattr(self, key, value)
         self.start()
         self.started = True
-        self.entry_time = self.start_time = time.perf_counter()
+        self.entry_time = self.start_time = Clock.now()
 
         return metadata
 
@@ -282,7 +286,7 @@ class Task:
     def pause__(self) -> None:
         self.paused = True
         self.time_into_trial = self.time_in_state()
-        self.pause_time = time.perf_counter()
+        self.pause_time = Clock.now()
         for name in self.timeouts.keys():
             self.pause_timeout(name)
         self.pause()
@@ -293,8 +297,8 @@ class Task:
 
     def resume__(self) -> None:
         self.paused = False
-        self.time_paused += time.perf_counter() - self.pause_time
-        self.entry_time = time.perf_counter() - self.time_into_trial
+        self.time_paused += Clock.now() - self.pause_time
+        self.entry_time = Clock.now() - self.time_into_trial
         for name in self.timeouts.keys():
             self.resume_timeout(name)
         self.resume()
@@ -311,14 +315,15 @@ class Task:
         pass
 
     def main_loop(self, event: PybEvents.PybEvent) -> None:
-        if isinstance(event, PybEvents.StateEnterEvent):
+        et = PybEvents.traits(type(event))
+        if et.is_a(PybEvents.StateEnterEvent):
             self.state = self.States(event.value)
-        elif isinstance(event, PybEvents.StateExitEvent):
+        elif et.is_a(PybEvents.StateExitEvent):
             if self.state in self.state_timeouts:
                 for tm in self.state_timeouts[self.state].values():
                     if tm[1]:
                         self.cancel_timeout(tm[0].name)
-        elif isinstance(event, PybEvents.TimeoutEvent):
+        elif et.is_a(PybEvents.TimeoutEvent):
             del self.timeouts[event.name]
         all_handled = self.all_states(event)
         if not all_handled and self.state.name in self.state_methods:
@@ -334,11 +339,11 @@ class Task:
         if self.start_time == 0:
             return 0
         else:
-            return time.perf_counter() - self.start_time - self.time_paused
+            return Clock.now() - self.start_time - self.time_paused
 
     def time_in_state(self) -> float:
         """Returns the time that has passed in seconds (and fractions of a second) since the current state began."""
-        return time.perf_counter() - self.entry_time
+        return Clock.now() - self.entry_time
 
     @staticmethod
     def get_constants() -> Dict[str, Any]:
@@ -386,8 +391,9 @@ class Task:
         """Log task completion"""
         self.log_event(PybEvents.TaskCompleteEvent(self.metadata["chamber"]))
 
-    def _send_timeout(self, name: str, metadata: Dict) -> None:
-        self.log_timeout(PybEvents.TimeoutEvent(self.metadata["chamber"], name, metadata=metadata))
+    def _send_timeout(self, timeout: Timeout, metadata: Dict) -> None:
+        self.log_timeout(PybEvents.TimeoutEvent(self.metadata["chamber"], timeout.name, timeout.scheduled, timeout.fired,
+                                                metadata=metadata.copy()))
 
     def set_timeout(self, name: str, timeout: float, end_with_state=True, metadata: Dict = None) -> None:
         """ Begins a timer that will add a TimeoutEvent to the event stream after a prescribed duration.
@@ -405,7 +411,8 @@ class Task:
         """
         metadata = metadata or {}
         if name not in self.timeouts:
-            tm = Timeout(name, self.metadata["chamber"], timeout, self._send_timeout, (name, metadata))
+            tm = Timeout(name, self.metadata["chamber"], timeout, self._send_timeout, ())
+            tm.args = (tm, metadata)
             self.timeouts[name] = tm
             if self.state not in self.state_timeouts:
                 self.state_timeouts[self.state] = {}
@@ -439,10 +446,13 @@ class Task:
         self.tp.tp_q.append(event)
 
     def log_timeout(self, event: PybEvents.TimeoutEvent):
-        self.tp.tmq_out.send_bytes(self.tp.encoder.encode(event))
+        self.tp.timeout_q.put(event)
 
     def write_component(self, cid: str, value: Any, metadata: Dict = None):
-        metadata = metadata or {}
+        metadata = dict(metadata or {})  # Tasks may reuse the dictionary they pass for several writes
+        if self.tp.trace is not None:
+            # Outputs written while handling a traced input continue its trace
+            metadata[Latency.TRACE_KEY] = dict(self.tp.trace, write_component=time.perf_counter())
         e = PybEvents.ComponentUpdateEvent(self.metadata["chamber"], cid, value, metadata=metadata)
         self.tp.log_gui_event(e)
         if self.components[cid][2] is not None:
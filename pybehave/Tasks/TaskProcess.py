@@ -4,56 +4,94 @@ import importlib
 import multiprocessing
 import os
 import re
+import time
 import traceback
-from multiprocessing import Process, Pipe
+from multiprocessing import Process
 from multiprocessing.connection import Connection
-from typing import Dict
+from typing import TYPE_CHECKING, Dict
 
 import msgspec.msgpack
-import psutil
 
 from pybehave.Events import PybEvents
 from pybehave.Events.FileEventLogger import FileEventLogger
+from pybehave.Events.LogWriter import wait_for_writers
 from pybehave.Tasks.TaskSequence import TaskSequence
-from pybehave.Tasks.TimeoutManager import TimeoutManager
+from pybehave.Tasks.TimeoutManager import Timeout, TimeoutManager
+from pybehave.Utilities import Clock, Latency, Scheduling
+from pybehave.Utilities.ReadyQueue import ReadyQueue
+from pybehave.Utilities.SharedRingBuffer import SharedRingBuffer
+
+if TYPE_CHECKING:
+    from pybehave.Sources.Source import Source
+
+GUI_HEARTBEAT_PERIOD = 0.1  # Seconds between HeartbeatEvents sent to the Workstation
 
 
 class TaskProcess(Process):
 
-    def __init__(self, mainq: Connection, guiq: Connection, sourceq: Dict[str, Connection]):
+    def __init__(self, mainq: Connection, guiq: Connection, sourceq: Dict[str, Connection], worker: int = 0,
+                 scheduling: Scheduling.SchedulingPolicy = None, trace_latency: bool = False,
+                 timeout_precision: float = 0, virtual_time: bool = False, scripted_sources: Dict[str, "Source"] = None):
         super().__init__()
+        self.worker = worker  # Index of this TaskProcess when chambers are distributed across several workers
+        self.scheduling = scheduling
+        self.trace_latency = trace_latency
+        self.timeout_precision = timeout_precision
+        self.virtual_time = virtual_time  # True if time should jump to the next deadline whenever the process is idle
+        self.scripted_sources = scripted_sources or {}  # Sources that run within this process
+        self.n_scheduled = 0
+        self.schedule_generations = {}  # Incremented when a task stops so events scheduled for it are discarded
+        self.latency = None
+        self.timeout_lateness = None
+        self.trace = None  # Latency trace of the Source input currently being handled by a task
         self.mainq = mainq
         self.guiq = guiq
         self.sourceq = sourceq
         self.tasks = {}
         self.task_event_loggers = {}
         self.tm = None
-        self.tmq_in = None
-        self.tmq_out = None
+        self.timeout_q = None
         self.encoder = None
         self.decoder = None
+        self.list_decoder = None
         self.gui_out = []
         self.tp_q = None
         self.logger_q = None
         self.event_responses = {}
+        self.dispatch = {}
         self.source_buffers = {}
+        self.source_rings = {}
+        self.source_encoders = {}
+        self.source_decoders = {}
         self.connections = []
+        self.heartbeats = {}
+        self.gui_heartbeat = 0
         self.should_exit = False
 
     def run(self):
-        p = psutil.Process(os.getpid())
-        p.nice(psutil.REALTIME_PRIORITY_CLASS)
-        self.tm = TimeoutManager()
-        self.tm.start()
+        Scheduling.apply(self.scheduling, "TaskProcess {}".format(self.worker), reset=True)
+        # The clock is global to the process so a previous session run in the same process may have replaced it
+        Clock.set_clock(Clock.VirtualClock() if self.virtual_time else Clock.Clock())
+        self.tm = TimeoutManager(self.timeout_precision)
+        if not self.virtual_time:
+            self.tm.start()
         self.tp_q = collections.deque()
         self.logger_q = collections.deque()
-        self.tmq_in, self.tmq_out = Pipe(False)
-        self.connections = [self.mainq, self.tmq_in, *self.sourceq.values()]
+        self.timeout_q = ReadyQueue()
+        self.connections = [self.mainq, self.timeout_q.reader, *self.sourceq.values()]
         self.encoder = msgspec.msgpack.Encoder(enc_hook=PybEvents.enc_hook)
-        self.decoder = msgspec.msgpack.Decoder(type=PybEvents.subclass_union(PybEvents.PybEvent), dec_hook=PybEvents.dec_hook)
+        self.decoder = PybEvents.EventDecoder()
+        self.list_decoder = PybEvents.EventDecoder(many=True)
+        if self.trace_latency:
+            self.latency = Latency.LatencyMonitor()
+        self.timeout_lateness = Latency.LatencyMonitor()
 
         for source in self.sourceq:
             self.source_buffers[source] = []
+        for sid, source in self.scripted_sources.items():
+            source.sid = sid
+            source.attach(self)
+            self.source_buffers[sid] = []
 
         self.event_responses = {PybEvents.AddTaskEvent: self.add_task,
                                 PybEvents.AddLoggerEvent: self.add_logger,
@@ -70,44 +108,58 @@ class TaskProcess(Process):
                                 PybEvents.UnavailableSourceEvent: self.source_unavailable,
                                 PybEvents.AddSourceEvent: self.add_source,
                                 PybEvents.RemoveSourceEvent: self.remove_source,
+                                PybEvents.SharedMemoryEvent: self.add_shared_memory,
                                 PybEvents.ErrorEvent: self.error,
                                 PybEvents.ConstantsUpdateEvent: self.update_constants,
                                 PybEvents.ConstantRemoveEvent: self.remove_constant,
+                                PybEvents.LatencyTraceEvent: self.record_latency,
+                                PybEvents.LatencyQueryEvent: self.report_latency,
                                 PybEvents.ExitEvent: self.prepare_exit}
 
         while True:
             try:
-                ready = multiprocessing.connection.wait(self.connections, timeout=0.1)
-                if len(ready) == 0:
-                    event = PybEvents.HeartbeatEvent()
-                    for key in self.tasks.keys():
-                        if self.tasks[key].started and not self.tasks[key].paused:
-                            self.tasks[key].main_loop(event)
-                    for source in self.source_buffers:
-                        if len(self.source_buffers[source]) > 0:
-                            self.sourceq[source].send_bytes(self.encoder.encode(self.source_buffers[source]))
-                            self.source_buffers[source] = []
-                    self.log_gui_event(event)
-                else:
-                    for r in ready:
-                        event = self.decoder.decode(r.recv_bytes())
-                        # t = time.perf_counter()
-                        self.handle_event(event)
-                        # print(time.perf_counter() - t)
-                        while len(self.tp_q) > 0:
-                            self.handle_event(self.tp_q.popleft())
-                        for source in self.source_buffers:
-                            if len(self.source_buffers[source]) > 0:
-                                self.sourceq[source].send_bytes(self.encoder.encode(self.source_buffers[source]))
-                                self.source_buffers[source] = []
-                        if isinstance(event, PybEvents.TaskEvent) and len(self.logger_q) > 0:
-                            for logger in self.task_event_loggers[event.chamber].values():
-                                logger.log_events(self.logger_q)
-                            self.logger_q.clear()
+                advance = self.virtual_time and self.running()
+                ready = multiprocessing.connection.wait(self.connections, timeout=0 if advance else self.next_wait())
+                if advance and len(ready) == 0:
+                    # Nothing can happen until the next deadline so time skips ahead to it
+                    self.advance_clock()
+                for r in ready:
+                    # Timeouts are fired within this process so they are passed as native objects
+                    if r is self.timeout_q.reader:
+                        # Timeouts and scheduled events may still be queued after their task was removed
+                        events = [event for event in self.timeout_q.get_all() if event.chamber in self.tasks]
+                        self.record_timeouts(events)
+                    else:
+                        try:
+                            data = r.recv_bytes()
+                        except EOFError:
+                            if r is self.mainq:
+                                raise
+                            # A Source that failed may have only reported the error to another worker
+                            self.discard_source(next(sid for sid, q in self.sourceq.items() if q is r))
+                            continue
+                        # Sources may coalesce several events into a single list frame
+                        decoder, list_decoder = self.source_decoders.get(r, (self.decoder, self.list_decoder))
+                        if PybEvents.is_event_list(data):
+                            events = list_decoder.decode(data)
+                        else:
+                            events = (decoder.decode(data),)
+                        if self.latency is not None:
+                            for event in events:
+                                Latency.stamp(event.metadata, "task_decode")
+                    for event in events:
+                        # Each event is handled separately so an error does not discard the rest of the batch
+                        try:
+                            self.handle_event(event)
+                            self.process_queued(event.chamber if PybEvents.traits(type(event)).task else None)
+                        except BaseException as e:
+                            metadata = {"chamber": event.chamber} if isinstance(event, PybEvents.TaskEvent) else {}
+                            self.log_gui_event(PybEvents.ErrorEvent(type(e).__name__, traceback.format_exc(),
+                                               metadata=metadata))
+                # Heartbeats are checked on every cycle so they are not starved while events keep arriving
+                self.heartbeat()
             except BaseException as e:
-                metadata = {"chamber": event.chamber} if isinstance(event, PybEvents.TaskEvent) else {}
-                self.log_gui_event(PybEvents.ErrorEvent(type(e).__name__, traceback.format_exc(),
-                                   metadata=metadata))
+                self.log_gui_event(PybEvents.ErrorEvent(type(e).__name__, traceback.format_exc()))
             if len(self.gui_out) > 0:
                 self.guiq.send_bytes(self.encoder.encode(self.gui_out))
                 self.gui_out.clear()
@@ -116,16 +168,131 @@ class TaskProcess(Process):
                 self.exit()
                 break
 
+    def next_heartbeat(self) -> float:
+        deadline = self.gui_heartbeat
+        for hd in self.heartbeats.values():
+            if hd < deadline:
+                deadline = hd
+        return deadline
+
+    def next_wait(self) -> float:
+        """Returns the time until the earliest heartbeat deadline."""
+        return max(self.next_heartbeat() - Clock.now(), 0)
+
+    def running(self) -> bool:
+        for task in self.tasks.values():
+            if task.started and not task.paused:
+                return True
+        return False
+
+    def advance_clock(self) -> None:
+        """Jumps the VirtualClock to the next timeout or heartbeat and fires any timeouts that are due."""
+        deadline = self.next_heartbeat()
+        timeout = self.tm.next_deadline()
+        if timeout is not None and timeout < deadline:
+            deadline = timeout
+        Clock.clock.advance_to(deadline)
+        self.tm.fire_expired()
+
+    def schedule_event(self, event: PybEvents.TaskEvent, delay: float) -> str:
+        """
+        Handles an event after a delay as if it had been received from a Source. Scripted Sources use this to deliver
+        inputs on the same clock as task timeouts.
+
+        Returns
+        -------
+        str
+            Key that can be passed to the TimeoutManager to cancel the event
+        """
+        self.n_scheduled += 1
+        timeout = Timeout("scheduled{}".format(self.n_scheduled), event.chamber, delay, self.deliver_scheduled,
+                          (event, self.schedule_generations.get(event.chamber, 0)))
+        self.tm.add_timeout(timeout)
+        return timeout.key
+
+    def deliver_scheduled(self, event: PybEvents.TaskEvent, generation: int) -> None:
+        # Called by the TimeoutManager
+        if self.schedule_generations.get(event.chamber, 0) == generation:
+            self.timeout_q.put(event)
+
+    def heartbeat(self) -> None:
+        now = Clock.now()
+        for chamber, task in list(self.tasks.items()):
+            if task.started and not task.paused and task.heartbeat_rate:
+                period = 1 / task.heartbeat_rate
+                if chamber not in self.heartbeats:
+                    self.heartbeats[chamber] = now + period
+                elif self.heartbeats[chamber] <= now:
+                    try:
+                        task.main_loop(PybEvents.HeartbeatEvent())
+                        self.process_queued(chamber)
+                    except BaseException as e:
+                        self.log_gui_event(PybEvents.ErrorEvent(type(e).__name__, traceback.format_exc(),
+                                                                metadata={"chamber": chamber}))
+                    # Stay on the original schedule unless the deadline has fallen more than a period behind
+                    self.heartbeats[chamber] += period
+                    if self.heartbeats[chamber] <= now:
+                        self.heartbeats[chamber] = now + period
+            elif chamber in self.heartbeats:
+                del self.heartbeats[chamber]
+        if self.gui_heartbeat <= now:
+            self.flush_sources()
+            self.flush_loggers()
+            # GUI heartbeats are shared by all chambers so only the first worker sends them
+            if self.worker == 0:
+                self.log_gui_event(PybEvents.HeartbeatEvent())
+            self.gui_heartbeat = now + GUI_HEARTBEAT_PERIOD
+
+    def flush_loggers(self) -> None:
+        """Lets EventLoggers save buffered events while their task is running even if no new events arrive."""
+        for chamber, task in list(self.tasks.items()):
+            if task.started:
+                for logger in self.task_event_loggers[chamber].values():
+                    try:
+                        logger.flush()
+                    except BaseException as e:
+                        self.log_gui_event(PybEvents.ErrorEvent(type(e).__name__, traceback.format_exc(),
+                                                                metadata={"chamber": chamber}))
+
+    def process_queued(self, chamber: int = None) -> None:
+        """Handles events added by the task and forwards any resulting output to Sources and EventLoggers."""
+        while len(self.tp_q) > 0:
+            self.handle_event(self.tp_q.popleft())
+        self.flush_sources()
+        if chamber is not None and len(self.logger_q) > 0:
+            for logger in self.task_event_loggers[chamber].values():
+                logger.log_events(self.logger_q)
+            self.logger_q.clear()
+
+    def flush_sources(self) -> None:
+        for source in self.source_buffers:
+            if len(self.source_buffers[source]) > 0:
+                if self.latency is not None:
+                    for event in self.source_buffers[source]:
+                        Latency.stamp(event.metadata, "source_flush")
+                if source in self.scripted_sources:
+                    self.scripted_sources[source].handle_events(self.source_buffers[source])
+                else:
+                    encoder = self.source_encoders.get(source, self.encoder)
+                    self.sourceq[source].send_bytes(encoder.encode(self.source_buffers[source]))
+                self.source_buffers[source] = []
+
     def handle_event(self, event):
         event_type = type(event)
-        self.log_gui_event(event)
-        if event_type in self.event_responses:
-            self.event_responses[type(event)](event)
-        elif isinstance(event, PybEvents.StatefulEvent):
+        try:
+            handler, et = self.dispatch[event_type]
+        except KeyError:
+            handler, et = self.dispatch[event_type] = (self.event_responses.get(event_type), PybEvents.traits(event_type))
+        if et.timed and event.timestamp is None:
+            event.acknowledge(self.tasks[event.chamber].time_elapsed())
+        self.gui_out.append(event)
+        if handler is not None:
+            handler(event)
+        elif et.stateful:
             task = self.tasks[event.chamber]
             if task.started and not task.paused:
                 self.tasks[task.metadata["chamber"]].main_loop(event)
-        if isinstance(event, PybEvents.Loggable):
+        if et.loggable:
             task = self.tasks[event.chamber]
             if task.started and not task.paused:
                 self.log_event(event)
@@ -184,7 +351,13 @@ class TaskProcess(Process):
             if task is self.tasks[task.metadata["chamber"]]:
                 for el in self.task_event_loggers[task.metadata["chamber"]].values():  # Start all EventLoggers
                     el.start_()
+                if self.latency is not None:
+                    self.latency.reset(event.chamber)
+                self.timeout_lateness.reset(event.chamber)
         metadata = task.start__()
+        if "sub_task" not in event.metadata:
+            for source in self.scripted_sources.values():
+                source.task_started(event.chamber)
         metadata.update(event.metadata)
         new_event = PybEvents.StateEnterEvent(task.metadata["chamber"], task.state.name, task.state.value,
                                               metadata=metadata)
@@ -208,14 +381,30 @@ class TaskProcess(Process):
 
     def stop_task(self, event: PybEvents.StopEvent):
         task = self.tasks[event.chamber]
+        if not task.started:
+            return  # A scheduled StopEvent can arrive after the task has already stopped
         new_event = PybEvents.StateExitEvent(event.chamber, task.state.name, task.state.value, metadata=event.metadata)
         self.tasks[task.metadata["chamber"]].main_loop(event)
         self.log_event(new_event)
+        self.log_gui_event(new_event)
+        for logger in self.task_event_loggers[event.chamber].values():
+            # Logging that had to wait for a LogWriter is reported before the file is closed
+            writer = logger.log_file if isinstance(logger, FileEventLogger) else None
+            if writer is not None and writer.blocked_writes > 0:
+                info = PybEvents.InfoEvent(event.chamber, "log_writer_blocked", writer.blocked_writes,
+                                           metadata={"logger": logger.name,
+                                                     "blocked_time": writer.blocked_time})
+                self.log_event(info)
+                self.log_gui_event(info)
         for logger in self.task_event_loggers[event.chamber].values():
             logger.log_events(self.logger_q)
         task.stop__()
+        self.schedule_generations[event.chamber] = self.schedule_generations.get(event.chamber, 0) + 1
         for logger in self.task_event_loggers[event.chamber].values():
             logger.stop()
+            # Latency statistics for the session are saved next to each output file
+            if self.latency is not None and isinstance(logger, FileEventLogger) and logger.file_path is not None:
+                self.latency.write(os.path.splitext(logger.file_path)[0] + "_latency.json", event.chamber)
         self.logger_q.clear()
 
     def pause_task(self, event: PybEvents.PauseEvent):
@@ -243,6 +432,7 @@ class TaskProcess(Process):
         for comp in self.tasks[task.metadata["chamber"]].components.values():
             comp[0].close()
         del self.tasks[task.metadata["chamber"]]
+        self.heartbeats.pop(event.chamber, None)
 
     def update_component(self, event: PybEvents.ComponentUpdateEvent):
         task = self.tasks[event.chamber]
@@ -251,9 +441,17 @@ class TaskProcess(Process):
             # event.value = comp.state
             metadata = event.metadata.copy()
             metadata["value"] = comp.state
+            # The latency trace follows any outputs written by the task rather than being logged
+            trace = metadata.pop(Latency.TRACE_KEY, None)
             new_event = PybEvents.ComponentChangedEvent(task.metadata["chamber"], comp, task.components[comp.id][1],
                                                         metadata=metadata)
-            self.tasks[task.metadata["chamber"]].main_loop(new_event)
+            if trace is not None and self.latency is not None:
+                trace["main_loop"] = time.perf_counter()
+                self.trace = trace
+            try:
+                self.tasks[task.metadata["chamber"]].main_loop(new_event)
+            finally:
+                self.trace = None
             self.log_event(new_event)
 
     def update_constants(self, event: PybEvents.ConstantsUpdateEvent):
@@ -282,33 +480,72 @@ class TaskProcess(Process):
             del task.initial_constants[event.constant]
 
     def log_gui_event(self, event: PybEvents.PybEvent):
-        if isinstance(event, PybEvents.TimedEvent) and event.timestamp is None:
+        if PybEvents.traits(type(event)).timed and event.timestamp is None:
             event.acknowledge(self.tasks[event.chamber].time_elapsed())
         self.gui_out.append(event)
 
     def log_event(self, event: PybEvents.Loggable):
-        if isinstance(event, PybEvents.TimedEvent) and event.timestamp is None:
+        if event.timestamp is None:
             event.acknowledge(self.tasks[event.chamber].time_elapsed())
         self.logger_q.append(event.format())
 
+    def record_latency(self, event: PybEvents.LatencyTraceEvent):
+        if self.latency is not None:
+            self.latency.record(event.chamber, event.trace)
+
+    def record_timeouts(self, events):
+        # Lateness of each timeout when it fired and when it reached the TaskProcess relative to its deadline
+        received = Clock.now()
+        for event in events:
+            if isinstance(event, PybEvents.TimeoutEvent) and event.scheduled is not None:
+                self.timeout_lateness.add(event.chamber, "timeout_fire", event.fired - event.scheduled)
+                self.timeout_lateness.add(event.chamber, "timeout_delivery", received - event.scheduled)
+
+    def report_latency(self, event: PybEvents.LatencyQueryEvent):
+        report = self.timeout_lateness.report()
+        if self.latency is not None:
+            for chamber, hops in self.latency.report().items():
+                report.setdefault(chamber, {}).update(hops)
+        self.gui_out.append(PybEvents.LatencyReportEvent(report))
+
     def source_unavailable(self, event: PybEvents.UnavailableSourceEvent):
         self.mainq.send_bytes(self.encoder.encode(event))
 
     def add_source(self, event: PybEvents.AddSourceEvent):
         self.sourceq[event.sid] = event.conn
         self.source_buffers[event.sid] = []
-        self.connections = [self.mainq, self.tmq_in, *self.sourceq.values()]
+        self.connections = [self.mainq, self.timeout_q.reader, *self.sourceq.values()]
 
     def remove_source(self, event: PybEvents.RemoveSourceEvent):
         self.sourceq[event.sid].send_bytes(self.encoder.encode([event]))
-        del self.sourceq[event.sid]
-        del self.source_buffers[event.sid]
-        self.connections = [self.mainq, self.tmq_in, *self.sourceq.values()]
+        self.discard_source(event.sid)
+
+    def discard_source(self, sid: str):
+        self.close_shared_memory(sid)
+        del self.sourceq[sid]
+        del self.source_buffers[sid]
+        self.connections = [self.mainq, self.timeout_q.reader, *self.sourceq.values()]
+
+    def add_shared_memory(self, event: PybEvents.SharedMemoryEvent):
+        to_source = SharedRingBuffer(event.task_to_source)
+        from_source = SharedRingBuffer(event.source_to_task)
+        self.source_rings[event.sid] = (to_source, from_source)
+        self.source_encoders[event.sid] = msgspec.msgpack.Encoder(enc_hook=to_source.enc_hook)
+        self.source_decoders[self.sourceq[event.sid]] = (
+            PybEvents.EventDecoder(ext_hook=from_source.ext_hook),
+            PybEvents.EventDecoder(many=True, ext_hook=from_source.ext_hook))
+
+    def close_shared_memory(self, sid: str):
+        if sid in self.source_rings:
+            for ring in self.source_rings[sid]:
+                ring.close()
+            del self.source_rings[sid]
+            del self.source_encoders[sid]
+            del self.source_decoders[self.sourceq[sid]]
 
     def error(self, event: PybEvents.ErrorEvent):
         if "sid" in event.metadata and event.metadata["sid"] in self.sourceq:
-            del self.sourceq[event.metadata["sid"]]
-            del self.source_buffers[event.metadata["sid"]]
+            self.discard_source(event.metadata["sid"])
         self.mainq.send_bytes(self.encoder.encode(event))
 
     def prepare_exit(self, event: PybEvents.ExitEvent):
@@ -317,5 +554,13 @@ class TaskProcess(Process):
     def exit(self, *args):
         for q in self.sourceq.values():
             q.send_bytes(self.encoder.encode([PybEvents.CloseSourceEvent()]))
+        for source in self.scripted_sources.values():
+            source.close_source()
         self.tm.quit()
-        self.tm.join()
+        if not self.virtual_time:
+            self.tm.join()
+        self.timeout_q.close()
+        for sid in list(self.source_rings):
+            self.close_shared_memory(sid)
+        # Loggers of stopped tasks may still be saving their files
+        wait_for_writers()
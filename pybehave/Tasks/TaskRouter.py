@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+import threading
+from multiprocessing.connection import Connection
+from typing import Any, Dict, List
+
+import msgspec
+
+from pybehave.Events import PybEvents
+
+
+class EventHeader(msgspec.Struct, gc=False, array_like=True):
+    # Events are encoded as arrays starting with the tag so the chamber of a TaskEvent is always the next element
+    tag: str
+    chamber: Any = None
+
+
+class TaskRouter:
+    """
+    Routes encoded events from the Workstation to the TaskProcess worker responsible for each chamber.
+
+    Connections to every worker are wrapped so that send_bytes can be used exactly like the Pipe to a single TaskProcess.
+    Events associated with a chamber are forwarded to the worker running that chamber while all other events, such as
+    changes to Sources or exiting, are sent to every worker. Chambers can be pinned to a worker, otherwise they are
+    assigned to the worker with the fewest chambers the first time an event for them is sent. Assignments last for the
+    lifetime of the Workstation so a chamber's task and loggers always remain on the same worker. Events can be sent from
+    multiple threads.
+
+    Parameters
+    ----------
+    conns : list
+        Connections to each TaskProcess worker
+    pins : dict
+        Mapping from chamber index to worker index for chambers that should always run on a specific worker
+    """
+
+    def __init__(self, conns: List[Connection], pins: Dict[int, int] = None):
+        self.conns = conns
+        self.assignments = {}
+        self.lock = threading.Lock()
+        self.decoder = msgspec.msgpack.Decoder(type=EventHeader)
+        for chamber, worker in (pins or {}).items():
+            self.assignments[chamber] = worker % len(conns)
+
+    def worker(self, chamber: int) -> int:
+        """Returns the index of the worker running a chamber, assigning one if the chamber has not been used."""
+        try:
+            return self.assignments[chamber]
+        except KeyError:
+            counts = [0] * len(self.conns)
+            for worker in self.assignments.values():
+                counts[worker] += 1
+            worker = self.assignments[chamber] = counts.index(min(counts))
+            return worker
+
+    def send_bytes(self, data: bytes) -> None:
+        with self.lock:
+            if len(self.conns) == 1:
+                self.conns[0].send_bytes(data)
+                return
+            if not PybEvents.is_event_list(data):
+                header = self.decoder.decode(data)
+                event_type = PybEvents.registry.table().get(header.tag)
+                if event_type is not None and PybEvents.traits(event_type).task:
+                    self.conns[self.worker(header.chamber)].send_bytes(data)
+                    return
+            for conn in self.conns:
+                conn.send_bytes(data)
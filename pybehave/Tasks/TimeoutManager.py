@@ -1,15 +1,21 @@
+from __future__ import annotations
+
+import heapq
+import itertools
 import queue
 import time
-from collections import OrderedDict
 from queue import Queue
 from threading import Thread
 
+from pybehave.Utilities import Clock
+
 
 class Timeout:
 
     def __init__(self, name: str, chamber: int, duration: float, target, args):
         self.name = name
         self.chamber = str(chamber)
+        self.key = self.chamber + "/" + self.name
         self.duration = duration
         self.duration_ = self.duration
         self.target = target
@@ -17,19 +23,25 @@ class Timeout:
         self.start_time = None
         self.started = False
         self.elapsed_time = 0
+        self.generation = 0  # Incremented whenever the deadline changes so stale heap entries can be discarded
+        self.scheduled = None  # Clock time the Timeout was due to expire when it last fired
+        self.fired = None  # Clock time the Timeout actually fired
 
     def start(self):
         self.started = True
-        self.start_time = time.perf_counter()
+        self.start_time = Clock.now()
         self.elapsed_time = 0
+        self.generation += 1
 
     def pause(self):
-        self.elapsed_time = time.perf_counter() - self.start_time
+        self.elapsed_time = Clock.now() - self.start_time
         self.start_time = None
+        self.generation += 1
 
     def resume(self):
         self.duration_ = self.time_remaining()
-        self.start_time = time.perf_counter()
+        self.start_time = Clock.now()
+        self.generation += 1
 
     def reset(self, duration: float):
         self.duration = duration
@@ -39,63 +51,143 @@ class Timeout:
     def extend(self, duration: float):
         self.duration += duration
         self.duration_ += duration
+        self.generation += 1
 
     def time_remaining(self):
         if self.start_time is not None:
-            return self.duration_ - (time.perf_counter() - self.start_time)
+            return self.duration_ - (Clock.now() - self.start_time)
         else:
             return self.duration_ - self.elapsed_time
 
+    def deadline(self):
+        """Returns the Clock time when the timeout will expire or None if it is paused."""
+        if self.start_time is not None:
+            return self.start_time + self.duration_
+        else:
+            return None
+
     def execute(self):
         self.target(*self.args)
 
 
 class TimeoutManager(Thread):
+    """
+    Thread responsible for executing Timeouts once they expire.
+
+    Running Timeouts are scheduled in a min-heap ordered by deadline. Cancelling, pausing, extending, or resetting a
+    Timeout does not search the heap; instead the Timeout's generation is incremented so that any existing heap entries
+    are ignored when they reach the top (lazy deletion). Each wakeup therefore costs O(log n) in the number of active
+    Timeouts and expired Timeouts are executed in deadline order.
+
+    Blocking waits typically return up to a millisecond (or a scheduler tick) after the requested time. If precision is
+    non-zero, the manager instead wakes this many seconds before the next deadline and yields in a tight loop until it
+    is reached, trading CPU time for lower lateness. Each fired Timeout records when it was scheduled and actually fired.
 
-    def __init__(self):
+    With a VirtualClock the manager is not started as a thread. Instead, the TaskProcess advances the clock to
+    next_deadline and calls fire_expired whenever it is idle.
+
+    Parameters
+    ----------
+    precision : float
+        Seconds before each deadline at which to stop blocking and spin (0 to always block)
+    """
+
+    def __init__(self, precision: float = 0):
         super(TimeoutManager, self).__init__()
-        self.timeouts = OrderedDict()
+        self.precision = precision
+        self.timeouts = {}
         self.timeout_queue = Queue()
+        self.heap = []
+        self.counter = itertools.count()  # Tie-breaker so Timeouts with equal deadlines are never compared
 
     def run(self):
         while True:
             wait = None
-            for timeout in self.timeouts.values():
-                if wait is None:
-                    wait = timeout.time_remaining()
-                else:
-                    wait = min(wait, timeout.time_remaining())
+            if len(self.heap) > 0:
+                wait = max(self.heap[0][0] - Clock.now() - self.precision, 0)
 
             try:
-
                 event = self.timeout_queue.get(timeout=wait)
-
-                if isinstance(event, Timeout):
-                    self.timeouts[event.chamber + "/" + event.name] = event
-                    event.start()
-
-                if isinstance(event, tuple):
-                    if event[0] == "Reset":
-                        self.timeouts[event[1].chamber + "/" + event[1].name] = event[1]
-                        self.timeouts[event[1].chamber + "/" + event[1].name].start()
-                    elif event[0] == "Quit":
+                while True:
+                    if not self.handle_request(event):
                         return
-                    elif event[1] in self.timeouts:
-                        if event[0] == "Cancel":
-                            del self.timeouts[event[1]]
-                        elif event[0] == "Pause":
-                            self.timeouts[event[1]].pause()
-                        elif event[0] == "Resume":
-                            self.timeouts[event[1]].resume()
-                        elif event[0] == "Extend":
-                            self.timeouts[event[1]].extend(event[2])
+                    event = self.timeout_queue.get_nowait()
             except queue.Empty:
-                pass
-
-            for name in list(self.timeouts.keys()):
-                if self.timeouts[name].time_remaining() <= 0:
-                    self.timeouts[name].execute()
-                    del self.timeouts[name]
+                if self.precision > 0 and len(self.heap) > 0:
+                    self.spin(self.heap[0][0])
+
+            self.fire_expired()
+
+    def fire_expired(self) -> None:
+        now = Clock.now()
+        while len(self.heap) > 0 and self.heap[0][0] <= now:
+            deadline, _, timeout, generation = heapq.heappop(self.heap)
+            if self.is_current(timeout, generation):
+                del self.timeouts[timeout.key]
+                timeout.scheduled = deadline
+                timeout.fired = Clock.now()
+                timeout.execute()
+        self.discard_stale()
+
+    def next_deadline(self) -> float | None:
+        """
+        Handles any waiting requests and returns the earliest deadline or None if no Timeouts are running. Used to drive
+        the manager from the TaskProcess with a VirtualClock instead of running it as a thread.
+        """
+        try:
+            while True:
+                self.handle_request(self.timeout_queue.get_nowait())
+        except queue.Empty:
+            pass
+        self.discard_stale()
+        return self.heap[0][0] if len(self.heap) > 0 else None
+
+    def spin(self, deadline: float) -> None:
+        # Yield the GIL on every iteration so the TaskProcess is not starved while waiting
+        while Clock.now() < deadline and self.timeout_queue.empty():
+            time.sleep(0)
+
+    def handle_request(self, event) -> bool:
+        if isinstance(event, Timeout):
+            self.timeouts[event.key] = event
+            event.start()
+            self.schedule(event)
+        elif isinstance(event, tuple):
+            if event[0] == "Reset":
+                self.timeouts[event[1].key] = event[1]
+                event[1].start()
+                self.schedule(event[1])
+            elif event[0] == "Quit":
+                return False
+            elif event[1] in self.timeouts:
+                if event[0] == "Cancel":
+                    del self.timeouts[event[1]]
+                elif event[0] == "Pause":
+                    self.timeouts[event[1]].pause()
+                elif event[0] == "Resume":
+                    self.timeouts[event[1]].resume()
+                    self.schedule(self.timeouts[event[1]])
+                elif event[0] == "Extend":
+                    self.timeouts[event[1]].extend(event[2])
+                    self.schedule(self.timeouts[event[1]])
+        return True
+
+    def schedule(self, timeout: Timeout) -> None:
+        deadline = timeout.deadline()
+        if deadline is not None:
+            heapq.heappush(self.heap, (deadline, next(self.counter), timeout, timeout.generation))
+
+    def is_current(self, timeout: Timeout, generation: int) -> bool:
+        return self.timeouts.get(timeout.key) is timeout and timeout.generation == generation
+
+    def discard_stale(self) -> None:
+        # Drop invalidated entries from the top so the next wait is computed from a live deadline
+        while len(self.heap) > 0 and not self.is_current(self.heap[0][2], self.heap[0][3]):
+            heapq.heappop(self.heap)
+        # Rebuild the heap if invalidated entries dominate to keep memory bounded
+        if len(self.heap) > 2 * len(self.timeouts) + 64:
+            self.heap = [entry for entry in self.heap if self.is_current(entry[2], entry[3])]
+            heapq.heapify(self.heap)
 
     def add_timeout(self, timeout: Timeout):
         self.timeout_queue.put(timeout)
@@ -0,0 +1,50 @@
+from __future__ import annotations
+
+import time
+
+
+class Clock:
+    """
+    Source of time for tasks and timeouts within a TaskProcess. Time is read from time.perf_counter().
+    """
+    virtual = False
+
+    def now(self) -> float:
+        return time.perf_counter()
+
+
+class VirtualClock(Clock):
+    """
+    Clock that only advances when explicitly moved forward.
+
+    The TaskProcess jumps a VirtualClock straight to the next timeout or heartbeat whenever no events are waiting to be
+    handled, so sessions run as fast as the task logic allows.
+
+    Parameters
+    ----------
+    start : float
+        Initial time in seconds (tasks treat a start time of 0 as not having started)
+    """
+    virtual = True
+
+    def __init__(self, start: float = 1):
+        self.time = start
+
+    def now(self) -> float:
+        return self.time
+
+    def advance_to(self, t: float) -> None:
+        if t > self.time:
+            self.time = t
+
+
+clock = Clock()  # Clock used by the current process
+
+
+def now() -> float:
+    return clock.now()
+
+
+def set_clock(new_clock: Clock) -> None:
+    global clock
+    clock = new_clock
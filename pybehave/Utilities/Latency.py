@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+import math
+import time
+from typing import Dict
+
+import msgspec
+
+# Hops are recorded in this order as an input propagates from a Source through the task to a hardware output
+HOPS = ("source_receive", "pipe_send", "task_decode", "main_loop", "write_component", "source_flush", "hardware_write")
+TRACE_KEY = "latency"  # Key in event metadata holding the trace of hop timestamps
+MIN_LATENCY = 1e-6
+BUCKETS_PER_DECADE = 20
+N_DECADES = 8
+
+
+def stamp(metadata: Dict, hop: str) -> None:
+    """Records the current time for a hop if the event is being traced."""
+    if TRACE_KEY in metadata:
+        metadata[TRACE_KEY][hop] = time.perf_counter()
+
+
+class LatencyHistogram:
+    """
+    Histogram of latencies in logarithmically spaced buckets from 1 µs to 100 s.
+
+    Percentiles are reported as the upper edge of the bucket containing them (at most 12% above the true value).
+    """
+
+    def __init__(self):
+        self.counts = [0] * (BUCKETS_PER_DECADE * N_DECADES + 1)
+        self.count = 0
+        self.max = 0
+
+    def add(self, latency: float) -> None:
+        if latency <= MIN_LATENCY:
+            i = 0
+        else:
+            i = min(int(math.log10(latency / MIN_LATENCY) * BUCKETS_PER_DECADE) + 1, len(self.counts) - 1)
+        self.counts[i] += 1
+        self.count += 1
+        if latency > self.max:
+            self.max = latency
+
+    def percentile(self, p: float) -> float:
+        target = p / 100 * self.count
+        total = 0
+        for i, c in enumerate(self.counts):
+            total += c
+            if total >= target and total > 0:
+                return min(MIN_LATENCY * 10 ** (i / BUCKETS_PER_DECADE), self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        return {"count": self.count, "p50": self.percentile(50), "p99": self.percentile(99), "max": self.max}
+
+
+class LatencyMonitor:
+    """
+    Aggregates completed traces into per-chamber histograms of the time spent reaching each hop and the end-to-end total.
+    """
+
+    def __init__(self):
+        self.histograms = {}
+
+    def add(self, chamber: int, name: str, latency: float) -> None:
+        self.histograms.setdefault(chamber, {}).setdefault(name, LatencyHistogram()).add(latency)
+
+    def record(self, chamber: int, trace: Dict[str, float]) -> None:
+        first = last = None
+        for hop in HOPS:
+            if hop in trace:
+                if last is not None:
+                    self.add(chamber, hop, trace[hop] - trace[last])
+                else:
+                    first = hop
+                last = hop
+        if first is not None and first != last:
+            self.add(chamber, "total", trace[last] - trace[first])
+
+    def reset(self, chamber: int) -> None:
+        self.histograms.pop(chamber, None)
+
+    def report(self, chamber: int = None) -> Dict[int, Dict[str, Dict[str, float]]]:
+        """Returns the count, p50, p99 and max latency in seconds for each hop in every chamber (or a single chamber)."""
+        chambers = self.histograms if chamber is None else {chamber: self.histograms.get(chamber, {})}
+        return {c: {hop: h.summary() for hop, h in hists.items()} for c, hists in chambers.items()}
+
+    def write(self, path: str, chamber: int) -> None:
+        """Writes the latency report for a chamber to a JSON file."""
+        with open(path, "wb") as f:
+            f.write(msgspec.json.format(msgspec.json.encode(self.report(chamber)[chamber])))
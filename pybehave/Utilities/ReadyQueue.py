@@ -0,0 +1,40 @@
+import collections
+import threading
+from multiprocessing import Pipe
+
+
+class ReadyQueue:
+    """
+    Thread-safe queue for handing native objects to a process event loop without serializing them.
+
+    Items are stored in a deque and a single wake byte is written to a one-way Pipe the first time the queue becomes
+    non-empty. The reading end of the Pipe can be passed to multiprocessing.connection.wait alongside other connections.
+    """
+
+    def __init__(self):
+        self.items = collections.deque()
+        self.reader, self.writer = Pipe(False)
+        self.lock = threading.Lock()
+        self.signalled = False
+
+    def put(self, item):
+        self.items.append(item)
+        with self.lock:
+            if not self.signalled:
+                self.signalled = True
+                self.writer.send_bytes(b'\x00')
+
+    def get_all(self):
+        """Clears the wake signal and returns all queued items in the order they were added."""
+        with self.lock:
+            if self.signalled:
+                self.reader.recv_bytes()
+                self.signalled = False
+        items = []
+        while len(self.items) > 0:
+            items.append(self.items.popleft())
+        return items
+
+    def close(self):
+        self.reader.close()
+        self.writer.close()
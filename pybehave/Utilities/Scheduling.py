@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import ast
+import ctypes
+import ctypes.util
+import os
+import sys
+import warnings
+from typing import Dict, List
+
+import msgspec
+import psutil
+
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+DEFAULT_RT_PRIORITY = 50
+
+
+class SchedulingPolicy(msgspec.Struct, kw_only=True):
+    """
+    Scheduling settings applied to a pybehave process.
+
+    Attributes
+    ----------
+    policy : str
+        One of "normal" (unchanged, or the default policy for processes applied with reset), "high", "realtime",
+        "fifo" or "rr". On Linux "realtime" and "fifo" use SCHED_FIFO and "rr" uses SCHED_RR. On Windows all real-time
+        policies use REALTIME_PRIORITY_CLASS.
+    priority : int
+        Priority for SCHED_FIFO/SCHED_RR (1-99, defaults to 50)
+    cpus : list
+        Indices of the cores the process may run on (empty to allow all cores)
+    mlockall : bool
+        True if all current and future memory should be locked to prevent page faults (Linux only)
+    """
+    policy: str = "normal"
+    priority: int = DEFAULT_RT_PRIORITY
+    cpus: List[int] = []
+    mlockall: bool = False
+
+
+def from_setting(value: str | Dict, default: SchedulingPolicy = None) -> SchedulingPolicy:
+    """Creates a SchedulingPolicy from a dictionary or its string representation stored in pybehave.ini."""
+    if value is None:
+        return default or SchedulingPolicy()
+    if isinstance(value, str):
+        value = ast.literal_eval(value)
+    return msgspec.convert(value, SchedulingPolicy)
+
+
+def policy_for(scheduling: Dict[str, SchedulingPolicy], role: str, instance: int | str = None) -> SchedulingPolicy:
+    """
+    Returns the SchedulingPolicy configured for a process.
+
+    Parameters
+    ----------
+    scheduling : dict
+        Policies keyed by role or by role_INSTANCE for policies configured per process
+    role : str
+        The type of process (gui, task_process or source)
+    instance : int or str
+        The index of the TaskProcess worker or name of the Source if policies are configured per process
+    """
+    if instance is not None and "{}_{}".format(role, instance) in scheduling:
+        return scheduling["{}_{}".format(role, instance)]
+    return scheduling.get(role)
+
+
+def apply(sp: SchedulingPolicy, name: str = "pybehave", reset: bool = False) -> None:
+    """
+    Applies a SchedulingPolicy to the calling process. Settings that are unsupported on this platform or cannot be applied
+    due to insufficient privileges raise a warning and are otherwise skipped. Child processes inherit the scheduling
+    policy and affinity of the process that started them so they should set reset to return to the default policy and
+    all cores when their own policy does not configure them.
+    """
+    if sp is None:
+        if not reset:
+            return
+        sp = SchedulingPolicy()
+    if sp.policy != "normal":
+        try:
+            set_priority(sp.policy, sp.priority)
+        except (PermissionError, psutil.AccessDenied):
+            warnings.warn(f"Insufficient privileges to apply the '{sp.policy}' scheduling policy to {name}", RuntimeWarning)
+        except (OSError, AttributeError, ValueError) as e:
+            warnings.warn(f"Unable to apply the '{sp.policy}' scheduling policy to {name}: {e}", RuntimeWarning)
+    elif reset:
+        try:
+            reset_priority()
+        except (OSError, AttributeError, psutil.Error) as e:
+            warnings.warn(f"Unable to reset the scheduling policy of {name}: {e}", RuntimeWarning)
+    if len(sp.cpus) > 0:
+        try:
+            if hasattr(os, "sched_setaffinity"):
+                os.sched_setaffinity(0, sp.cpus)
+            else:
+                psutil.Process().cpu_affinity(sp.cpus)
+        except (OSError, AttributeError, ValueError, psutil.Error) as e:
+            warnings.warn(f"Unable to pin {name} to cores {sp.cpus}: {e}", RuntimeWarning)
+    elif reset and hasattr(psutil.Process, "cpu_affinity"):
+        # Platforms without CPU affinity (e.g. macOS) never restrict the cores a process may run on
+        try:
+            psutil.Process().cpu_affinity([])  # An empty list allows every core
+        except (OSError, AttributeError, ValueError, psutil.Error) as e:
+            warnings.warn(f"Unable to reset the cores {name} may run on: {e}", RuntimeWarning)
+    if sp.mlockall:
+        try:
+            lock_memory()
+        except OSError as e:
+            warnings.warn(f"Unable to lock the memory of {name}: {e}", RuntimeWarning)
+
+
+def set_priority(policy: str, priority: int) -> None:
+    p = psutil.Process()
+    if sys.platform == 'win32':
+        if policy == "high":
+            p.nice(psutil.HIGH_PRIORITY_CLASS)
+        elif policy in ("realtime", "fifo", "rr"):
+            p.nice(psutil.REALTIME_PRIORITY_CLASS)
+        else:
+            raise ValueError(f"Unknown scheduling policy '{policy}'")
+    elif policy == "high":
+        p.nice(-10)
+    elif policy in ("realtime", "fifo", "rr"):
+        if not hasattr(os, "sched_setscheduler"):
+            raise AttributeError("real-time scheduling policies are not supported on this platform")
+        sched = os.SCHED_RR if policy == "rr" else os.SCHED_FIFO
+        os.sched_setscheduler(0, sched, os.sched_param(priority))
+    else:
+        raise ValueError(f"Unknown scheduling policy '{policy}'")
+
+
+def reset_priority() -> None:
+    """Returns the calling process to the default scheduling policy and priority."""
+    p = psutil.Process()
+    if sys.platform == 'win32':
+        if p.nice() != psutil.NORMAL_PRIORITY_CLASS:
+            p.nice(psutil.NORMAL_PRIORITY_CLASS)
+        return
+    if hasattr(os, "sched_getscheduler") and os.sched_getscheduler(0) != os.SCHED_OTHER:
+        os.sched_setscheduler(0, os.SCHED_OTHER, os.sched_param(0))
+    if p.nice() < 0:
+        p.nice(0)
+
+
+def lock_memory() -> None:
+    if not sys.platform.startswith('linux'):
+        raise OSError("mlockall is only supported on Linux")
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    if libc.mlockall(MCL_CURRENT | MCL_FUTURE) != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+import struct
+import threading
+from multiprocessing import shared_memory
+from typing import Any
+
+import msgspec
+import numpy as np
+
+from pybehave.Events import PybEvents
+
+SHARED_ARRAY_TYPE_CODE = 2
+HEADER_SIZE = 64  # Write and read counters are kept on separate halves of a cache line sized header
+COUNTER = struct.Struct('<Q')
+READ_OFFSET = 32
+
+
+class SharedArrayReference(msgspec.Struct, gc=False, array_like=True):
+    offset: int
+    nbytes: int
+    end: int
+    dtype: str
+    shape: tuple
+
+
+shared_array_encoder = msgspec.msgpack.Encoder()
+shared_array_decoder = msgspec.msgpack.Decoder(type=SharedArrayReference)
+
+
+class SharedRingBuffer:
+    """
+    Single-producer/single-consumer ring buffer in shared memory for passing large NumPy arrays between processes.
+
+    The producer copies array data into the ring and encodes a small SharedArrayReference in its place. The message
+    carrying the reference is still sent over the existing Pipe which acts as the doorbell for the consumer so
+    multiprocessing.connection.wait continues to work unchanged. The consumer copies the data out of the ring and
+    advances the read counter. The producer only writes the write counter and the consumer only writes the read counter
+    so no lock is shared between processes. If the ring is full or the array is smaller than min_bytes, the array is
+    encoded inline as usual.
+
+    Parameters
+    ----------
+    name : str
+        The name of an existing shared memory block to attach to (None to create a new block)
+    size : int
+        Capacity of the ring in bytes when creating a new block
+    min_bytes : int
+        Arrays smaller than this are encoded inline
+    """
+
+    def __init__(self, name: str = None, size: int = 0, min_bytes: int = 65536):
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=HEADER_SIZE + size)
+            self.shm.buf[:HEADER_SIZE] = bytes(HEADER_SIZE)
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        self.name = self.shm.name
+        self.capacity = self.shm.size - HEADER_SIZE
+        self.min_bytes = min_bytes
+        self.lock = threading.Lock()
+
+    def write(self, data: memoryview) -> tuple[int, int] | None:
+        """Copies data into the ring and returns its offset and the write counter after the copy or None if full."""
+        n = data.nbytes
+        with self.lock:
+            write_index = COUNTER.unpack_from(self.shm.buf, 0)[0]
+            read_index = COUNTER.unpack_from(self.shm.buf, READ_OFFSET)[0]
+            free = self.capacity - (write_index - read_index)
+            pos = write_index % self.capacity
+            # Records are contiguous so skip to the start of the ring if the end is too small
+            pad = self.capacity - pos if pos + n > self.capacity else 0
+            if pad + n > free:
+                return None
+            write_index += pad
+            pos = write_index % self.capacity
+            self.shm.buf[HEADER_SIZE + pos:HEADER_SIZE + pos + n] = data.cast('B')
+            write_index += n
+            COUNTER.pack_into(self.shm.buf, 0, write_index)
+            return pos, write_index
+
+    def read(self, ref: SharedArrayReference) -> np.ndarray:
+        """Copies the referenced array out of the ring and releases its space to the producer."""
+        start = HEADER_SIZE + ref.offset
+        arr = np.frombuffer(self.shm.buf[start:start + ref.nbytes], dtype=ref.dtype).reshape(ref.shape).copy()
+        COUNTER.pack_into(self.shm.buf, READ_OFFSET, ref.end)
+        return arr
+
+    def enc_hook(self, obj: Any) -> Any:
+        if isinstance(obj, np.ndarray) and obj.nbytes >= self.min_bytes:
+            loc = self.write(memoryview(np.ascontiguousarray(obj)))
+            if loc is not None:
+                return msgspec.msgpack.Ext(SHARED_ARRAY_TYPE_CODE, shared_array_encoder.encode(
+                    SharedArrayReference(offset=loc[0], nbytes=obj.nbytes, end=loc[1], dtype=obj.dtype.str,
+                                         shape=obj.shape)))
+        return PybEvents.enc_hook(obj)
+
+    def ext_hook(self, code: int, data: memoryview) -> Any:
+        if code == SHARED_ARRAY_TYPE_CODE:
+            return self.read(shared_array_decoder.decode(data))
+        return PybEvents.ext_hook(code, data)
+
+    def writable_ext_hook(self, code: int, data: memoryview) -> Any:
+        """Variant of ext_hook that also copies arrays sent over the Pipe (arrays in the ring are always copied)."""
+        if code == SHARED_ARRAY_TYPE_CODE:
+            return self.read(shared_array_decoder.decode(data))
+        return PybEvents.writable_ext_hook(code, data)
+
+    def close(self) -> None:
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
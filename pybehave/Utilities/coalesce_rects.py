@@ -0,0 +1,37 @@
+from typing import List, Sequence, Tuple
+
+
+def overlaps(a: Sequence[int], b: Sequence[int]) -> bool:
+    """True if two rectangles share any area or one contains the other."""
+    if a[0] < b[0] + b[2] and b[0] < a[0] + a[2] and a[1] < b[1] + b[3] and b[1] < a[1] + a[3]:
+        return True
+    return contains(a, b) or contains(b, a)
+
+
+def contains(outer: Sequence[int], inner: Sequence[int]) -> bool:
+    return (outer[0] <= inner[0] and outer[1] <= inner[1] and inner[0] + inner[2] <= outer[0] + outer[2] and
+            inner[1] + inner[3] <= outer[1] + outer[3])
+
+
+def coalesce_rects(rects: Sequence[Sequence[int]]) -> List[Tuple[int, int, int, int]]:
+    """
+    Merges overlapping rectangles so each area of the display is only updated once per frame. Rectangles are given as
+    (x, y, width, height) sequences such as pygame Rects and returned as tuples that can be passed to
+    pygame.display.update.
+    """
+    merged = []
+    for rect in sorted((tuple(r) for r in rects), key=lambda r: (r[1], r[0])):
+        i = 0
+        while i < len(merged):
+            if overlaps(rect, merged[i]):
+                other = merged.pop(i)
+                left, top = min(rect[0], other[0]), min(rect[1], other[1])
+                right = max(rect[0] + rect[2], other[0] + other[2])
+                bottom = max(rect[1] + rect[3], other[1] + other[3])
+                rect = (left, top, right - left, bottom - top)
+                # The union may overlap rectangles that were already checked so every rectangle is checked again
+                i = 0
+            else:
+                i += 1
+        merged.append(rect)
+    return merged
@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+import importlib
+import multiprocessing
+from multiprocessing.connection import Connection
+from typing import TYPE_CHECKING, List
+
+if TYPE_CHECKING:
+    from pybehave.Sources.Source import Source
+
+
+def create_source(code: str) -> Source:
+    """Instantiates a Source from its constructor code as stored in the settings (e.g. "OSControllerSource('COM3')")."""
+    segs = code.split('(', 1)
+    try:
+        source_type = getattr(importlib.import_module("pybehave.Sources." + segs[0]), segs[0])
+    except ModuleNotFoundError:
+        source_type = getattr(importlib.import_module("Local.Sources." + segs[0]), segs[0])
+    args = eval("(" + segs[1])
+    if not isinstance(args, tuple):  # A single argument is not evaluated as a tuple
+        args = (args,)
+    return source_type(*args)
+
+
+def connect_source(source: Source, n_task_processes: int) -> List[Connection]:
+    """
+    Creates a Pipe between the Source and each TaskProcess worker.
+
+    Parameters
+    ----------
+    source : Source
+        The Source to connect
+    n_task_processes : int
+        The number of TaskProcess workers
+
+    Returns
+    -------
+    list
+        The TaskProcess end of each Pipe ordered by worker
+    """
+    tpqs = []
+    source.queues = []
+    for _ in range(n_task_processes):
+        tpq, sourceq = multiprocessing.Pipe()
+        tpqs.append(tpq)
+        source.queues.append(sourceq)
+    source.queue = source.queues[0]
+    return tpqs
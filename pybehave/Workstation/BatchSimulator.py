@@ -0,0 +1,231 @@
+from __future__ import annotations
+
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import runpy
+import statistics
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import msgspec
+
+from pybehave.Utilities.create_source import create_source
+from pybehave.Workstation.LocalSession import LocalSession
+
+SUBJECT_SOURCE = "subject"  # Name address files use to connect Components to the VirtualSubject
+
+
+class SimulationConfig(msgspec.Struct, kw_only=True):
+    """
+    Configuration for a batch of simulated sessions loaded from a TOML file.
+
+    Attributes
+    ----------
+    root : str
+        Folder containing the Local package with Tasks and Sources. Defaults to Desktop/py-behav.
+    task : str
+        Name of the Task class
+    subject : str
+        Constructor code for the VirtualSubject modelling responses (e.g. "LeverPresser(0.5)")
+    address_file : str
+        AddressFile connecting the task's Components to the VirtualSubject through a Source named "subject"
+    protocol : str
+        Protocol providing constants shared by every session
+    grid : dict
+        Values to sweep for each constant. Every combination is simulated.
+    repeats : int
+        Number of sessions for each combination of constants
+    seed : int
+        Seed of the first session. Each session is seeded with seed plus its index.
+    time_limit : float
+        Seconds of simulated time after which a session that has not completed is stopped
+    wall_limit : float
+        Seconds of real time after which a session that has not completed is abandoned
+    loggers : str
+        EventLoggers for every session in the same format as a chamber configuration file
+    output : str
+        Folder for the per-session outputs and summary
+    processes : int
+        Number of sessions simulated in parallel (defaults to the number of CPUs)
+    """
+    root: Optional[str] = None
+    task: str
+    subject: str
+    address_file: str = ""
+    protocol: str = ""
+    grid: Dict[str, List[Any]] = {}
+    repeats: int = 1
+    seed: int = 0
+    time_limit: Optional[float] = None
+    wall_limit: Optional[float] = None
+    loggers: str = "CSVEventLogger((||csv||))"
+    output: str = "simulations"
+    processes: Optional[int] = None
+
+
+def load_config(path: str) -> SimulationConfig:
+    """Loads a SimulationConfig from a TOML file resolving any relative paths against the folder containing it."""
+    with open(path, "rb") as f:
+        config = msgspec.toml.decode(f.read(), type=SimulationConfig)
+    folder = os.path.dirname(os.path.abspath(path))
+    if config.root is None:
+        config.root = os.path.join(os.path.expanduser('~'), 'Desktop', 'py-behav')
+    for field in ("root", "address_file", "protocol", "output"):
+        value = getattr(config, field)
+        if value:
+            setattr(config, field, os.path.join(folder, os.path.expanduser(value)))
+    return config
+
+
+class SessionSpec(msgspec.Struct):
+    """A single simulated session."""
+    index: int
+    repeat: int
+    seed: int
+    constants: Dict[str, Any]
+
+
+def expand_grid(config: SimulationConfig) -> List[SessionSpec]:
+    """Returns a session for every repeat of every combination of constants in the grid."""
+    names = list(config.grid)
+    sessions = []
+    for values in itertools.product(*(config.grid[name] for name in names)):
+        for repeat in range(config.repeats):
+            index = len(sessions)
+            sessions.append(SessionSpec(index, repeat, config.seed + index, dict(zip(names, values))))
+    return sessions
+
+
+class SimulatedSession:
+    """
+    A single session of a batch simulation run as a LocalSession with simulated time.
+
+    Parameters
+    ----------
+    config : SimulationConfig
+        Settings shared by every session
+    spec : SessionSpec
+        The session to run
+    """
+
+    def __init__(self, config: SimulationConfig, spec: SessionSpec):
+        self.config = config
+        self.spec = spec
+        self.folder = os.path.join(config.output, "session_{:05d}".format(spec.index))
+        self.subject = create_source(config.subject)
+        self.subject.seed(spec.seed)
+        if config.time_limit is not None:
+            self.subject.time_limit = config.time_limit
+
+    def write_protocol(self) -> str:
+        # Constants reach the task through a protocol so they are set before the task is initialized
+        constants = {}
+        if self.config.protocol:
+            constants.update(runpy.run_path(self.config.protocol)['protocol'])
+        constants.update(self.spec.constants)
+        path = os.path.join(self.folder, "protocol.py")
+        with open(path, "w") as f:
+            f.write("protocol = {!r}\n".format(constants))
+        return path
+
+    def run(self) -> Dict[str, Any]:
+        os.makedirs(self.folder, exist_ok=True)
+        metadata = {"subject": "simulated{}".format(self.spec.index), "protocol": self.write_protocol(),
+                    "address_file": self.config.address_file}
+        session = LocalSession(self.config.task, metadata, self.folder, {SUBJECT_SOURCE: self.subject},
+                               self.config.loggers, True, self.config.wall_limit)
+        session.run()
+        summary = {"session": self.spec.index, "repeat": self.spec.repeat, "seed": self.spec.seed,
+                   **self.spec.constants, "completed": session.completed, "elapsed": session.elapsed,
+                   "wall_time": session.wall_time, "error": session.error}
+        summary.update(session.counts)
+        summary.update(self.subject.summary())
+        return summary
+
+
+def initialize_worker(root: str) -> None:
+    sys.path.insert(0, root)
+
+
+def run_session(args) -> Dict[str, Any]:
+    config, spec = args
+    return SimulatedSession(config, spec).run()
+
+
+def summarize(sessions: List[Dict[str, Any]], constants: List[str]) -> List[Dict[str, Any]]:
+    """Aggregates numeric results across the repeats of each combination of constants."""
+    groups = {}
+    for session in sessions:
+        groups.setdefault(tuple(repr(session[name]) for name in constants), []).append(session)
+    summary = []
+    for group in groups.values():
+        entry = {name: group[0][name] for name in constants}
+        entry["sessions"] = len(group)
+        entry["errors"] = sum(session["error"] is not None for session in group)
+        keys = []
+        for session in group:
+            keys.extend(key for key in session if key not in keys)
+        for key in keys:
+            if key in constants or key in ("session", "repeat", "seed", "error"):
+                continue
+            values = [float(session.get(key, 0)) for session in group
+                      if isinstance(session.get(key, 0), (int, float))]
+            if len(values) == len(group):
+                entry[key] = {"mean": statistics.fmean(values),
+                              "std": statistics.stdev(values) if len(values) > 1 else 0.0,
+                              "min": min(values), "max": max(values)}
+        summary.append(entry)
+    return summary
+
+
+class BatchSimulator:
+    """
+    Simulates a task with a VirtualSubject for every combination of constants in a grid across a pool of processes.
+
+    Each session runs with simulated time and saves the output of its EventLoggers and the protocol it used to its own
+    folder. Results for every session are saved to sessions.csv and statistics across the repeats of each combination of
+    constants to summary.json.
+
+    Parameters
+    ----------
+    config : SimulationConfig
+        The batch to simulate
+    """
+
+    def __init__(self, config: SimulationConfig):
+        self.config = config
+        self.sessions = []
+        self.summary = []
+
+    def run(self) -> List[Dict[str, Any]]:
+        specs = expand_grid(self.config)
+        os.makedirs(self.config.output, exist_ok=True)
+        print("Simulating {} sessions of {}".format(len(specs), self.config.task))
+        start = time.perf_counter()
+        with multiprocessing.Pool(self.config.processes, initialize_worker, (self.config.root,)) as pool:
+            for result in pool.imap_unordered(run_session, [(self.config, spec) for spec in specs]):
+                self.sessions.append(result)
+                if result["error"] is not None:
+                    print("Session {} failed:\n{}".format(result["session"], result["error"]))
+                if len(self.sessions) % 100 == 0 or len(self.sessions) == len(specs):
+                    print("{}/{} sessions complete".format(len(self.sessions), len(specs)))
+        print("Simulated {} sessions in {:.1f}s".format(len(specs), time.perf_counter() - start))
+        self.sessions.sort(key=lambda session: session["session"])
+        self.summary = summarize(self.sessions, list(self.config.grid))
+        self.save()
+        return self.summary
+
+    def save(self) -> None:
+        fields = []
+        for session in self.sessions:
+            fields.extend(key for key in session if key not in fields)
+        with open(os.path.join(self.config.output, "sessions.csv"), "w", newline="") as f:
+            writer = csv.DictWriter(f, fields)
+            writer.writeheader()
+            writer.writerows(self.sessions)
+        with open(os.path.join(self.config.output, "summary.json"), "w") as f:
+            json.dump(self.summary, f, indent=2, default=repr)
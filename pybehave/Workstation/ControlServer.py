@@ -0,0 +1,262 @@
+from __future__ import annotations
+
+import asyncio
+import ipaddress
+import os
+import socket
+import struct
+import threading
+from typing import Callable, Dict, List, Set, Type
+
+import msgspec
+
+from pybehave.Events import PybEvents
+from pybehave.Utilities.create_task import create_task
+
+FRAME_HEADER = struct.Struct('<I')  # Every frame is prefixed with the length of the encoded events
+MAX_QUEUED_FRAMES = 1024  # Frames buffered for a subscriber before further events are dropped
+
+# Events clients may send that are forwarded to the TaskProcess
+COMMANDS = (PybEvents.AddTaskEvent, PybEvents.OutputFileChangedEvent, PybEvents.StartEvent, PybEvents.PauseEvent,
+            PybEvents.ResumeEvent, PybEvents.StopEvent, PybEvents.ClearEvent, PybEvents.ConstantsUpdateEvent,
+            PybEvents.ConstantRemoveEvent, PybEvents.AddLoggerEvent, PybEvents.RemoveLoggerEvent, PybEvents.GUIEvent,
+            PybEvents.LatencyQueryEvent)
+
+
+def parse_address(address: str):
+    """Returns the host and port for a TCP address (HOST:PORT) or None if the address is a Unix socket path."""
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit() and os.path.sep not in host:
+        return host.strip("[]") or "127.0.0.1", int(port)
+    return None
+
+
+def is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class Subscriber:
+    """A connected client and the events it is subscribed to."""
+
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.subscribed = False
+        self.chambers = set()
+        self.events = set()
+        self.frames = asyncio.Queue(MAX_QUEUED_FRAMES)
+        self.dropped = 0
+
+    def subscribe(self, event: PybEvents.SubscribeEvent) -> None:
+        self.subscribed = True
+        self.chambers = set(event.chambers)
+        self.events = set(event.events)
+
+    def matches(self, event: PybEvents.PybEvent) -> bool:
+        if len(self.events) > 0 and type(event).__name__ not in self.events:
+            return False
+        if len(self.chambers) > 0:
+            return PybEvents.traits(type(event)).task and event.chamber in self.chambers
+        return True
+
+    def send(self, frame: bytes) -> None:
+        try:
+            self.frames.put_nowait(frame)
+        except asyncio.QueueFull:
+            # Slow clients lose events rather than delaying the Workstation
+            self.dropped += 1
+
+    async def drain(self) -> None:
+        while True:
+            frame = await self.frames.get()
+            self.writer.write(frame)
+            await self.writer.drain()
+
+
+class ControlServer(threading.Thread):
+    """
+    Local server for controlling tasks and streaming their events from other programs.
+
+    Clients connect over localhost TCP or a Unix socket and exchange frames holding msgpack encoded PybEvents (or lists
+    of PybEvents) prefixed by their length as a little-endian uint32. Commands are forwarded to the TaskProcess exactly
+    as if they were sent by the Workstation. After sending a SubscribeEvent, a client receives every event the
+    TaskProcess reports for the chambers and event types it selected as lists of PybEvents until it sends an
+    UnsubscribeEvent. Rejected frames are answered with an ErrorEvent.
+
+    The server runs an asyncio event loop on its own thread so it never blocks rendering or event handling.
+
+    Parameters
+    ----------
+    address : str
+        HOST:PORT to listen on localhost TCP (the host must be a loopback address) or the path of a Unix socket that
+        only the current user may connect to
+    send : callable
+        Forwards encoded events to the TaskProcess
+    handlers : dict
+        Callbacks for additional event types clients may send that are handled locally rather than forwarded
+    """
+
+    def __init__(self, address: str, send: Callable[[bytes], None],
+                 handlers: Dict[Type[PybEvents.PybEvent], Callable[[PybEvents.PybEvent], None]] = None):
+        super().__init__(daemon=True)
+        self.address = address
+        self.forward = send
+        self.handlers = handlers or {}
+        self.subscribers: Set[Subscriber] = set()
+        self.loop = None
+        self.stopped = None
+        self.ready = threading.Event()
+        self.error = None  # Exception that stopped the server, for example if the address could not be bound
+        self.encoder = msgspec.msgpack.Encoder(enc_hook=PybEvents.enc_hook)
+        self.decoder = PybEvents.EventDecoder()
+        self.list_decoder = PybEvents.EventDecoder(many=True)
+
+    def run(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        try:
+            self.loop.run_until_complete(self.serve())
+        except BaseException as e:
+            self.error = e
+        finally:
+            self.ready.set()
+            self.loop.close()
+
+    def wait_ready(self) -> None:
+        """Waits until the server is listening and raises any error that prevented it from starting."""
+        self.ready.wait()
+        if self.error is not None:
+            raise self.error
+
+    async def serve(self) -> None:
+        self.stopped = self.loop.create_future()
+        tcp = parse_address(self.address)
+        if tcp is not None:
+            # Clients can run arbitrary code through protocols and constants so only local connections are accepted
+            if not is_loopback(tcp[0]):
+                raise ValueError("The control server only listens on loopback addresses (127.0.0.0/8, ::1 or "
+                                 "localhost), not {}".format(tcp[0]))
+            server = await asyncio.start_server(self.handle_client, *tcp)
+        else:
+            if os.path.exists(self.address):
+                os.remove(self.address)  # Stale socket from a previous session
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.bind(self.address)
+                # Only the owner may connect and no connection is accepted before the permissions are set
+                os.chmod(self.address, 0o600)
+            except BaseException:
+                sock.close()
+                raise
+            server = await asyncio.start_unix_server(self.handle_client, sock=sock)
+        self.ready.set()
+        async with server:
+            await self.stopped
+        for subscriber in list(self.subscribers):
+            subscriber.writer.close()
+        if tcp is None and os.path.exists(self.address):
+            os.remove(self.address)
+
+    def publish(self, events: List[PybEvents.PybEvent]) -> None:
+        """Sends events to all subscribed clients. Can be called from any thread."""
+        if len(self.subscribers) > 0 and self.loop is not None:
+            self.loop.call_soon_threadsafe(self.publish_, events)
+
+    def publish_(self, events: List[PybEvents.PybEvent]) -> None:
+        for subscriber in self.subscribers:
+            if subscriber.subscribed:
+                selected = [event for event in events if subscriber.matches(event)]
+                if len(selected) > 0:
+                    subscriber.send(self.frame(selected))
+
+    def frame(self, events) -> bytes:
+        data = self.encoder.encode(events)
+        return FRAME_HEADER.pack(len(data)) + data
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        subscriber = Subscriber(writer)
+        self.subscribers.add(subscriber)
+        sender = create_task(subscriber.drain())
+        try:
+            while True:
+                header = await reader.readexactly(FRAME_HEADER.size)
+                data = await reader.readexactly(FRAME_HEADER.unpack(header)[0])
+                try:
+                    if PybEvents.is_event_list(data):
+                        events = self.list_decoder.decode(data)
+                    else:
+                        events = (self.decoder.decode(data),)
+                    for event in events:
+                        self.handle_event(subscriber, event)
+                except (msgspec.DecodeError, ValueError) as e:
+                    subscriber.send(self.frame([PybEvents.ErrorEvent(type(e).__name__, str(e))]))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.subscribers.discard(subscriber)
+            sender.cancel()
+            writer.close()
+
+    def handle_event(self, subscriber: Subscriber, event: PybEvents.PybEvent) -> None:
+        if isinstance(event, PybEvents.SubscribeEvent):
+            subscriber.subscribe(event)
+        elif isinstance(event, PybEvents.UnsubscribeEvent):
+            subscriber.subscribed = False
+        elif type(event) in self.handlers:
+            self.handlers[type(event)](event)
+        elif isinstance(event, COMMANDS):
+            self.forward(self.encoder.encode(event))
+        else:
+            raise ValueError("{} cannot be sent to the control server".format(type(event).__name__))
+
+    def stop(self) -> None:
+        if self.loop is not None and self.stopped is not None:
+            self.loop.call_soon_threadsafe(self.stopped.set_result, None)
+        self.join()
+
+
+class ControlClient:
+    """
+    Minimal blocking client for a ControlServer.
+
+    Parameters
+    ----------
+    address : str
+        HOST:PORT or Unix socket path the server is listening on
+    """
+
+    def __init__(self, address: str):
+        tcp = parse_address(address)
+        if tcp is not None:
+            self.sock = socket.create_connection(tcp)
+        else:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(address)
+        self.encoder = msgspec.msgpack.Encoder(enc_hook=PybEvents.enc_hook)
+        self.decoder = PybEvents.EventDecoder(many=True)
+
+    def send(self, *events: PybEvents.PybEvent) -> None:
+        data = self.encoder.encode(list(events))
+        self.sock.sendall(FRAME_HEADER.pack(len(data)) + data)
+
+    def subscribe(self, chambers: List[int] = None, events: List[str] = None) -> None:
+        self.send(PybEvents.SubscribeEvent(chambers=chambers or [], events=events or []))
+
+    def receive(self) -> List[PybEvents.PybEvent]:
+        """Blocks until the next list of events is received."""
+        return self.decoder.decode(self.recv_exactly(FRAME_HEADER.unpack(self.recv_exactly(FRAME_HEADER.size))[0]))
+
+    def recv_exactly(self, n: int) -> bytes:
+        data = bytearray()
+        while len(data) < n:
+            chunk = self.sock.recv(n - len(data))
+            if not chunk:
+                raise EOFError
+            data += chunk
+        return bytes(data)
+
+    def close(self) -> None:
+        self.sock.close()
@@ -0,0 +1,308 @@
+from __future__ import annotations
+
+import multiprocessing
+import os
+import signal
+import sys
+from datetime import datetime
+from multiprocessing.connection import Connection
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+import msgspec
+
+from pybehave.Events import PybEvents
+from pybehave.Tasks.TaskProcess import TaskProcess
+from pybehave.Tasks.TaskRouter import TaskRouter
+from pybehave.Utilities import Scheduling
+from pybehave.Utilities.create_source import connect_source, create_source
+from pybehave.Workstation.ControlServer import ControlServer
+
+if TYPE_CHECKING:
+    from pybehave.Sources.Source import Source
+
+
+class ChamberConfig(msgspec.Struct, kw_only=True):
+    """
+    Task to run in a chamber during a headless session.
+
+    Attributes
+    ----------
+    chamber : int
+        Chamber number starting from 1 as shown in the Workstation
+    task : str
+        Name of the Task class
+    subject : str
+        Name of the subject completing the task
+    address_file : str
+        Path to the AddressFile (relative to the session configuration)
+    protocol : str
+        Path to the Protocol (relative to the session configuration)
+    loggers : str
+        EventLoggers for the task in the same format as a chamber configuration file
+    output : str
+        Output folder for any file EventLoggers. Defaults to the same folder the Workstation would use.
+    """
+    chamber: int
+    task: str
+    subject: str = "default"
+    address_file: str = ""
+    protocol: str = ""
+    loggers: str = ""
+    output: Optional[str] = None
+
+
+class SessionConfig(msgspec.Struct, kw_only=True):
+    """
+    Configuration for a headless session loaded from a TOML file. Settings mirror those in pybehave.ini.
+
+    Attributes
+    ----------
+    root : str
+        Folder containing the Local package with Tasks and Sources. Defaults to Desktop/py-behav.
+    sources : dict
+        Constructor code for each Source keyed by name (e.g. osc = "OSControllerSource('COM3')")
+    chambers : list
+        Tasks to run
+    n_task_processes : int
+        Number of TaskProcess workers chambers are distributed across
+    task_process_pins : dict
+        Mapping from chamber index to the worker it should always run on
+    scheduling : dict
+        SchedulingPolicy for task_process and source or individual processes (task_process_INDEX or source_NAME)
+    latency_tracing : bool
+        True if end-to-end latency should be measured
+    timeout_precision : float
+        Seconds before each deadline at which timeouts should stop blocking and spin
+    control : str
+        HOST:PORT or Unix socket path for a ControlServer (empty to disable)
+    virtual_time : bool
+        True if time should skip ahead to the next deadline whenever the tasks are idle
+    scripted_sources : dict
+        Constructor code for Sources that run inside each TaskProcess (e.g. lever = "ScriptedSource([(5, 'lever', True)])")
+    """
+    root: Optional[str] = None
+    sources: Dict[str, str] = {}
+    chambers: List[ChamberConfig] = []
+    n_task_processes: int = 1
+    task_process_pins: Dict[int, int] = {}
+    scheduling: Dict[str, Scheduling.SchedulingPolicy] = msgspec.field(
+        default_factory=lambda: {"task_process": Scheduling.SchedulingPolicy(policy="realtime")})
+    latency_tracing: bool = False
+    timeout_precision: float = 0
+    control: str = ""
+    virtual_time: bool = False
+    scripted_sources: Dict[str, str] = {}
+
+
+def load_config(path: str) -> SessionConfig:
+    """Loads a SessionConfig from a TOML file resolving any relative paths against the folder containing it."""
+    with open(path, "rb") as f:
+        config = msgspec.toml.decode(f.read(), type=SessionConfig)
+    folder = os.path.dirname(os.path.abspath(path))
+    if config.root is None:
+        config.root = os.path.join(os.path.expanduser('~'), 'Desktop', 'py-behav')
+    config.root = os.path.join(folder, os.path.expanduser(config.root))
+    for chamber in config.chambers:
+        for field in ("address_file", "protocol", "output"):
+            value = getattr(chamber, field)
+            if value:
+                setattr(chamber, field, os.path.join(folder, os.path.expanduser(value)))
+    return config
+
+
+class HeadlessWorkstation:
+    """
+    Runs a session without pygame or PyQt.
+
+    Only the Sources and TaskProcess workers are started. Every configured chamber is started as soon as its task is
+    initialized and the session ends once all tasks have completed, raised an error, or been stopped. If a control
+    server is configured, the session instead continues until a client sends an ExitEvent so further tasks can be
+    added and controlled through the server.
+
+    Parameters
+    ----------
+    config : SessionConfig
+        The session to run
+    """
+
+    def __init__(self, config: SessionConfig):
+        self.config = config
+        self.sources = {}
+        self.tps = []
+        self.gui_queues = []
+        self.mainq = None
+        self.running = set()  # Chambers with a running task
+        self.autostart = set()  # Chambers from the configuration that should start once initialized
+        self.latency = {}  # Most recent latency report for each chamber
+        self.n_exited = 0
+        self.control = None
+        self.exit_requested = False
+        self.requests, self.request_out = multiprocessing.Pipe(False)  # Wakes the event loop when exit is requested
+        self.encoder = msgspec.msgpack.Encoder(enc_hook=PybEvents.enc_hook)
+        self.decoder = PybEvents.EventDecoder(many=True)
+
+    def start_workstation(self) -> None:
+        sys.path.insert(0, self.config.root)
+        # Child processes ignore interrupts so the session can be stopped cleanly from the terminal
+        handler = signal.signal(signal.SIGINT, signal.SIG_IGN)
+        for name, code in self.config.sources.items():
+            self.sources[name] = create_source(code)
+            self.sources[name].sid = name
+        source_connections = [{} for _ in range(self.config.n_task_processes)]
+        for name, source in self.sources.items():
+            for i, tpq in enumerate(self.connect_source(source)):
+                source_connections[i][name] = tpq
+            source.scheduling = self.scheduling_policy("source", name)
+            source.trace_latency = self.config.latency_tracing
+            source.start()
+
+        mainqs = []
+        for i in range(self.config.n_task_processes):
+            gui_queue, gui_out = multiprocessing.Pipe(False)
+            mainq, tpq = multiprocessing.Pipe()
+            self.gui_queues.append(gui_queue)
+            mainqs.append(mainq)
+            scripted = {name: create_source(code) for name, code in self.config.scripted_sources.items()}
+            self.tps.append(TaskProcess(tpq, gui_out, source_connections[i], i, self.scheduling_policy("task_process", i),
+                                        self.config.latency_tracing, self.config.timeout_precision,
+                                        self.config.virtual_time, scripted))
+            self.tps[i].start()
+        self.mainq = TaskRouter(mainqs, self.config.task_process_pins)
+        signal.signal(signal.SIGINT, handler)
+        if len(self.config.control) > 0:
+            self.control = ControlServer(self.config.control, self.mainq.send_bytes,
+                                         {PybEvents.ExitEvent: self.request_exit})
+            self.control.start()
+            try:
+                self.control.wait_ready()
+            except BaseException:
+                # Without the server no client could ever end the session
+                self.control = None
+                self.exit()
+                raise
+
+        for chamber in self.config.chambers:
+            self.add_task(chamber)
+        try:
+            self.update()
+        except KeyboardInterrupt:
+            print("Stopping all chambers")
+            self.exit_requested = True
+            self.stop_all()
+            self.update()
+        self.exit()
+
+    def scheduling_policy(self, role: str, instance: int | str = None) -> Scheduling.SchedulingPolicy:
+        return Scheduling.policy_for(self.config.scheduling, role, instance)
+
+    def connect_source(self, source: Source) -> List[Connection]:
+        return connect_source(source, self.config.n_task_processes)
+
+    def send(self, event: PybEvents.PybEvent) -> None:
+        self.mainq.send_bytes(self.encoder.encode(event))
+
+    def add_task(self, config: ChamberConfig) -> None:
+        """Adds a task to a chamber. The task is started once it has been initialized."""
+        chamber = config.chamber - 1
+        metadata = {"chamber": chamber, "subject": config.subject, "protocol": config.protocol,
+                    "address_file": config.address_file}
+        output = config.output
+        if output is None:
+            output = "{}/{}/Data/{}/{}/".format(self.config.root, config.task, config.subject,
+                                                datetime.now().strftime("%m-%d-%Y"))
+        self.autostart.add(chamber)
+        self.send(PybEvents.AddTaskEvent(chamber, config.task, config.loggers, metadata=metadata))
+        self.send(PybEvents.OutputFileChangedEvent(chamber, output, config.subject))
+
+    def stop_all(self) -> None:
+        for chamber in self.running:
+            self.send(PybEvents.StopEvent(chamber))
+        # Tasks that have not started yet are removed instead
+        for chamber in self.autostart:
+            self.send(PybEvents.ClearEvent(chamber, True))
+        self.autostart.clear()
+
+    def request_exit(self, event: PybEvents.ExitEvent) -> None:
+        # Called from the ControlServer thread
+        self.request_out.send_bytes(self.encoder.encode(event))
+
+    def update(self) -> None:
+        """Handles events from the TaskProcess workers until no chambers are running and exit has been requested."""
+        while self.active():
+            self.poll()
+
+    def active(self) -> bool:
+        if len(self.running) > 0 or len(self.autostart) > 0:
+            return True
+        return self.control is not None and not self.exit_requested
+
+    def poll(self) -> None:
+        for ready in multiprocessing.connection.wait([self.requests, *self.gui_queues]):
+            try:
+                data = ready.recv_bytes()
+            except EOFError:
+                # The worker has exited
+                self.gui_queues.remove(ready)
+                continue
+            if ready is self.requests:
+                print("Exit requested")
+                self.exit_requested = True
+                self.stop_all()
+                continue
+            events = self.decoder.decode(data)
+            if self.control is not None:
+                self.control.publish(events)
+            for event in events:
+                self.handle_event(event)
+
+    def handle_event(self, event: PybEvents.PybEvent) -> None:
+        et = PybEvents.traits(type(event))
+        if et.is_a(PybEvents.InitEvent):
+            if event.chamber in self.autostart:
+                self.autostart.discard(event.chamber)
+                self.running.add(event.chamber)
+                self.send(PybEvents.StartEvent(event.chamber))
+        elif et.is_a(PybEvents.StartEvent):
+            if "sub_task" not in event.metadata:
+                self.running.add(event.chamber)
+                print("Chamber {} started".format(event.chamber + 1))
+        elif et.is_a(PybEvents.TaskCompleteEvent):
+            # Sequences do not stop themselves once every sub-task is complete
+            if "sequence_complete" in event.metadata:
+                self.send(PybEvents.StopEvent(event.chamber))
+        elif et.is_a(PybEvents.StopEvent):
+            if event.chamber in self.running:
+                self.running.discard(event.chamber)
+                print("Chamber {} stopped".format(event.chamber + 1))
+        elif et.is_a(PybEvents.ClearEvent):
+            self.running.discard(event.chamber)
+            self.autostart.discard(event.chamber)
+        elif et.is_a(PybEvents.ErrorEvent):
+            self.handle_error(event)
+        elif et.is_a(PybEvents.LatencyReportEvent):
+            self.latency.update(event.report)
+        elif et.is_a(PybEvents.UnavailableSourceEvent):
+            self.sources[event.sid].available = False
+        elif et.is_a(PybEvents.ExitEvent):
+            self.n_exited += 1
+
+    def handle_error(self, event: PybEvents.ErrorEvent) -> None:
+        print(event.traceback)
+        if "chamber" in event.metadata:
+            chamber = event.metadata["chamber"]
+            print("Removing the task in chamber {} due to an unhandled {}".format(chamber + 1, event.error))
+            self.send(PybEvents.ClearEvent(chamber, True))
+            self.running.discard(chamber)
+            self.autostart.discard(chamber)
+
+    def exit(self) -> None:
+        if self.control is not None:
+            self.control.stop()
+        self.send(PybEvents.ExitEvent())
+        # Every TaskProcess worker acknowledges the exit
+        while self.n_exited < len(self.tps) and len(self.gui_queues) > 0:
+            self.poll()
+        for tp in self.tps:
+            tp.join()
+        for source in self.sources.values():
+            source.join()
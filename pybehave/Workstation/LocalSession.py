@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import multiprocessing
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Dict
+
+import msgspec
+
+from pybehave.Events import PybEvents
+from pybehave.Tasks.TaskProcess import TaskProcess
+from pybehave.Utilities import Clock
+
+if TYPE_CHECKING:
+    from pybehave.Sources.ScriptedSource import ScriptedSource
+
+
+class LocalSession:
+    """
+    Runs a single task to completion in a TaskProcess on a thread of the calling process while this thread plays the
+    role of the Workstation. Inputs come from ScriptedSources running within the TaskProcess.
+
+    Parameters
+    ----------
+    task : str
+        Name of the Task class
+    metadata : dict
+        Chamber metadata as sent by the Workstation (subject, protocol and address_file)
+    folder : str
+        Output folder for any file EventLoggers
+    sources : dict
+        ScriptedSources keyed by the name address files use for them
+    loggers : str
+        EventLoggers for the task in the same format as a chamber configuration file
+    virtual_time : bool
+        True if the task should run with simulated time rather than in real time
+    wall_limit : float
+        Seconds of real time after which the task is stopped if it has not completed
+    constants : dict
+        Code for constants to update before the task starts as in a ConstantsUpdateEvent
+
+    Attributes
+    ----------
+    completed : bool
+        True if the task completed rather than being stopped
+    elapsed : float
+        Task time at which the task completed or was stopped
+    counts : dict
+        Number of each type of logged event and input, and entries into each state
+    error : str
+        Traceback or description of any error that ended the session
+    """
+
+    def __init__(self, task: str, metadata: Dict, folder: str, sources: Dict[str, ScriptedSource], loggers: str = "",
+                 virtual_time: bool = True, wall_limit: float = None, constants: Dict[str, str] = None):
+        self.task = task
+        self.metadata = dict(metadata, chamber=0)
+        self.folder = folder
+        self.sources = sources
+        self.loggers = loggers
+        self.virtual_time = virtual_time
+        self.wall_limit = wall_limit
+        self.constants = constants or {}
+        self.counts = {}
+        self.elapsed = 0
+        self.wall_time = 0
+        self.completed = False
+        self.stopped = False
+        self.error = None
+        self.encoder = msgspec.msgpack.Encoder(enc_hook=PybEvents.enc_hook)
+        self.decoder = PybEvents.EventDecoder(many=True)
+        self.error_decoder = PybEvents.EventDecoder()
+
+    def run(self) -> None:
+        os.makedirs(self.folder, exist_ok=True)
+        mainq, tpq = multiprocessing.Pipe()
+        guiq, gui_out = multiprocessing.Pipe(False)
+        tp = TaskProcess(tpq, gui_out, {}, virtual_time=self.virtual_time, scripted_sources=self.sources)
+        # The TaskProcess replaces the clock of this process which is restored once the session ends
+        previous_clock = Clock.clock
+        thread = threading.Thread(target=tp.run, daemon=True)
+        thread.start()
+        try:
+            start = time.perf_counter()
+            self.send(mainq, PybEvents.AddTaskEvent(0, self.task, self.loggers, metadata=self.metadata))
+            self.send(mainq, PybEvents.OutputFileChangedEvent(0, self.folder + os.sep,
+                                                              self.metadata.get("subject", "default")))
+            if len(self.constants) > 0:
+                self.send(mainq, PybEvents.ConstantsUpdateEvent(0, self.constants))
+            exited = False
+            wall_limit = self.wall_limit
+            while not exited:
+                remaining = None
+                if wall_limit is not None:
+                    remaining = wall_limit - (time.perf_counter() - start)
+                    if remaining <= 0:
+                        # Stopping the task saves its output before the TaskProcess exits
+                        self.error = "Exceeded wall_limit"
+                        self.send(mainq, PybEvents.StopEvent(0))
+                        wall_limit = remaining = None
+                for ready in multiprocessing.connection.wait([guiq, mainq], remaining):
+                    if ready is mainq:
+                        # Errors creating the task are reported to the Workstation directly
+                        event = self.error_decoder.decode(mainq.recv_bytes())
+                        if isinstance(event, PybEvents.ErrorEvent):
+                            self.error = event.traceback
+                            self.send(mainq, PybEvents.ExitEvent())
+                        continue
+                    for event in self.decoder.decode(guiq.recv_bytes()):
+                        exited = self.handle_event(mainq, event) or exited
+            thread.join()
+        finally:
+            Clock.set_clock(previous_clock)
+        for conn in (mainq, tpq, guiq, gui_out):
+            conn.close()
+        self.wall_time = time.perf_counter() - start
+
+    def send(self, mainq, event: PybEvents.PybEvent) -> None:
+        mainq.send_bytes(self.encoder.encode(event))
+
+    def handle_event(self, mainq, event: PybEvents.PybEvent) -> bool:
+        """Responds to an event from the TaskProcess as the Workstation would. Returns True once it has exited."""
+        if isinstance(event, PybEvents.TimedEvent) and event.timestamp is not None:
+            self.elapsed = max(self.elapsed, event.timestamp)
+        if isinstance(event, (PybEvents.Loggable, PybEvents.ComponentUpdateEvent)):
+            # Logged events and inputs are counted by type and states by name
+            name = type(event).__name__
+            self.counts[name] = self.counts.get(name, 0) + 1
+            if isinstance(event, PybEvents.StateEnterEvent):
+                key = "{}:{}".format(name, event.name)
+                self.counts[key] = self.counts.get(key, 0) + 1
+        if isinstance(event, PybEvents.InitEvent):
+            self.send(mainq, PybEvents.StartEvent(0))
+        elif isinstance(event, PybEvents.TaskCompleteEvent):
+            self.completed = True
+        elif isinstance(event, PybEvents.StopEvent):
+            if not self.stopped:
+                self.stopped = True
+                self.send(mainq, PybEvents.ClearEvent(0, True))
+                self.send(mainq, PybEvents.ExitEvent())
+        elif isinstance(event, PybEvents.ErrorEvent):
+            self.error = event.traceback
+            self.send(mainq, PybEvents.ExitEvent())
+        elif isinstance(event, PybEvents.ExitEvent):
+            return True
+        return False
@@ -0,0 +1,241 @@
+from __future__ import annotations
+
+import binascii
+import csv
+import difflib
+import os
+from typing import Dict, List, Optional, Tuple
+
+import msgspec
+
+from pybehave.Events import PybEvents
+from pybehave.Events.MetadataSerializer import MetadataSerializer, create_serializer
+from pybehave.Sources.ScriptedSource import ScriptedSource
+from pybehave.Workstation.LocalSession import LocalSession
+
+REPLAY_SOURCE = "replay"
+STATE_EVENTS = ("StateEnterEvent", "StateExitEvent", "TimeoutEvent")  # Events compared between a recording and its replay
+
+
+class RecordedEvent(msgspec.Struct):
+    """A single row from the body of a CSVEventLogger file."""
+    trial: int
+    time: float
+    type: str
+    code: str
+    name: str
+    metadata: str
+
+
+class RecordedSession(msgspec.Struct):
+    """
+    Contents of a session saved by a CSVEventLogger.
+
+    Attributes
+    ----------
+    info : dict
+        Header values (Version, MetadataFormat, Subject, Task, Chamber, Protocol and AddressFile)
+    constants : dict
+        Code for any constants that were changed from the protocol before the session started
+    events : list
+        Every logged event in order
+    """
+    info: Dict[str, str]
+    constants: Dict[str, str]
+    events: List[RecordedEvent]
+
+    def metadata_serializer(self) -> MetadataSerializer:
+        """Returns a serializer for the metadata format of the file. Files without a Version row used the repr format."""
+        return create_serializer(self.info.get("MetadataFormat", "repr"))
+
+
+def read_csv_session(path: str) -> RecordedSession:
+    info = {}
+    constants = {}
+    events = []
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+        section = info
+        for row in reader:
+            if len(row) == 0:
+                continue
+            if row[0] == "Trial":
+                break
+            if row[0] == "SubjectConfiguration":
+                section = constants
+            elif len(row) > 1:
+                section[row[0]] = row[1]
+        for row in reader:
+            if len(row) >= 6:
+                events.append(RecordedEvent(int(row[0]), float(row[1]), row[2], row[3], row[4], row[5]))
+    return RecordedSession(info, constants, events)
+
+
+def parse_metadata(metadata: str, serializer: MetadataSerializer) -> Dict:
+    try:
+        return serializer.decode(metadata)
+    except (msgspec.DecodeError, binascii.Error):
+        return {}
+
+
+def replay_inputs(session: RecordedSession) -> List[Tuple[float, PybEvents.TaskEvent]]:
+    """
+    Returns the events that reached the task from outside (Component inputs, GUI interactions, constant changes and
+    pauses) with the time they were received. Chamber indices are replaced when the inputs are scheduled.
+    """
+    inputs = []
+    serializer = session.metadata_serializer()
+    for event in session.events:
+        if event.type == "ComponentChangedEvent":
+            metadata = parse_metadata(event.metadata, serializer)
+            if "value" not in metadata:
+                continue  # Values that cannot be parsed (e.g. arrays) are skipped
+            value = metadata.pop("value")
+            inputs.append((event.time, PybEvents.ComponentUpdateEvent(0, event.name, value, metadata=metadata)))
+        elif event.type == "GUIEvent":
+            inputs.append((event.time, PybEvents.GUIEvent(0, event.name, int(event.code))))
+        elif event.type == "ConstantUpdateEvent":
+            inputs.append((event.time, PybEvents.ConstantsUpdateEvent(0, {event.name: event.code})))
+        elif event.type == "PauseEvent":
+            # Paused time is excluded from timestamps so pauses are replayed with no duration
+            inputs.append((event.time, PybEvents.PauseEvent(0)))
+            inputs.append((event.time, PybEvents.ResumeEvent(0)))
+    return inputs
+
+
+class ReplaySource(ScriptedSource):
+    """
+    ScriptedSource that re-delivers the inputs from a recorded session and stops the task when the recording ended.
+    Inputs are sent directly to the task's Components so no address file is needed.
+
+    Parameters
+    ----------
+    inputs : list
+        Events with the time after the task started they should be delivered as from replay_inputs
+    end : float
+        Time after the task started at which it should be stopped (None to let the task complete on its own)
+    """
+
+    def __init__(self, inputs: List[Tuple[float, PybEvents.TaskEvent]], end: float = None):
+        super(ReplaySource, self).__init__()
+        self.inputs = inputs
+        self.end = end
+
+    def task_started(self, chamber: int) -> None:
+        for t, event in self.inputs:
+            changes = {"chamber": chamber}
+            if isinstance(event, PybEvents.ComponentUpdateEvent):
+                # Component IDs include the chamber they were recorded in
+                name, _, index = event.comp_id.rsplit("-", 2)
+                changes["comp_id"] = "{}-{}-{}".format(name, chamber, index)
+            self.tp.schedule_event(msgspec.structs.replace(event, **changes), t)
+        if self.end is not None:
+            self.tp.schedule_event(PybEvents.StopEvent(chamber), self.end)
+
+
+class ReplayResult(msgspec.Struct):
+    """
+    Comparison between the states a recorded session moved through and those of its replay.
+
+    Attributes
+    ----------
+    recorded : list
+        Type, name and time of every state change and timeout in the recording
+    replayed : list
+        Type, name and time of every state change and timeout in the replay
+    divergence : int
+        Index of the first event that differs between the two sequences (None if they match)
+    max_drift : float
+        Largest difference in time between corresponding events before any divergence
+    error : str
+        Traceback of any error raised by the task during the replay
+    """
+    recorded: List[Tuple[str, str, float]]
+    replayed: List[Tuple[str, str, float]]
+    divergence: Optional[int]
+    max_drift: float
+    error: Optional[str] = None
+
+    def matches(self, tolerance: float = None) -> bool:
+        if self.divergence is not None or self.error is not None:
+            return False
+        return tolerance is None or self.max_drift <= tolerance
+
+    def diff(self, context: int = 3) -> List[str]:
+        """Returns the state sequences around the first divergence in unified diff format."""
+        recorded = ["{} {}".format(event_type, name) for event_type, name, _ in self.recorded]
+        replayed = ["{} {}".format(event_type, name) for event_type, name, _ in self.replayed]
+        return list(difflib.unified_diff(recorded, replayed, "recorded", "replayed", n=context, lineterm=""))
+
+
+def compare(recorded: List[Tuple[str, str, float]], replayed: List[Tuple[str, str, float]], error: str = None) -> ReplayResult:
+    divergence = None
+    max_drift = 0
+    for i in range(max(len(recorded), len(replayed))):
+        if i >= len(recorded) or i >= len(replayed) or recorded[i][:2] != replayed[i][:2]:
+            divergence = i
+            break
+        max_drift = max(max_drift, abs(recorded[i][2] - replayed[i][2]))
+    return ReplayResult(recorded, replayed, divergence, max_drift, error)
+
+
+def replay(path: str, output: str = None, realtime: bool = False, protocol: str = None,
+           wall_limit: float = None) -> ReplayResult:
+    """
+    Runs the task from a CSVEventLogger file again with the recorded inputs and compares the states it moves through
+    with the recording.
+
+    Parameters
+    ----------
+    path : str
+        The recorded session
+    output : str
+        Folder for the log of the replay (defaults to a replay folder next to the recording)
+    realtime : bool
+        True if inputs should be replayed at the speed they were recorded rather than with simulated time
+    protocol : str
+        Protocol to use instead of the one recorded in the file (for example if it was moved)
+    wall_limit : float
+        Seconds of real time after which the replay is stopped
+
+    Returns
+    -------
+    ReplayResult
+        Comparison of the recorded and replayed state sequences
+    """
+    recording = read_csv_session(path)
+    if protocol is None:
+        protocol = recording.info.get("Protocol", "")
+    if output is None:
+        output = os.path.join(os.path.dirname(os.path.abspath(path)), "replay")
+    existing = set(os.listdir(output)) if os.path.isdir(output) else set()
+    end = recording.events[-1].time if len(recording.events) > 0 else None
+    source = ReplaySource(replay_inputs(recording), end)
+    metadata = {"subject": recording.info.get("Subject", "default"), "protocol": protocol, "address_file": ""}
+    session = LocalSession(recording.info["Task"], metadata, output, {REPLAY_SOURCE: source},
+                           "CSVEventLogger((||csv||))", not realtime, wall_limit, recording.constants)
+    session.run()
+    # The replay is compared through its own log so both sequences include every logged state change
+    replayed = []
+    logs = sorted(name for name in os.listdir(output) if name.endswith(".csv") and name not in existing)
+    if len(logs) > 0:
+        replayed = state_sequence(read_csv_session(os.path.join(output, logs[-1])))
+    return compare(state_sequence(recording), replayed, session.error)
+
+
+def state_sequence(session: RecordedSession) -> List[Tuple[str, str, float]]:
+    return [(event.type, event.name, event.time) for event in session.events if event.type in STATE_EVENTS]
+
+
+def print_result(result: ReplayResult, tolerance: float = None) -> None:
+    if result.error is not None:
+        print(result.error)
+    if result.divergence is None:
+        print("{} state events match (maximum drift {:.6f}s)".format(len(result.recorded), result.max_drift))
+        if not result.matches(tolerance):
+            print("Drift exceeds the tolerance of {}s".format(tolerance))
+    else:
+        print("Replay diverged at event {} of {}".format(result.divergence + 1, len(result.recorded)))
+        for line in result.diff():
+            print(line)
+
@@ -1,11 +1,10 @@
 from __future__ import annotations
 
-import multiprocessing
 import os
 import webbrowser
 from typing import TYPE_CHECKING
 
-from pybehave.Events.PybEvents import AddSourceEvent, RemoveSourceEvent
+from pybehave.Events.PybEvents import RemoveSourceEvent
 from pybehave.Utilities.Exceptions import MissingExtraError
 from pybehave.Utilities.find_closing_paren import find_closing_paren
 import pybehave.Sources
@@ -122,11 +121,7 @@ class SettingsDialog(QDialog):
         search_str = '\"' + st_name + '\": ' + s_type
         open_ind = source_string.index(search_str) + len(search_str)
         close_ind = find_closing_paren(source_string, open_ind) + 1
-        self.workstation.sources[st_name] = s_type(**eval(source_string[open_ind:close_ind]))
-        tpq, sourceq = multiprocessing.Pipe()
-        self.workstation.sources[st_name].queue = sourceq
-        self.workstation.sources[st_name].start()
-        self.workstation.mainq.send_bytes(self.workstation.encoder.encode(AddSourceEvent(st_name, tpq)))
+        self.workstation.add_source(st_name, s_type(**eval(source_string[open_ind:close_ind])))
 
     def remove_source(self) -> None:
         st = self.source_list.currentItem().text()
@@ -257,11 +252,7 @@ class AddSourceDialog(QDialog):
             else:
                 source_string = source_string[:-1] + ', "{}": \'{}()\''.format(self.name.text(), self.source.currentText()) + "}"
         settings.setValue("sources", source_string)
-        self.sd.workstation.sources[self.name.text()] = source_type(*self.params)
-        tpq, sourceq = multiprocessing.Pipe()
-        self.sd.workstation.sources[self.name.text()].queue = sourceq
-        self.sd.workstation.sources[self.name.text()].start()
-        self.sd.workstation.mainq.send_bytes(self.sd.workstation.encoder.encode(AddSourceEvent(self.name.text(), tpq)))
+        self.sd.workstation.add_source(self.name.text(), source_type(*self.params))
         ql = QListWidgetItem("{} ({})".format(self.name.text(), self.source.currentText()), self.sd.source_list)
         if self.sd.workstation.sources[self.name.text()].available:
             ql.setIcon(self.sd.source_list.style().standardIcon(QStyle.SP_DialogApplyButton))
@@ -6,7 +6,7 @@ import threading
 import time
 import traceback
 from multiprocessing.dummy.connection import Connection
-from typing import List
+from typing import TYPE_CHECKING, List
 
 import msgspec
 
@@ -14,8 +14,16 @@ from pybehave.Events import PybEvents
 from pybehave.Events.EventWidget import EventWidget
 from pybehave.GUIs.SequenceGUI import SequenceGUI
 from pybehave.Tasks.TaskProcess import TaskProcess
+from pybehave.Tasks.TaskRouter import TaskRouter
+from pybehave.Utilities import Scheduling
+from pybehave.Utilities.coalesce_rects import coalesce_rects
+from pybehave.Utilities.create_source import connect_source, create_source
+from pybehave.Workstation.ControlServer import ControlServer
 from pybehave.Workstation.WorkstationGUI import WorkstationGUI
 
+if TYPE_CHECKING:
+    from pybehave.Sources.Source import Source
+
 import importlib
 
 import math
@@ -38,6 +46,14 @@ class Workstation:
         self.guis = {}
         self.sources = {}
         self.n_chamber, self.n_col, self.n_row, self.w, self.h = 0, 0, 0, 0, 0
+        self.n_task_processes = 1
+        self.task_process_pins = {}
+        self.scheduling = {}
+        self.trace_latency = False
+        self.timeout_precision = 0
+        self.control_socket = ""
+        self.control = None
+        self.latency = {}  # Most recent latency report for each chamber
         self.ed = None
         self.wsg = None
         self.mainq = None
@@ -48,14 +64,15 @@ class Workstation:
         self.fr = 10
         self.last_frame = 0
         self.task_gui = None
-        self.gui_updates = []
-        self.gui_queue = None
+        self.gui_updates = []  # Screen areas drawn since the last frame
+        self.dirty_chambers = set()  # Chambers whose Elements may need to be drawn in the next frame
+        self.gui_queues = []
         self.qui_events_queue = None
         self.gui_stop_event = None
         self.refresh_gui = True
-        self.tp = None
+        self.tps = []
         self.encoder = msgspec.msgpack.Encoder(enc_hook=PybEvents.enc_hook)
-        self.decoder = msgspec.msgpack.Decoder(type=List[PybEvents.subclass_union(PybEvents.PybEvent)], dec_hook=PybEvents.dec_hook)
+        self.decoder = PybEvents.EventDecoder(many=True)
 
         # Core application details
         QCoreApplication.setOrganizationName("TNEL")
@@ -91,6 +108,41 @@ class Workstation:
             self.n_chamber = 1
             settings.setValue("n_chamber", self.n_chamber)
 
+        # Store the number of TaskProcess workers chambers are distributed across and any chambers pinned to a worker
+        if settings.contains("n_task_processes"):
+            self.n_task_processes = max(int(settings.value("n_task_processes")), 1)
+            self.task_process_pins = ast.literal_eval(settings.value("task_process_pins", "{}"))
+        else:
+            settings.setValue("n_task_processes", self.n_task_processes)
+            settings.setValue("task_process_pins", str(self.task_process_pins))
+
+        # Store the scheduling policies for the GUI, TaskProcess workers, and Sources. Policies for individual workers
+        # or Sources can be provided as task_process_INDEX or source_NAME.
+        if not settings.contains("scheduling/gui"):
+            settings.setValue("scheduling/gui", str({"policy": "normal"}))
+            settings.setValue("scheduling/task_process", str({"policy": "realtime"}))
+            settings.setValue("scheduling/source", str({"policy": "normal"}))
+        # Store whether end-to-end latency should be measured
+        if settings.contains("latency_tracing"):
+            self.trace_latency = settings.value("latency_tracing", type=bool)
+        else:
+            settings.setValue("latency_tracing", self.trace_latency)
+        # Store how long before each deadline timeouts should stop blocking and spin
+        if settings.contains("timeout_precision"):
+            self.timeout_precision = settings.value("timeout_precision", type=float)
+        else:
+            settings.setValue("timeout_precision", self.timeout_precision)
+        # Store the address of the local control server (HOST:PORT or a Unix socket path, empty to disable)
+        if settings.contains("control_socket"):
+            self.control_socket = settings.value("control_socket")
+        else:
+            settings.setValue("control_socket", self.control_socket)
+
+        settings.beginGroup("scheduling")
+        for key in settings.childKeys():
+            self.scheduling[key] = Scheduling.from_setting(settings.value(key))
+        settings.endGroup()
+
         # Compute the arrangement of chambers in the pygame window
         if settings.contains("pygame/n_row"):
             self.n_row = int(settings.value("pygame/n_row"))
@@ -110,29 +162,42 @@ class Workstation:
         if settings.contains("sources"):
             self.sources = eval(settings.value("sources"))
             for name, code in self.sources.items():
-                segs = code.split('(', 1)
-                try:
-                    source_type = getattr(importlib.import_module("pybehave.Sources." + segs[0]), segs[0])
-                except ModuleNotFoundError:
-                    source_type = getattr(importlib.import_module("Local.Sources." + segs[0]), segs[0])
-                self.sources[name] = source_type(*eval("(" + segs[1]))
+                self.sources[name] = create_source(code)
                 self.sources[name].sid = name
         else:
             settings.setValue("sources", '{}')
-        source_connections = {}
+        source_connections = [{} for _ in range(self.n_task_processes)]
         for name, source in self.sources.items():
-            tpq, sourceq = multiprocessing.Pipe()
-            source.queue = sourceq
-            source_connections[name] = tpq
+            for i, tpq in enumerate(self.connect_source(source)):
+                source_connections[i][name] = tpq
+            source.scheduling = self.scheduling_policy("source", name)
+            source.trace_latency = self.trace_latency
             source.start()
 
         app = QApplication(sys.argv)
         self.wsg = WorkstationGUI(self)
-        self.gui_queue, gui_out = multiprocessing.Pipe(False)
         self.qui_events_queue, gui_events_out = multiprocessing.Pipe(False)
-        self.mainq, tpq = multiprocessing.Pipe()
-        self.tp = TaskProcess(tpq, gui_out, source_connections)
-        self.tp.start()
+        mainqs = []
+        for i in range(self.n_task_processes):
+            gui_queue, gui_out = multiprocessing.Pipe(False)
+            mainq, tpq = multiprocessing.Pipe()
+            self.gui_queues.append(gui_queue)
+            mainqs.append(mainq)
+            self.tps.append(TaskProcess(tpq, gui_out, source_connections[i], i, self.scheduling_policy("task_process", i),
+                                        self.trace_latency, self.timeout_precision))
+            self.tps[i].start()
+        self.mainq = TaskRouter(mainqs, self.task_process_pins)
+        # Applied once every child process has started so they do not inherit the GUI's policy and cores
+        Scheduling.apply(self.scheduling_policy("gui"), "the Workstation")
+        if len(self.control_socket) > 0:
+            self.control = ControlServer(self.control_socket, self.mainq.send_bytes)
+            self.control.start()
+            try:
+                self.control.wait_ready()
+            except BaseException as e:
+                self.control = None
+                message = "Unable to start the control server on {}: {}".format(self.control_socket, e)
+                self.handle_error(PybEvents.ErrorEvent(type(e).__name__, message))
         self.gui_task = threading.Thread(target=self.update_gui)
         self.gui_task.start()
         self.gui_stop_event = threading.Event()
@@ -141,6 +206,54 @@ class Workstation:
 
         sys.exit(app.exec())
 
+    def scheduling_policy(self, role: str, instance: int | str = None) -> Scheduling.SchedulingPolicy:
+        """
+        Returns the SchedulingPolicy configured for a process.
+
+        Parameters
+        ----------
+        role : str
+            The type of process (gui, task_process or source)
+        instance : int or str
+            The index of the TaskProcess worker or name of the Source if policies are configured per process
+        """
+        return Scheduling.policy_for(self.scheduling, role, instance)
+
+    def connect_source(self, source: Source) -> List[Connection]:
+        """
+        Creates a Pipe between the Source and each TaskProcess worker.
+
+        Parameters
+        ----------
+        source : Source
+            The Source to connect
+
+        Returns
+        -------
+        list
+            The TaskProcess end of each Pipe ordered by worker
+        """
+        return connect_source(source, self.n_task_processes)
+
+    def add_source(self, name: str, source: Source) -> None:
+        """
+        Starts a Source and connects it to every TaskProcess worker.
+
+        Parameters
+        ----------
+        name : str
+            The name/ID of the Source
+        source : Source
+            The Source to add
+        """
+        self.sources[name] = source
+        tpqs = self.connect_source(source)
+        source.scheduling = self.scheduling_policy("source", name)
+        source.trace_latency = self.trace_latency
+        source.start()
+        for conn, tpq in zip(self.mainq.conns, tpqs):
+            conn.send_bytes(self.encoder.encode(PybEvents.AddSourceEvent(name, tpq)))
+
     def compute_chambergui(self) -> None:
         desktop = os.path.join(os.path.join(os.path.expanduser('~')), 'Desktop')
         settings = QSettings(desktop + "/py-behav/pybehave.ini", QSettings.IniFormat)
@@ -202,6 +315,13 @@ class Workstation:
         """
         self.mainq.send_bytes(self.encoder.encode(PybEvents.ClearEvent(chamber, del_loggers)))
 
+    def query_latency(self) -> None:
+        """
+        Requests the current latency statistics from every TaskProcess. Reports are stored in the latency attribute
+        keyed by chamber when they are received.
+        """
+        self.mainq.send_bytes(self.encoder.encode(PybEvents.LatencyQueryEvent()))
+
     def gui_event_loop(self, out: Connection, stop_event: threading.Event) -> None:
         while not stop_event.is_set():
             event = pygame.event.wait(100)  # millisecond timeout
@@ -209,13 +329,21 @@ class Workstation:
                 out.send_bytes(self.encoder.encode([PybEvents.PygameEvent(event.type, event.__dict__)]))
 
     def update_gui(self) -> None:
-        conns = [self.qui_events_queue, self.gui_queue]
+        conns = [self.qui_events_queue, *self.gui_queues]
+        n_exited = 0
         while True:
-            for ready in multiprocessing.connection.wait(conns):
+            # Wake up in time for the next frame if anything is waiting to be drawn
+            timeout = None
+            if len(self.dirty_chambers) > 0 or len(self.gui_updates) > 0:
+                timeout = max(self.last_frame + 1 / self.fr - time.perf_counter(), 0)
+            for ready in multiprocessing.connection.wait(conns, timeout):
                 events = self.decoder.decode(ready.recv_bytes())
+                if self.control is not None and ready is not self.qui_events_queue:
+                    self.control.publish(events)
                 for event in events:
                     try:
-                        if isinstance(event, PybEvents.AddTaskEvent):
+                        et = PybEvents.traits(type(event))
+                        if et.is_a(PybEvents.AddTaskEvent):
                             module = importlib.import_module("Local.GUIs." + event.task_name + "GUI")
                             module = importlib.reload(module)
                             gui = getattr(module, event.task_name + "GUI")
@@ -224,77 +352,99 @@ class Workstation:
                             row = math.floor(event.chamber / self.n_col)
                             # Create the GUI
                             self.guis[event.chamber] = gui(event, self.task_gui.subsurface(col * self.w, row * self.h, self.w, self.h), self)
-                        elif isinstance(event, PybEvents.TaskEvent):
+                        elif et.task:
                             if event.chamber in self.guis:
-                                for widget in self.wsg.chambers[event.chamber].widgets:
+                                # Chambers controlled through the ControlServer have no ChamberWidget
+                                chamber_widget = self.wsg.chambers.get(event.chamber)
+                                for widget in chamber_widget.widgets if chamber_widget is not None else []:
                                     if isinstance(widget, EventWidget):
                                         widget.emitter.emit(event)
                                 self.guis[event.chamber].handle_event(event)
                                 col = event.chamber % self.n_col
                                 row = math.floor(event.chamber / self.n_col)
                                 rect = pygame.Rect((col * self.w, row * self.h, self.w, self.h))
-                                if isinstance(event, PybEvents.InitEvent) or isinstance(event, PybEvents.StartEvent):
+                                if et.is_a(PybEvents.InitEvent) or et.is_a(PybEvents.StartEvent):
                                     if "sub_task" in event.metadata:
                                         self.guis[event.chamber].switch_sub_gui(event)
                                     self.guis[event.chamber].complete = False
                                     self.guis[event.chamber].draw()
                                     self.gui_updates.append(rect)
-                                elif isinstance(event, PybEvents.OutputFileChangedEvent):
+                                elif et.is_a(PybEvents.OutputFileChangedEvent):
                                     self.guis[event.chamber].subject_name.text = event.subject
                                     pygame.draw.rect(self.guis[event.chamber].task_gui, Colors.darkgray, self.guis[event.chamber].subject_name.rect, 0)
                                     self.guis[event.chamber].subject_name.draw()
                                     self.gui_updates.append(self.guis[event.chamber].subject_name.rect.move(col * self.w, row * self.h))
-                                elif isinstance(event, PybEvents.TaskCompleteEvent):
+                                elif et.is_a(PybEvents.TaskCompleteEvent):
                                     if not isinstance(self.guis[event.chamber], SequenceGUI) or "sequence_complete" in event.metadata:
                                         self.guis[event.chamber].complete = True
                                         self.guis[event.chamber].draw()
                                         self.gui_updates.append(rect)
-                                        self.wsg.chambers[event.chamber].stop(False)
-                                elif isinstance(event, PybEvents.ClearEvent) and event.del_loggers:
+                                        if chamber_widget is not None:
+                                            chamber_widget.stop(False)
+                                elif et.is_a(PybEvents.ClearEvent) and event.del_loggers:
                                     pygame.draw.rect(self.task_gui, Colors.black, rect)
                                     self.gui_updates.append(rect)
-                                    self.wsg.remove_task(event.chamber + 1)
+                                    if chamber_widget is not None:
+                                        self.wsg.remove_task(event.chamber + 1)
                                     del self.guis[event.chamber]
+                                    self.dirty_chambers.discard(event.chamber)
                                 else:
-                                    if isinstance(self.guis[event.chamber], SequenceGUI):
-                                        elements = self.guis[event.chamber].get_all_elements()
-                                    else:
-                                        elements = self.guis[event.chamber].elements
-                                    for element in elements:
-                                        if element.has_updated():
-                                            element.draw()
-                                            self.gui_updates.append(element.rect.move(col * self.w, row * self.h))
-                        elif isinstance(event, PybEvents.HeartbeatEvent) or isinstance(event, PybEvents.PygameEvent):
+                                    # Elements are drawn at most once per frame however many events change them
+                                    self.dirty_chambers.add(event.chamber)
+                        elif et.is_a(PybEvents.HeartbeatEvent) or et.is_a(PybEvents.PygameEvent):
                             for key in self.guis.keys():
                                 self.guis[key].handle_event(event)
-                                col = key % self.n_col
-                                row = math.floor(key / self.n_col)
-                                if isinstance(self.guis[key], SequenceGUI):
-                                    elements = self.guis[key].get_all_elements()
-                                else:
-                                    elements = self.guis[key].elements
-                                for element in elements:
-                                    if element.has_updated():
-                                        element.draw()
-                                        self.gui_updates.append(element.rect.move(col * self.w, row * self.h))
-                        elif isinstance(event, PybEvents.ErrorEvent):
+                                self.dirty_chambers.add(key)
+                        elif et.is_a(PybEvents.ErrorEvent):
                             self.handle_error(event)
-                        elif isinstance(event, PybEvents.UnavailableSourceEvent):
+                        elif et.is_a(PybEvents.LatencyReportEvent):
+                            self.latency.update(event.report)
+                        elif et.is_a(PybEvents.UnavailableSourceEvent):
                             self.sources[event.sid].available = False
                             if self.wsg.sd is not None and self.wsg.sd.isVisible():
                                 self.wsg.sd.update_source_availability()
-                        elif isinstance(event, PybEvents.ExitEvent):
-                            return
-
-                        if time.perf_counter() - self.last_frame > 1 / self.fr:
-                            if len(self.gui_updates) > 0:
-                                pygame.display.update(self.gui_updates)
-                                self.gui_updates = []
-                            self.last_frame = time.perf_counter()
+                        elif et.is_a(PybEvents.ExitEvent):
+                            # Every TaskProcess worker acknowledges the exit
+                            n_exited += 1
+                            if n_exited == len(self.tps):
+                                return
                     except BaseException as e:
-                        metadata = {"chamber": event.chamber} if isinstance(event, PybEvents.TaskEvent) else {}
+                        metadata = {"chamber": event.chamber} if PybEvents.traits(type(event)).task else {}
                         tb = traceback.format_exc()
                         self.handle_error(PybEvents.ErrorEvent(type(e).__name__, tb, metadata=metadata))
+            if time.perf_counter() - self.last_frame >= 1 / self.fr:
+                try:
+                    self.draw_frame()
+                except BaseException as e:
+                    self.handle_error(PybEvents.ErrorEvent(type(e).__name__, traceback.format_exc()))
+
+    def draw_frame(self) -> None:
+        """Draws every updated Element in the dirty chambers and updates the changed areas of the display."""
+        try:
+            for chamber in list(self.dirty_chambers):
+                if chamber not in self.guis:
+                    continue
+                try:
+                    col = chamber % self.n_col
+                    row = math.floor(chamber / self.n_col)
+                    if isinstance(self.guis[chamber], SequenceGUI):
+                        elements = self.guis[chamber].get_all_elements()
+                    else:
+                        elements = self.guis[chamber].elements
+                    for element in elements:
+                        if element.has_updated():
+                            element.draw()
+                            self.gui_updates.append(element.rect.move(col * self.w, row * self.h))
+                except BaseException as e:
+                    self.handle_error(PybEvents.ErrorEvent(type(e).__name__, traceback.format_exc(),
+                                                           metadata={"chamber": chamber}))
+            if len(self.gui_updates) > 0:
+                pygame.display.update(coalesce_rects(self.gui_updates))
+        finally:
+            # A failed frame is not retried so errors cannot keep the GUI thread busy
+            self.dirty_chambers.clear()
+            self.gui_updates = []
+            self.last_frame = time.perf_counter()
 
     def handle_error(self, event: PybEvents.ErrorEvent):
         print(event.traceback)
@@ -332,8 +482,11 @@ class Workstation:
                 if gui.started and not gui.paused:
                     self.mainq.send_bytes(self.encoder.encode(PybEvents.StopEvent(chamber)))
 
+        if self.control is not None:
+            self.control.stop()
         self.mainq.send_bytes(self.encoder.encode(PybEvents.ExitEvent()))
-        self.tp.join()
+        for tp in self.tps:
+            tp.join()
 
         # Join source processes. Assumes all source have terminated
         for source in self.sources.values():
@@ -1,15 +1,61 @@
 def pybehave():
+    import argparse
     import multiprocessing
-    from pybehave.Workstation.Workstation import Workstation
     import faulthandler
-    import psutil
     import os
 
-    p = psutil.Process(os.getpid())
-    p.nice(psutil.REALTIME_PRIORITY_CLASS)
+    parser = argparse.ArgumentParser(prog="pybehave")
+    parser.add_argument("--headless", action="store_true", help="run a session without the GUI")
+    parser.add_argument("--simulate", action="store_true", help="simulate a batch of sessions with virtual subjects")
+    parser.add_argument("--query", action="store_true", help="aggregate measures across every saved session")
+    parser.add_argument("--config", help="TOML file describing the headless session, simulation or query")
+    parser.add_argument("--replay", metavar="SESSION", help="replay a session saved by a CSVEventLogger")
+    parser.add_argument("--realtime", action="store_true", help="replay inputs at the speed they were recorded")
+    parser.add_argument("--root", help="folder containing the Local package (defaults to Desktop/py-behav)")
+    parser.add_argument("--recover", metavar="SEGMENT", help="validate and stitch the segments of a CSVEventLogger session")
+    parser.add_argument("--output", help="folder for the replay's output or path for the recovered session")
+    parser.add_argument("--tolerance", type=float, help="maximum timing drift in seconds for a replay to match")
+    args = parser.parse_args()
+    if (args.headless or args.simulate) and args.config is None:
+        parser.error("--headless and --simulate require --config")
+    if args.query and args.config is None:
+        parser.error("--query requires --config")
 
     faulthandler.enable()
     multiprocessing.allow_connection_pickling()
+    if args.headless:
+        # The headless workstation does not depend on pygame or PyQt
+        from pybehave.Workstation.HeadlessWorkstation import HeadlessWorkstation, load_config
+        ws = HeadlessWorkstation(load_config(args.config))
+        ws.start_workstation()
+        return
+    if args.query:
+        from pybehave.analysis.SessionQuery import SessionQuery, load_config, print_rows
+        config = load_config(args.config)
+        query = SessionQuery(config)
+        print_rows(query.run())
+        if config.output is not None:
+            query.save_output(config.output)
+        return
+    if args.recover is not None:
+        import sys
+        from pybehave.Events.SegmentRecovery import print_report, recover
+        report = recover(args.recover, args.output)
+        print_report(report)
+        sys.exit(0 if report.valid() else 1)
+    if args.replay is not None:
+        import sys
+        from pybehave.Workstation.SessionReplay import print_result, replay
+        sys.path.insert(0, args.root or os.path.join(os.path.expanduser('~'), 'Desktop', 'py-behav'))
+        result = replay(args.replay, args.output, args.realtime)
+        print_result(result, args.tolerance)
+        sys.exit(0 if result.matches(args.tolerance) else 1)
+    if args.simulate:
+        from pybehave.Workstation.BatchSimulator import BatchSimulator, load_config
+        BatchSimulator(load_config(args.config)).run()
+        return
+
+    from pybehave.Workstation.Workstation import Workstation
     desktop = os.path.join(os.path.join(os.path.expanduser('~')), 'Desktop')
     if not os.path.exists("{}\\py-behav\\".format(desktop)):
         os.mkdir("{}\\py-behav\\".format(desktop))
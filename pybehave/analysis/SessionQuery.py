@@ -0,0 +1,380 @@
+from __future__ import annotations
+
+import csv
+import hashlib
+import multiprocessing
+import os
+import statistics
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import msgspec
+import numpy as np
+
+from pybehave.Events.SegmentRecovery import SEGMENT_PATTERN
+from pybehave.analysis.SessionReader import CSVSession
+
+CACHE_VERSION = 1
+INFO_KEY = "info"  # Cache of the header of each session
+DATE_FORMAT = "%m-%d-%Y"  # Format of the date folders created by the Workstation
+PERCENTILES = (10, 25, 50, 75, 90)
+
+
+class Measure(msgspec.Struct, kw_only=True):
+    """
+    A value computed from every session and aggregated across the sessions in each group.
+
+    Attributes
+    ----------
+    name : str
+        Column name for the measure in the results
+    extract : str
+        How values are found in each session: "count" of matching events, session "duration", "metadata" values of key for
+        matching events, or "latency" from each matching event to the next to_type/to_state event
+    type : str
+        Type of the events to match (any type if omitted)
+    state : str
+        State or component name of the events to match (any name if omitted)
+    key : str
+        Metadata key for metadata measures
+    to_type : str
+        Type of the events ending each latency
+    to_state : str
+        State or component name of the events ending each latency
+    aggregate : str
+        How values from all sessions in a group are combined: "mean", "median", "std", "min", "max", "sum", "count",
+        "fraction" of values equal to value, "percentiles", or "histogram" over bins
+    value : Any
+        Value counted by fraction aggregates
+    bins : list
+        Bin edges for histogram aggregates
+    """
+    name: str
+    extract: str
+    type: Optional[str] = None
+    state: Optional[str] = None
+    key: Optional[str] = None
+    to_type: Optional[str] = None
+    to_state: Optional[str] = None
+    aggregate: str = "mean"
+    value: Any = None
+    bins: Optional[List[float]] = None
+
+    def cache_key(self) -> str:
+        """Identifies the values extracted by this measure independent of how they are aggregated."""
+        spec = [self.extract, self.type, self.state, self.key, self.to_type, self.to_state]
+        return hashlib.sha1(msgspec.json.encode([CACHE_VERSION] + spec)).hexdigest()[:16]
+
+
+class QueryConfig(msgspec.Struct, kw_only=True):
+    """
+    Query across the sessions saved by CSVEventLoggers in a py-behav folder loaded from a TOML file.
+
+    Attributes
+    ----------
+    root : str
+        Folder with a Task/Data/Subject/Date/ tree of sessions. Defaults to Desktop/py-behav.
+    tasks : list
+        Tasks to include (all tasks if empty)
+    subjects : list
+        Subjects to include (all subjects if empty)
+    start : str
+        Earliest date to include (YYYY-MM-DD)
+    end : str
+        Latest date to include (YYYY-MM-DD)
+    group_by : list
+        Fields sessions are grouped by: task, subject, date, session, or any header field (e.g. Protocol)
+    measures : list
+        Values to compute for each group
+    cache : str
+        Folder for cached values and results. Defaults to .cache/query in the root folder.
+    output : str
+        CSV or JSON file to save the results to
+    processes : int
+        Number of sessions read in parallel (defaults to the number of CPUs)
+    """
+    root: Optional[str] = None
+    tasks: List[str] = []
+    subjects: List[str] = []
+    start: Optional[str] = None
+    end: Optional[str] = None
+    group_by: List[str] = msgspec.field(default_factory=lambda: ["subject", "date"])
+    measures: List[Measure] = []
+    cache: Optional[str] = None
+    output: Optional[str] = None
+    processes: Optional[int] = None
+
+
+def load_config(path: str) -> QueryConfig:
+    """Loads a QueryConfig from a TOML file resolving any relative paths against the folder containing it."""
+    with open(path, "rb") as f:
+        config = msgspec.toml.decode(f.read(), type=QueryConfig)
+    folder = os.path.dirname(os.path.abspath(path))
+    if config.root is None:
+        config.root = os.path.join(os.path.expanduser('~'), 'Desktop', 'py-behav')
+    for field in ("root", "cache", "output"):
+        value = getattr(config, field)
+        if value:
+            setattr(config, field, os.path.join(folder, os.path.expanduser(value)))
+    return config
+
+
+class SessionFile(msgspec.Struct, array_like=True):
+    """A session found in the data tree with the size and modification time used to detect changes."""
+    path: str
+    task: str
+    subject: str
+    date: str
+    size: int
+    mtime_ns: int
+
+
+class CachedValue(msgspec.Struct, array_like=True):
+    size: int
+    mtime_ns: int
+    value: Any
+
+
+class CachedResult(msgspec.Struct):
+    fingerprint: str
+    rows: List[Dict[str, Any]]
+
+
+def parse_date(folder: str) -> str:
+    try:
+        return datetime.strptime(folder, DATE_FORMAT).strftime("%Y-%m-%d")
+    except ValueError:
+        return folder
+
+
+def scan(config: QueryConfig) -> List[SessionFile]:
+    """Finds every session in the data tree that matches the tasks, subjects and dates in the query."""
+    sessions = []
+    tasks = config.tasks or sorted(name for name in os.listdir(config.root)
+                                   if os.path.isdir(os.path.join(config.root, name, "Data")))
+    for task in tasks:
+        data = os.path.join(config.root, task, "Data")
+        if not os.path.isdir(data):
+            continue
+        for subject in config.subjects or sorted(os.listdir(data)):
+            subject_folder = os.path.join(data, subject)
+            if not os.path.isdir(subject_folder):
+                continue
+            for folder in sorted(os.listdir(subject_folder)):
+                date = parse_date(folder)
+                if (config.start is not None and date < config.start) or (config.end is not None and date > config.end):
+                    continue
+                date_folder = os.path.join(subject_folder, folder)
+                if not os.path.isdir(date_folder):
+                    continue
+                with os.scandir(date_folder) as entries:
+                    for entry in entries:
+                        # Segmented sessions are included once they are stitched together with pybehave --recover
+                        if entry.name.endswith(".csv") and entry.is_file() and SEGMENT_PATTERN.match(entry.name) is None:
+                            stat = entry.stat()
+                            sessions.append(SessionFile(entry.path, task, subject, date, stat.st_size,
+                                                        stat.st_mtime_ns))
+    sessions.sort(key=lambda session: session.path)
+    return sessions
+
+
+def extract(session: CSVSession, measure: Measure) -> Any:
+    """Returns the value of a measure for a single session."""
+    if measure.extract == "count":
+        return len(session.select(measure.type, measure.state))
+    elif measure.extract == "duration":
+        return float(session.table["time"].max()) if len(session) > 0 else 0.0
+    elif measure.extract == "metadata":
+        return [entry.get(measure.key) for entry in session.metadata(session.events(measure.type, measure.state))]
+    elif measure.extract == "latency":
+        starts = session.events(measure.type, measure.state)["time"]
+        ends = np.sort(session.events(measure.to_type, measure.to_state)["time"])
+        # Each latency ends at the first matching event before the next start
+        following = np.searchsorted(ends, starts, side="left")
+        valid = following < len(ends)
+        next_start = np.append(starts[1:], np.inf)
+        latencies = ends[following[valid]] - starts[valid]
+        return latencies[ends[following[valid]] < next_start[valid]].tolist()
+    raise ValueError("Unknown extract '{}' for measure {}".format(measure.extract, measure.name))
+
+
+def extract_session(args) -> (str, Dict[str, Any], Optional[str]):
+    path, measures = args
+    try:
+        with CSVSession(path, save_index=False) as session:
+            return path, {key: session.info if measure is None else extract(session, measure)
+                          for key, measure in measures}, None
+    except Exception as e:
+        return path, {}, "{}: {}".format(type(e).__name__, e)
+
+
+def aggregate(values: List[Any], measure: Measure) -> Any:
+    """Combines the values from every session in a group."""
+    flat = []
+    for value in values:
+        if isinstance(value, list):
+            flat.extend(v for v in value if v is not None)
+        elif value is not None:
+            flat.append(value)
+    if measure.aggregate == "count":
+        return len(flat)
+    elif measure.aggregate == "fraction":
+        return sum(value == measure.value for value in flat) / len(flat) if len(flat) > 0 else None
+    numbers = [value for value in flat if isinstance(value, (int, float))]
+    if measure.aggregate == "histogram":
+        return np.histogram(numbers, measure.bins or 10)[0].tolist()
+    if len(numbers) == 0:
+        return None
+    if measure.aggregate == "mean":
+        return statistics.fmean(numbers)
+    elif measure.aggregate == "median":
+        return statistics.median(numbers)
+    elif measure.aggregate == "std":
+        return statistics.stdev(numbers) if len(numbers) > 1 else 0.0
+    elif measure.aggregate == "min":
+        return min(numbers)
+    elif measure.aggregate == "max":
+        return max(numbers)
+    elif measure.aggregate == "sum":
+        return sum(numbers)
+    elif measure.aggregate == "percentiles":
+        return dict(zip(("p{}".format(p) for p in PERCENTILES), np.percentile(numbers, PERCENTILES).tolist()))
+    raise ValueError("Unknown aggregate '{}' for measure {}".format(measure.aggregate, measure.name))
+
+
+class SessionQuery:
+    """
+    Computes measures across every session in a py-behav data tree and aggregates them by group. Sessions are read in
+    parallel across a pool of processes. The values of each measure are cached for every session by its size and
+    modification time so only new or changed sessions are read again, and the results of each query are cached until
+    any session it includes changes.
+
+    Parameters
+    ----------
+    config : QueryConfig
+        The query to run
+    """
+
+    def __init__(self, config: QueryConfig):
+        self.config = config
+        self.cache = config.cache or os.path.join(config.root, ".cache", "query")
+        self.errors = {}  # Sessions that could not be read and the reason
+        self.info = {}  # Header of each session
+        self.rows = []
+
+    def cache_path(self, *parts: str) -> str:
+        return os.path.join(self.cache, *parts)
+
+    def load(self, path: str, decode_type: type) -> Any:
+        try:
+            with open(path, "rb") as f:
+                return msgspec.msgpack.decode(f.read(), type=decode_type)
+        except (OSError, msgspec.DecodeError):
+            return None
+
+    def save(self, path: str, obj: Any) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp = "{}.{}.tmp".format(path, os.getpid())
+        with open(temp, "wb") as f:
+            f.write(msgspec.msgpack.encode(obj))
+        os.replace(temp, path)  # Readers never see a partially written cache
+
+    def run(self) -> List[Dict[str, Any]]:
+        start = time.perf_counter()
+        sessions = scan(self.config)
+        files = [(session.path, session.size, session.mtime_ns) for session in sessions]
+        fingerprint = hashlib.sha1(msgspec.msgpack.encode([self.config.group_by, self.config.measures, files,
+                                                           CACHE_VERSION])).hexdigest()
+        query_key = hashlib.sha1(msgspec.msgpack.encode([self.config.root, self.config.tasks, self.config.subjects,
+                                                         self.config.start, self.config.end, self.config.group_by,
+                                                         self.config.measures])).hexdigest()[:16]
+        cached = self.load(self.cache_path("queries", query_key + ".msgpack"), CachedResult)
+        if cached is not None and cached.fingerprint == fingerprint:
+            self.rows = cached.rows
+            return self.rows
+        values = self.session_values(sessions)
+        self.rows = self.group(sessions, values)
+        self.save(self.cache_path("queries", query_key + ".msgpack"), CachedResult(fingerprint, self.rows))
+        print("Queried {} sessions in {:.2f}s".format(len(sessions), time.perf_counter() - start))
+        return self.rows
+
+    def session_values(self, sessions: List[SessionFile]) -> Dict[str, Dict[str, Any]]:
+        """Returns the value of every measure for each session, reading only sessions that are not cached."""
+        measures = {measure.cache_key(): measure for measure in self.config.measures}
+        measures[INFO_KEY] = None
+        caches = {key: self.load(self.cache_path("measures", key + ".msgpack"), Dict[str, CachedValue]) or {}
+                  for key in measures}
+        stale = {}
+        for session in sessions:
+            for key, cache in caches.items():
+                entry = cache.get(session.path)
+                if entry is None or entry.size != session.size or entry.mtime_ns != session.mtime_ns:
+                    stale.setdefault(session.path, []).append((key, measures[key]))
+        if len(stale) > 0:
+            info = {session.path: session for session in sessions}
+            with multiprocessing.Pool(self.config.processes) as pool:
+                for path, results, error in pool.imap_unordered(extract_session, stale.items(), chunksize=8):
+                    if error is not None:
+                        self.errors[path] = error
+                        print("Could not read {}: {}".format(path, error))
+                        continue
+                    for key, value in results.items():
+                        caches[key][path] = CachedValue(info[path].size, info[path].mtime_ns, value)
+            scanned = set(info)
+            for key, cache in caches.items():
+                # Sessions outside this query are kept for other queries unless they no longer exist
+                self.save(self.cache_path("measures", key + ".msgpack"),
+                          {path: value for path, value in cache.items() if path in scanned or os.path.exists(path)})
+        values = {}
+        for session in sessions:
+            if session.path not in self.errors:
+                self.info[session.path] = caches[INFO_KEY][session.path].value
+                # Measures that only differ in how they are aggregated share the same extracted values
+                values[session.path] = {measure.name: caches[measure.cache_key()][session.path].value
+                                        for measure in self.config.measures}
+        return values
+
+    def group(self, sessions: List[SessionFile], values: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+        groups = {}
+        for session in sessions:
+            if session.path not in values:
+                continue
+            fields = {"task": session.task, "subject": session.subject, "date": session.date, "session": session.path}
+            fields.update((key, value) for key, value in self.info[session.path].items() if key not in fields)
+            key = tuple(str(fields.get(field, "")) for field in self.config.group_by)
+            groups.setdefault(key, []).append(values[session.path])
+        rows = []
+        for key in sorted(groups):
+            row = dict(zip(self.config.group_by, key))
+            row["sessions"] = len(groups[key])
+            for measure in self.config.measures:
+                row[measure.name] = aggregate([session[measure.name] for session in groups[key]], measure)
+            rows.append(row)
+        return rows
+
+    def save_output(self, path: str) -> None:
+        if path.endswith(".json"):
+            with open(path, "wb") as f:
+                f.write(msgspec.json.format(msgspec.json.encode(self.rows)))
+            return
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            fields = self.config.group_by + ["sessions"] + [measure.name for measure in self.config.measures]
+            writer.writerow(fields)
+            for row in self.rows:
+                writer.writerow([msgspec.json.encode(row[field]).decode() if isinstance(row[field], (dict, list))
+                                 else row[field] for field in fields])
+
+
+def print_rows(rows: List[Dict[str, Any]]) -> None:
+    if len(rows) == 0:
+        print("No sessions found")
+        return
+    fields = list(rows[0])
+    text = [[str(row[field]) if not isinstance(row[field], float) else "{:.4g}".format(row[field]) for field in fields]
+            for row in rows]
+    widths = [max(len(field), *(len(line[i]) for line in text)) for i, field in enumerate(fields)]
+    print("  ".join(field.ljust(width) for field, width in zip(fields, widths)))
+    for line in text:
+        print("  ".join(value.ljust(width) for value, width in zip(line, widths)))
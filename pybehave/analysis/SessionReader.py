@@ -0,0 +1,280 @@
+from __future__ import annotations
+
+import csv
+import mmap
+import os
+from typing import Dict, Iterable, List, Optional, Union
+
+import msgspec
+import numpy as np
+
+from pybehave.Events.CSVEventLogger import FOOTER_MARKER
+from pybehave.Events.MetadataSerializer import create_serializer
+
+INDEX_VERSION = 2
+TABLE_HEADER = b"Trial,Time,Type,Code,State,Metadata"
+# Fields of each event returned by CSVSession.events
+EVENT_DTYPE = np.dtype([("trial", "<i8"), ("time", "<f8"), ("type", "<u2"), ("name", "<u4"), ("code", "<f8"),
+                        ("offset", "<u8"), ("length", "<u4")])
+
+
+class SessionIndex(msgspec.Struct, array_like=True):
+    """
+    Sidecar index for a CSVEventLogger file. The file size and modification time identify the version of the file the
+    index was built from. Columns are little-endian arrays with one entry per event. Events of each type and name are
+    listed in type_order and name_order with the positions in those arrays where each type or name starts in
+    type_starts and name_starts.
+    """
+    version: int
+    size: int
+    mtime_ns: int
+    info: Dict[str, str]
+    constants: Dict[str, str]
+    types: List[str]
+    names: List[str]
+    events: bytes
+    type_order: bytes
+    type_starts: bytes
+    name_order: bytes
+    name_starts: bytes
+
+
+def index_path(path: str) -> str:
+    """Returns the path of the sidecar index for a session."""
+    return os.path.splitext(path)[0] + "_index.msgpack"
+
+
+def parse_header(header: bytes) -> (Dict[str, str], Dict[str, str]):
+    info = {}
+    constants = {}
+    section = info
+    for row in csv.reader(header.decode().splitlines()):
+        if len(row) == 0:
+            continue
+        if row[0] == "SubjectConfiguration":
+            section = constants
+        elif len(row) > 1:
+            section[row[0]] = row[1]
+    return info, constants
+
+
+def postings(column: np.ndarray, count: int) -> (np.ndarray, np.ndarray):
+    """Returns the rows sorted by value and the position in that order where each value starts."""
+    order = np.argsort(column, kind="stable").astype("<u8")
+    starts = np.searchsorted(column[order], np.arange(count + 1)).astype("<u8")
+    return order, starts
+
+
+def split_row(row: bytes) -> List[bytes]:
+    """Splits the text of an event into its trial, time, type, code, name and metadata."""
+    trial, time, event_type, rest = row.rstrip(b"\r").split(b",", 3)
+    # Codes may contain commas but names do not so the name is the field before the quoted metadata
+    i = rest.find(b',"')
+    if i < 0 or not rest.endswith(b'"'):
+        raise ValueError("Event has no quoted metadata")
+    code, _, name = rest[:i].rpartition(b",")
+    return [trial, time, event_type, code, name, rest[i + 2:-1]]
+
+
+def build_index(mm: mmap.mmap, size: int, mtime_ns: int) -> SessionIndex:
+    """Parses a session once to find the location and key fields of every event."""
+    start = mm.find(TABLE_HEADER)
+    if start < 0:
+        raise ValueError("File does not contain a pybehave event table")
+    info, constants = parse_header(mm[:start])
+    start = mm.find(b"\n", start) + 1
+    # Segments end with a blank line followed by a footer
+    end = mm.find(b"\n" + FOOTER_MARKER.encode(), start)
+    if end < 0:
+        end = size
+    elif mm[end - 1:end] == b"\r":
+        end -= 1
+    buffer = np.frombuffer(mm, dtype=np.uint8, count=end - start, offset=start)
+    newlines = np.flatnonzero(buffer == 10)
+    # Quoted metadata can span several lines (repr of NumPy arrays) so rows only end at newlines outside quotes
+    quotes = np.flatnonzero(buffer == 34)
+    ends = newlines[np.searchsorted(quotes, newlines) % 2 == 0] + start  # Any partially written final event is excluded
+    starts = np.empty_like(ends)
+    starts[:1] = start
+    starts[1:] = ends[:-1] + 1
+    events = np.zeros(len(ends), dtype=EVENT_DTYPE)
+    events["offset"] = starts
+    events["length"] = ends - starts
+    types = {}
+    names = {}
+    trial = events["trial"]
+    times = events["time"]
+    type_ids = events["type"]
+    name_ids = events["name"]
+    codes = events["code"]
+    for i, (s, e) in enumerate(zip(starts.tolist(), ends.tolist())):
+        try:
+            trial_text, time_text, type_text, code_text, name_text, _ = split_row(mm[s:e])
+            trial[i] = int(trial_text)
+            times[i] = float(time_text)
+        except ValueError:
+            raise ValueError("Event {} at byte {} could not be parsed: {!r}".format(i + 1, s, mm[s:min(e, s + 80)]))
+        type_ids[i] = types.setdefault(type_text, len(types))
+        name_ids[i] = names.setdefault(name_text, len(names))
+        try:
+            codes[i] = float(code_text)
+        except ValueError:
+            codes[i] = np.nan
+    type_order, type_starts = postings(type_ids, len(types))
+    name_order, name_starts = postings(name_ids, len(names))
+    return SessionIndex(INDEX_VERSION, size, mtime_ns, info, constants, [t.decode() for t in types],
+                        [n.decode() for n in names], events.tobytes(), type_order.tobytes(), type_starts.tobytes(),
+                        name_order.tobytes(), name_starts.tobytes())
+
+
+class CSVSession:
+    """
+    Session saved by a CSVEventLogger that is memory-mapped rather than read into memory. The trial, time, type, name and
+    code of every event are loaded from a sidecar index that is built the first time the session is opened and rebuilt
+    whenever the file changes. Metadata and the text of each event are only read from the file when requested.
+
+    Parameters
+    ----------
+    path : str
+        Path to the CSV file
+    index : str
+        Path to the sidecar index (defaults to the file name followed by _index.msgpack)
+    save_index : bool
+        False if the index should not be saved (for example if the folder is read-only)
+
+    Attributes
+    ----------
+    info : dict
+        Header values (Version, MetadataFormat, Subject, Task, Chamber, Protocol and AddressFile)
+    constants : dict
+        Code for any constants that were changed from the protocol before the session started
+    types : np.ndarray
+        Event type names indexed by the type field of each event
+    names : np.ndarray
+        State and component names indexed by the name field of each event
+    table : np.ndarray
+        Structured array of every event with the fields trial, time, type, name, code (NaN if not numeric), and the
+        offset and length in bytes of the event in the file
+    """
+
+    def __init__(self, path: str, index: str = None, save_index: bool = True):
+        self.path = path
+        self.file = open(path, "rb")
+        stat = os.fstat(self.file.fileno())
+        if stat.st_size == 0:
+            raise ValueError("{} is empty".format(path))
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.index_path = index or index_path(path)
+        session_index = self.load_index(stat.st_size, stat.st_mtime_ns)
+        if session_index is None:
+            session_index = build_index(self.mm, stat.st_size, stat.st_mtime_ns)
+            if save_index:
+                try:
+                    with open(self.index_path, "wb") as f:
+                        f.write(msgspec.msgpack.encode(session_index))
+                except OSError:
+                    pass  # The session can still be used without saving its index
+        self.info = session_index.info
+        self.constants = session_index.constants
+        self.types = np.array(session_index.types, dtype=object)
+        self.names = np.array(session_index.names, dtype=object)
+        self.table = np.frombuffer(session_index.events, dtype=EVENT_DTYPE)
+        self.type_order = np.frombuffer(session_index.type_order, dtype="<u8")
+        self.type_starts = np.frombuffer(session_index.type_starts, dtype="<u8")
+        self.name_order = np.frombuffer(session_index.name_order, dtype="<u8")
+        self.name_starts = np.frombuffer(session_index.name_starts, dtype="<u8")
+        self.serializer = create_serializer(self.info.get("MetadataFormat", "repr"))
+
+    def load_index(self, size: int, mtime_ns: int) -> Optional[SessionIndex]:
+        try:
+            with open(self.index_path, "rb") as f:
+                session_index = msgspec.msgpack.decode(f.read(), type=SessionIndex)
+        except (OSError, msgspec.DecodeError):
+            return None
+        if session_index.version != INDEX_VERSION or session_index.size != size or session_index.mtime_ns != mtime_ns:
+            return None
+        return session_index
+
+    def close(self) -> None:
+        self.table = None
+        self.mm.close()
+        self.file.close()
+
+    def __enter__(self) -> CSVSession:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def rows_for(self, values: Union[str, Iterable[str]], lookup: np.ndarray, order: np.ndarray,
+                 starts: np.ndarray) -> np.ndarray:
+        values = {values} if isinstance(values, str) else set(values)
+        ids = [i for i, value in enumerate(lookup) if value in values]
+        if len(ids) == 1:
+            return order[starts[ids[0]]:starts[ids[0] + 1]]
+        return np.sort(np.concatenate([order[starts[i]:starts[i + 1]] for i in ids] + [np.empty(0, dtype="<u8")]))
+
+    def select(self, type: Union[str, Iterable[str]] = None, name: Union[str, Iterable[str]] = None,
+               start: float = None, end: float = None) -> np.ndarray:
+        """Returns the rows of events with any of the given types and names that occurred between start and end."""
+        rows = None
+        if type is not None:
+            rows = self.rows_for(type, self.types, self.type_order, self.type_starts)
+        if name is not None:
+            name_rows = self.rows_for(name, self.names, self.name_order, self.name_starts)
+            rows = name_rows if rows is None else np.intersect1d(rows, name_rows, assume_unique=True)
+        if rows is None:
+            rows = np.arange(len(self.table), dtype="<u8")
+        if start is not None or end is not None:
+            times = self.table["time"][rows]
+            mask = np.ones(len(rows), dtype=bool)
+            if start is not None:
+                mask &= times >= start
+            if end is not None:
+                mask &= times < end
+            rows = rows[mask]
+        return rows
+
+    def events(self, type: Union[str, Iterable[str]] = None, name: Union[str, Iterable[str]] = None,
+               start: float = None, end: float = None) -> np.ndarray:
+        """
+        Returns every event with any of the given types and names that occurred between start and end seconds as a
+        structured array with the same fields as table.
+        """
+        return self.table[self.select(type, name, start, end)]
+
+    def type_names(self, events: np.ndarray) -> np.ndarray:
+        return self.types[events["type"]]
+
+    def state_names(self, events: np.ndarray) -> np.ndarray:
+        return self.names[events["name"]]
+
+    def text(self, events: np.ndarray) -> List[str]:
+        """Returns the row of the CSV file for each event."""
+        return [self.mm[o:o + n].decode().rstrip("\r") for o, n in zip(events["offset"].tolist(), events["length"].tolist())]
+
+    def metadata(self, events: np.ndarray) -> List[Dict]:
+        """Decodes the metadata of each event from the file."""
+        metadata = []
+        for o, n in zip(events["offset"].tolist(), events["length"].tolist()):
+            field = split_row(self.mm[o:o + n])[5]
+            metadata.append(self.serializer.decode(field.decode().replace('""', '"')))
+        return metadata
+
+    def trial_starts(self, name: str, type: str = "StateEnterEvent") -> np.ndarray:
+        """Returns the rows that begin each trial where trials start with every event of the given type and name."""
+        return self.select(type, name)
+
+    def trial(self, n: int, name: str, type: str = "StateEnterEvent") -> np.ndarray:
+        """Returns every event from the start of the nth trial (from 0) until the start of the next."""
+        starts = self.trial_starts(name, type)
+        end = starts[n + 1] if n + 1 < len(starts) else len(self.table)
+        return self.table[int(starts[n]):int(end)]
+
+
+def open_session(path: str, index: str = None, save_index: bool = True) -> CSVSession:
+    """Opens a session saved by a CSVEventLogger for analysis."""
+    return CSVSession(path, index, save_index)
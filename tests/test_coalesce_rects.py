@@ -0,0 +1,41 @@
+from pybehave.Utilities.coalesce_rects import coalesce_rects
+
+
+def test_disjoint_rects_are_kept():
+    rects = [(0, 0, 10, 10), (20, 0, 10, 10), (0, 20, 10, 10)]
+    assert sorted(coalesce_rects(rects)) == sorted(rects)
+
+
+def test_touching_edges_are_not_merged():
+    assert sorted(coalesce_rects([(0, 0, 10, 10), (10, 0, 10, 10)])) == [(0, 0, 10, 10), (10, 0, 10, 10)]
+
+
+def test_overlapping_rects_are_merged():
+    assert coalesce_rects([(0, 0, 10, 10), (5, 5, 10, 10)]) == [(0, 0, 15, 15)]
+
+
+def test_duplicates_and_contained_rects_are_merged():
+    assert coalesce_rects([(0, 0, 100, 100), (10, 10, 5, 5), (0, 0, 100, 100), (20, 20, 0, 0)]) == [(0, 0, 100, 100)]
+
+
+def test_union_that_overlaps_an_earlier_rect_is_merged_again():
+    # The last rect only overlaps the tall one but their union also covers the small rect to the right
+    rects = [(0, 0, 10, 30), (20, 0, 10, 10), (5, 20, 20, 5)]
+    assert coalesce_rects(rects) == [(0, 0, 30, 30)]
+
+
+def test_chambers_on_a_grid_merge_into_the_full_window():
+    chambers = [(col * 100, row * 100, 100, 100) for row in range(4) for col in range(4)]
+    elements = [(col * 100 + 10, row * 100 + 10, 20, 20) for row in range(4) for col in range(4)]
+    merged = coalesce_rects(chambers + elements)
+    assert sorted(merged) == sorted(chambers)
+
+
+def test_accepts_rect_like_sequences():
+    class Rect(list):
+        pass
+    assert coalesce_rects([Rect([0, 0, 4, 4]), [2, 2, 4, 4]]) == [(0, 0, 6, 6)]
+
+
+def test_empty():
+    assert coalesce_rects([]) == []